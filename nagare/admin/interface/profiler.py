@@ -0,0 +1,73 @@
+#--
+# Copyright (c) 2008-2013 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+#--
+
+"""Requests profiling administration view
+"""
+
+from __future__ import with_statement
+
+from nagare import presentation, profiler
+
+NB_ROWS = 20  # Number of the slowest views and of the latest requests to display
+
+
+class Admin(object):
+    priority = 200        # Order of the default view, into the administrative interface
+
+    def __init__(self, apps):
+        """Initialization
+
+        In:
+          - ``apps`` -- list of tuples (application, application name, application urls)
+        """
+        pass
+
+
+@presentation.render_for(Admin)
+def render(self, h, *args):
+    """Display the timings of the latest profiled requests
+    """
+    profiles = profiler.get_profiles()
+    if not profiles:
+        return h.div(
+                     h.h2('Profiling'),
+                     h.p('No profiled requests. Set the ', h.code('wsgi_pipe'), ' option of an application to ', h.code('nagare.profiler:create_pipe'))
+                    )
+
+    steps, renders = profiler.stats(profiles)
+
+    with h.div:
+        h << h.h2('Profiling')
+        h << h.p('%d latest requests - ' % len(profiles), h.a('Refresh').action(lambda: None))
+
+        with h.table:
+            with h.tr:
+                h << h.th('Step') << h.th('Number') << h.th('Mean (ms)') << h.th('Max (ms)')
+
+            for (name, (nb, total, maximum)) in sorted(steps.items(), key=lambda step: -step[1][1]):
+                with h.tr:
+                    h << h.td(name) << h.td(nb) << h.td('%.2f' % (total * 1000 / nb)) << h.td('%.2f' % (maximum * 1000))
+
+        h << h.h3('Slowest views')
+
+        with h.table:
+            with h.tr:
+                h << h.th('Class') << h.th('View') << h.th('Number') << h.th('Total (ms)')
+
+            for ((cls, model), (nb, total)) in sorted(renders.items(), key=lambda render: -render[1][1])[:NB_ROWS]:
+                with h.tr:
+                    h << h.td(cls) << h.td(model or '') << h.td(nb) << h.td('%.2f' % (total * 1000))
+
+        h << h.h3('Latest requests')
+
+        with h.ul:
+            for profile in reversed(profiles[-NB_ROWS:]):
+                h << h.li(str(profile))
+
+    return h.root
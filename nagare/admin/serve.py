@@ -17,7 +17,7 @@ import os
 import pkg_resources
 import configobj
 
-from nagare import config, log
+from nagare import config, log, comet
 from nagare.admin import reloader, util, reference, command
 
 # ---------------------------------------------------------------------------
@@ -35,6 +35,11 @@ publisher_options_spec = {
         activated='boolean(default=False)',  # No automatic reload
         interval='integer(default=1)',
     ),
+
+    'comet': dict(
+        backend='option("local", "unix", default="local")',  # The comet messages are only sent to the current process
+        socket='string(default="")'  # Path of the unix socket of the comet broker
+    ),
 }
 
 # ---------------------------------------------------------------------------
@@ -202,6 +207,13 @@ def run(parser, options, args):
     else:
         watcher = None
 
+    # The backend of the comet channels
+    if pconf['comet']['backend'] == 'unix':
+        if not pconf['comet']['socket']:
+            parser.error('No unix socket path given for the comet broker')
+
+        comet.channels.set_backend(comet.UnixSocketBackend(pconf['comet']['socket']))
+
     # Load the publisher
     publishers = dict([(entry.name, entry) for entry in pkg_resources.iter_entry_points('nagare.publishers')])
     t = pconf['publisher']['type']
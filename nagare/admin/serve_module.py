@@ -106,7 +106,7 @@ def run(parser, options, args):
 
     wsgi_pipe = debugged_app(app) if options.debug else app
     publisher.register_application(args[0], args[1], app, wsgi_pipe)
-    app.set_config('', {'application': {'redirect_after_post': False, 'name': args[1], 'always_html': True}}, None)
+    app.set_config('', {'application': {'redirect_after_post': False, 'name': args[1], 'always_html': True, 'streaming': False}}, None)
     app.set_publisher(publisher)
 
     # Always use the standalone session manager (in memory sessions)
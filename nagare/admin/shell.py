@@ -25,7 +25,7 @@ import os
 import code
 import pkg_resources
 
-from nagare import database, log, local
+from nagare import database, log, local, comet
 from nagare.admin import util, reference, command
 
 
@@ -278,6 +278,7 @@ def set_batch_options(optparser):
     optparser.usage += ' <application> <file.py>'
 
     optparser.add_option('-d', '--debug', action='store_const', const=True, default=False, dest='debug', help='debug mode for the database engine')
+    optparser.add_option('--comet', action='store', type='string', dest='comet', help='path of the unix socket of the comet broker, to send messages to the comet channels of the publishers')
 
     if not sys.argv[3:]:
         return None
@@ -313,6 +314,9 @@ def batch(parser, options, args):
 
     del sys.argv[:i + 3]
 
+    if options.comet:
+        comet.channels.set_backend(comet.UnixSocketBackend(options.comet))
+
     ns = create_globals(args[:1], options.debug, parser.error)
     __builtin__.__dict__.update(ns)
 
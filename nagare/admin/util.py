@@ -28,6 +28,7 @@ application_options_spec = {
 
         redirect_after_post='boolean(default=False)',  # Follow the PRG pattern ?
         always_html='boolean(default=True)',  # Don't generate xhtml, even if it's a browser capability ?
+        streaming='boolean(default=False)',  # Send the pages chunk by chunk ?
         wsgi_pipe='string(default="")',  # Method to create the WSGI middlewares pipe
         static='string(default="$root/static")'  # Default directory of the static files
     ),
@@ -13,12 +13,13 @@ import types
 import inspect
 import compiler
 import cStringIO
+import json
 import re
 
 import peak.rules
 import pyjs
 
-from nagare import presentation, namespaces, serializer, security, partial
+from nagare import namespaces, serializer, security, partial
 
 YUI_INTERNAL_PREFIX = '/static/nagare/yui/build'
 YUI_EXTERNAL_PREFIX = 'http://yui.yahooapis.com/2.9.0/build'
@@ -45,28 +46,47 @@ class ViewToJs(object):
         self.output = output
 
 
-def serialize_body(view_to_js, content_type, doctype):
-    """Wrap a view body into a javascript code
+def serialize_updates(views_to_js, content_type, doctype):
+    """Serialize the updates of the DOM elements into a JSON response
+
+    The response is a JSON object with:
+
+      - ``updates`` -- list of the ``{id, js, html}`` updates: the javascript
+        function ``js`` is called, on the client, with the id of the DOM
+        element and its new HTML
+      - ``head`` -- the assets of the ``<head>`` to load on the client
 
     In:
-      - ``view_to_js`` -- the view
+      - ``views_to_js`` -- list of the ``ViewToJs`` views
       - ``content_type`` -- the rendered content type
       - ``doctype`` -- the (optional) doctype
-      - ``declaration`` -- is the XML declaration to be outputed?
 
     Return:
-      - Javascript to evaluate on the client
+      - a tuple ('text/plain', JSON response)
     """
-    # Get the HTML or XHTML of the view
-    body = serializer.serialize(view_to_js.output, content_type, doctype, False)[1]
+    updates = [
+                {
+                    'id': view_to_js.id,
+                    'js': view_to_js.js,
+                    'html': serializer.serialize(view_to_js.output, content_type, doctype, False)[1]
+                } for view_to_js in views_to_js if view_to_js.output is not None
+              ]
+
+    if not updates:
+        return ('text/plain', '')
 
-    # Wrap it into a javascript code
-    return "%s('%s', %s)" % (view_to_js.js, view_to_js.id.encode('utf-8'), py2js(body, view_to_js.renderer))
+    # The non ASCII characters are escaped: only the C encoder of the ``json``
+    # module is used
+    response = json.dumps({'updates': updates, 'head': views_to_js[0].renderer.head.get_assets()})
+
+    # Sent as text, not as ``application/json``, to be readable into the
+    # iframe of the files uploads
+    return ('text/plain', response)
 
 
 @peak.rules.when(serializer.serialize, (ViewToJs,))
 def serialize(self, content_type, doctype, declaration):
-    """Wrap a view into a javascript code
+    """Serialize a view into a JSON response
 
     In:
       - ``content_type`` -- the rendered content type
@@ -74,16 +94,9 @@ def serialize(self, content_type, doctype, declaration):
       - ``declaration`` -- is the XML declaration to be outputed?
 
     Return:
-      - a tuple ('text/plain', Javascript to evaluate on the client)
+      - a tuple ('text/plain', JSON response)
     """
-    if self.output is None:
-        return ('text/plain', '')
-
-    # Get the javascript for the header
-    head = presentation.render(self.renderer.head, self.renderer, None, None)
-
-    # Wrap the body and the header into a javascript code
-    return ('text/plain', serialize_body(self, content_type, doctype) + '; ' + head)
+    return serialize_updates([self], content_type, doctype)
 
 
 def javascript_dependencies(renderer):
@@ -250,7 +263,7 @@ class ViewsToJs(list):
 
 @peak.rules.when(serializer.serialize, (ViewsToJs,))
 def serialize(self, content_type, doctype, declaration):
-    """Wrap a view into a javascript code
+    """Serialize the views into a single JSON response
 
     In:
       - ``content_type`` -- the rendered content type
@@ -258,17 +271,9 @@ def serialize(self, content_type, doctype, declaration):
       - ``declaration`` -- is the XML declaration to be outputed?
 
     Return:
-      - a tuple ('text/plain', Javascript to evaluate on the client)
+      - a tuple ('text/plain', JSON response)
     """
-    bodies = [serialize_body(view_to_js, content_type, doctype) for view_to_js in self if view_to_js.output is not None]
-
-    if not bodies:
-        return ('text/plain', '')
-
-    # Get the javascript for the header
-    head = presentation.render(self[0].renderer.head, self[0].renderer, None, None)
-
-    return ('text/plain', '; '.join(bodies) + '; ' + head)
+    return serialize_updates(self, content_type, doctype)
 
 
 class Updates(Update):
@@ -397,8 +402,13 @@ class JS(object):
         Return:
           - javascript fragment of the call to the transcoded function
         """
-        renderer.head.javascript_url('/static/nagare/pyjslib.js')
-        renderer.head.javascript(self.name, self.javascript)
+        head = renderer.head
+        if not hasattr(head, 'javascript_url'):
+            # Attribute of a tag of the head renderer itself
+            head = renderer
+
+        head.javascript_url('/static/nagare/pyjslib.js')
+        head.javascript(self.name, self.javascript)
 
         return self.name + '(this)'
 
@@ -0,0 +1,220 @@
+#--
+# Copyright (c) 2008-2013 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+#--
+
+"""Cache of the rendered views
+
+A view decorated by ``cached()`` is rendered once for each value of its key
+and of its parameters (the model name), then a copy of the rendered tree is
+returned until the time to live of the fragment expires or the fragment is
+evicted.
+
+Only the views without side effects can be cached: a rendering registering
+callbacks (directly or by the components it renders) or adding contents to
+the ``<head>`` section is never cached.
+
+.. code-block:: python
+
+    @presentation.render_for(Menu)
+    @cache.cached(lambda self: self.lang, ttl=60)
+    def render(self, h, *args):
+        ...
+"""
+
+from __future__ import with_statement
+
+import copy
+import time
+import functools
+
+from lxml import etree as ET
+
+from nagare import callbacks
+from nagare.sessions import lru_dict
+
+DEFAULT_SIZE = 100
+
+_caches = []  # The caches created by ``cached()``
+
+
+def _copy(output, renderer):
+    """Deep copy of a rendered tree
+
+    In:
+      - ``output`` -- the rendered tree
+      - ``renderer`` -- the renderer to associate to the copied tags
+
+    Return:
+      - the copy of the tree
+    """
+    if isinstance(output, basestring):
+        return output
+
+    if isinstance(output, ET._Element):
+        clone = copy.deepcopy(output)
+        if renderer is not None:
+            clone._renderer = renderer
+        return clone
+
+    if isinstance(output, (list, tuple)):
+        return [_copy(child, renderer) for child in output]
+
+    raise TypeError("Can't cache the %r view" % output)
+
+
+def _head_state(renderer):
+    """Return the state of the ``<head>`` section of a rendering
+
+    In:
+      - ``renderer`` -- the renderer
+
+    Return:
+      - a value changing each time a content is added to the ``<head>``
+    """
+    head = getattr(renderer, 'head', None)
+    if head is None:
+        return None
+
+    return (getattr(head, '_order', None), len(head._stack[0]))
+
+
+class Cache(object):
+    """The rendered fragments of a view"""
+
+    def __init__(self, view, key, ttl=0, size=DEFAULT_SIZE):
+        """Initialization
+
+        In:
+          - ``view`` -- the view
+          - ``key`` -- function returning, from the rendered object, the key of the fragment
+          - ``ttl`` -- time to live of a fragment, in seconds (``0`` for no expiration)
+          - ``size`` -- maximum number of fragments
+        """
+        self.view = view
+        self.key = key
+        self.ttl = ttl
+        self.fragments = lru_dict.ThreadSafeLRUDict(size)
+
+        # The counters are updated under the lock of the fragments
+        self.lock = self.fragments.lock
+        self.nb_hits = self.nb_misses = self.nb_refused = 0
+
+    def count(self, counter):
+        """Increment a counter
+
+        In:
+          - ``counter`` -- name of the counter
+        """
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def render(self, o, renderer, comp, *args):
+        """Return the cached fragment of an object or render it
+
+        In:
+          - ``o`` -- the object
+          - ``renderer`` -- the renderer
+          - ``comp`` -- the component
+          - ``args`` -- the other parameters of the view
+
+        Return:
+          - the rendered tree
+        """
+        # The same view can render several models of an object
+        key = (self.key(o), args)
+
+        try:
+            expiration, fragment = self.fragments[key]
+        except TypeError:
+            # Unhashable parameters
+            self.count('nb_refused')
+            return self.view(o, renderer, comp, *args)
+        except KeyError:
+            pass
+        else:
+            if not self.ttl or (time.time() < expiration):
+                self.count('nb_hits')
+                return _copy(fragment, renderer)
+
+        self.count('nb_misses')
+
+        next_callback_id = callbacks.get_next_id()
+        head = _head_state(renderer)
+
+        output = self.view(o, renderer, comp, *args)
+
+        if (callbacks.get_next_id() != next_callback_id) or (_head_state(renderer) != head):
+            # The rendering has side effects
+            self.count('nb_refused')
+        else:
+            try:
+                self.fragments[key] = (time.time() + self.ttl, _copy(output, None))
+            except TypeError:
+                self.count('nb_refused')
+
+        return output
+
+    def stats(self):
+        """Statistics of the cache
+
+        Return:
+          - dictionary of the statistics
+        """
+        nb_fragments = len(self.fragments)
+
+        with self.lock:
+            nb_hits, nb_misses, nb_refused = self.nb_hits, self.nb_misses, self.nb_refused
+
+        nb = nb_hits + nb_misses
+
+        return {
+                'nb_fragments': nb_fragments,
+                'nb_hits': nb_hits,
+                'nb_misses': nb_misses,
+                'nb_refused': nb_refused,
+                'ratio': float(nb_hits) / nb if nb else 0.
+               }
+
+
+def cached(key, ttl=0, size=DEFAULT_SIZE):
+    """Decorator to cache the fragments rendered by a view
+
+    In:
+      - ``key`` -- function returning, from the rendered object, the key of the fragment
+      - ``ttl`` -- time to live of a fragment, in seconds (``0`` for no expiration)
+      - ``size`` -- maximum number of fragments
+
+    Return:
+      - a closure
+    """
+    def _(view):
+        cache = Cache(view, key, ttl, size)
+        _caches.append(cache)
+
+        @functools.wraps(view)
+        def render(self, renderer, comp, *args):
+            return cache.render(self, renderer, comp, *args)
+
+        render.cache = cache
+        return render
+
+    return _
+
+
+def stats():
+    """Statistics of all the views caches
+
+    Return:
+      - dictionary: "<module>.<function>:<line>" of the view -> statistics of its cache
+    """
+    return dict(
+                (
+                    '%s.%s:%d' % (cache.view.__module__, cache.view.__name__, cache.view.func_code.co_firstlineno),
+                    cache.stats()
+                ) for cache in _caches
+               )
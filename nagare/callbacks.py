@@ -8,11 +8,12 @@
 #--
 """Callbacks manager
 
-Manage the dictionary of the ids / callbacks associations
+Manage the tables of the ids / callbacks associations
 """
 
-import random
+import bisect
 
+from nagare import local, partial
 from nagare.continuation import Continuation
 
 
@@ -20,6 +21,179 @@ class CallbackLookupError(LookupError):
     pass
 
 
+def get_next_id():
+    """Return the id of the next callback to register
+
+    The callbacks ids of a session are allocated by a monotonic counter,
+    kept into the session, so they are never reused
+
+    Return:
+      - the next callback id
+    """
+    return getattr(local.request, 'next_callback_id', 0)
+
+
+def set_next_id(id_):
+    """Set the id of the next callback to register, for the current request
+
+    In:
+      - ``id_`` -- the next callback id
+    """
+    local.request.next_callback_id = id_
+
+
+def _action_key(f):
+    """Return the key identifying an action
+
+    The methods and the ``Partial`` wrappers without parameters are created
+    on the fly: a method is known by its object and its function
+
+    In:
+      - ``f`` -- the action
+
+    Return:
+      - the key
+    """
+    while isinstance(f, partial._Partial) and not f.args and not f.kw:
+        f = f.f
+
+    im_self = getattr(f, 'im_self', None)
+    return id(f) if im_self is None else (id(im_self), f.im_func)
+
+
+class Bucket(object):
+    """The callbacks registered by a view of a component
+
+    The ids of the callbacks, allocated in increasing order, are kept into a
+    sorted list and, for each id, the index of its action into the list of
+    the distinct actions. So a view with thousands of links to the same
+    actions is serialized as two lists of integers.
+    """
+    def __init__(self, model):
+        """Initialization
+
+        In:
+          - ``model`` -- name of the view (``None`` for the default view)
+        """
+        self.model = model
+        self.ids = []
+        self.indexes = []
+        self.actions = []  # The distinct (callback, with_request, render) actions
+        self._known = {}  # Transient dict: key of an action -> index of the action
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_known']
+
+        return state
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, id_, callback, with_request, render):
+        """Add a callback
+
+        In:
+          - ``id_`` -- id of the callback, greater than the ids already added
+          - ``callback`` -- the action function or method
+          - ``with_request`` -- will the request and response objects be passed to the action?
+          - ``render`` -- the render function or method
+        """
+        # The actions are kept so the objects ids into the keys are not reused
+        key = (_action_key(callback), with_request, id(render))
+
+        known = self.__dict__.setdefault('_known', {})
+        index = known.get(key)
+        if index is None:
+            index = known[key] = len(self.actions)
+            self.actions.append((callback, with_request, render))
+
+        self.ids.append(id_)
+        self.indexes.append(index)
+
+    def get(self, id_):
+        """Return the action of a callback
+
+        In:
+          - ``id_`` -- id of the callback
+
+        Return:
+          - the tuple (callback, with_request, render) or ``None``
+        """
+        i = bisect.bisect_left(self.ids, id_)
+        if (i == len(self.ids)) or (self.ids[i] != id_):
+            return None
+
+        return self.actions[self.indexes[i]]
+
+
+class Callbacks(object):
+    """The callbacks of a state, merged from the buckets of all the components
+
+    The ids ranges of the buckets are interleaved (a view is rendered in
+    the middle of the view of its parent component), so the bucket of an id
+    is found through a dictionary id -> bucket, built on the first lookup
+    """
+    def __init__(self, buckets=()):
+        """Initialization
+
+        In:
+          - ``buckets`` -- the buckets of callbacks
+        """
+        self.buckets = list(buckets)
+        self._index = None  # Dict: id -> bucket
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets)
+
+    def __iter__(self):
+        """Return the ids of the callbacks
+        """
+        return (id_ for bucket in self.buckets for id_ in bucket.ids)
+
+    def items(self):
+        """Return the (id, (model, callback, with_request, render)) callbacks
+        """
+        return [
+                    (id_, (bucket.model,) + bucket.actions[index])
+                    for bucket in self.buckets
+                    for (id_, index) in zip(bucket.ids, bucket.indexes)
+                ]
+
+    def __eq__(self, other):
+        return isinstance(other, Callbacks) and (dict(self.items()) == dict(other.items()))
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    def __getitem__(self, id_):
+        """Return a callback
+
+        In:
+          - ``id_`` -- id of the callback
+
+        Return:
+          - the tuple (model, callback, with_request, render)
+        """
+        index = self._index
+        if index is None:
+            index = self._index = {}
+            for bucket in self.buckets:
+                index.update(dict.fromkeys(bucket.ids, bucket))
+
+        bucket = index[id_]
+        return (bucket.model,) + bucket.get(id_)
+
+    def update(self, callbacks):
+        """Merge the buckets of a component
+
+        In:
+          - ``callbacks`` -- dictionary model -> bucket of the callbacks of a component
+        """
+        self.buckets.extend(callbacks.itervalues())
+        self._index = None
+
+
 def register(model, priority, callback, with_request, render, callbacks):
     """Register a callback
 
@@ -39,18 +213,23 @@ def register(model, priority, callback, with_request, render, callbacks):
       - ``render`` -- the render function or method
 
     Out:
-      - ``callbacks`` -- dictionary where the keys are the callback ids and the
-        values are tuples (callback, with_request, render)
+      - ``callbacks`` -- dictionary where the keys are the views names and the
+        values are the buckets of the callbacks registered by the views
 
     Return:
       - the callback identifier
     """
-    id_ = random.randint(10000000, 99999999)
+    id_ = get_next_id()
+    set_next_id(id_ + 1)
+
+    # Remember the action and the rendering function into the bucket of the view
+    bucket = callbacks.get(model)
+    if bucket is None:
+        bucket = callbacks[model] = Bucket(model)
 
-    # Remember the model, the action and the rendering function
-    callbacks[id_] = (model, callback, with_request, render)
+    bucket.add(id_, callback, with_request, render)
 
-    return '_action%d%08d' % (priority, id_)
+    return '_action%d%d' % (priority, id_)
 
 
 def clean(old, new):
@@ -60,87 +239,129 @@ def clean(old, new):
       - ``old`` -- the old registered callbacks
       - ``new`` -- the new registered callbacks
     """
-    # Retrieve all views which has registered new callbacks
-    models = set(callback[0] for callback in new.itervalues())
+    # The buckets of the views which have registered new callbacks are dropped
+    return dict((model, bucket) for (model, bucket) in old.iteritems() if model not in new)
+
+
+def has_actions(params):
+    """Are callback identifiers received?
+
+    In:
+      - ``params`` -- the request parameters
+
+    Return:
+      - a boolean
+    """
+    return any(
+                name.startswith('_action') or (isinstance(value, basestring) and value.startswith('_action'))
+                for (name, value) in params.iteritems()
+              )
 
-    # Keep only the old callbacks of a view if no new callbacks were registered
-    return dict((k, v) for k, v in old.iteritems() if v[0] not in models)
+
+def parse(params):
+    """Parse the callback identifiers received into a dispatch plan
+
+    The structure of a callback identifier is
+    '_action<priority on 1 char><key into the callbacks dictionary>[.x|.y]'
+
+    In:
+      - ``params`` -- the request parameters
+
+    Return:
+      - for each priority, the list of the [order, callback id, parameter name, value]
+        records, in the order the identifiers were received (a callback with
+        multiple values is ordered by its last value)
+    """
+    plan = ([], [], [], [], [], [])
+    records = {}  # Dict: callback identifier -> record
+    unordered = set()  # Priorities with callbacks received multiple times
+
+    for (name, value) in params.items():
+        if isinstance(value, basestring) and (value[:7] == '_action'):
+            # For the radio buttons, the callback identifier is the value,
+            # not the name
+            name = value
+        elif name[:7] != '_action':
+            continue
+
+        record = records.get(name)
+        if record is not None:
+            # Multiple values for the same callback are put into a tuple
+            v = record[3]
+            record[3] = (v if isinstance(v, tuple) else (v,)) + (value,)
+            record[0] = len(records)
+
+            unordered.add(int(name[7]))
+            continue
+
+        try:
+            bucket = plan[int(name[7])]
+            id_ = int(name[8:].partition('.')[0])
+        except (ValueError, IndexError):
+            raise CallbackLookupError(name[8:])
+
+        record = records[name] = [len(records), id_, name, value]
+        bucket.append(record)
+
+    for priority in unordered:
+        plan[priority].sort()
+
+    return plan
 
 
 def process(callbacks, request, response):
     """Call the actions associated to the callback identifiers received
 
     In:
-      - ``callbacks`` -- dictionary where the keys are the callback ids and the
-        values are tuples (callback, with_request, render)
+      - ``callbacks`` -- the callbacks of the state (``Callbacks`` object)
       - ``request`` -- the web request object
       - ``response`` -- the web response object
 
     Return:
       - the render function
     """
-    # The structure of a callback identifier is
-    # '_action<priority on 1 char><key into the callbacks dictionary>'
-    actions = {}
-
-    try:
-        for (name, value) in request.params.items():
-            if isinstance(value, basestring) and value.startswith('_action'):
-                # For the radio buttons, the callback identifier is the value,
-                # not the name
-                name = value
-
-            if name and name.startswith('_action'):
-                v = actions.get(name)
-                if v is not None:
-                    # Multiple values for the same callback are put into a tuple
-                    v = v[3]
-                    value = (v if isinstance(v, tuple) else (v,)) + (value,)
-
-                actions[name] = ((int(name[7]), len(actions)), int(name[8:16]), name, value)
-    except ValueError:
-        raise CallbackLookupError(name[8:])
+    plan = parse(request.params)
 
     render = None
-    callback_type = 0
 
-    for ((callback_type, _), name, param, value) in sorted(actions.values()):
-        try:
-            (model, f, with_request, render) = callbacks[name]
-        except KeyError:
-            raise CallbackLookupError(name)
+    for (callback_type, records) in enumerate(plan):
+        for (_, name, param, value) in records:
+            try:
+                (model, f, with_request, render) = callbacks[name]
+            except KeyError:
+                raise CallbackLookupError(name)
 
-        if f is None:
-            continue
+            if f is None:
+                continue
+
+            # ``callback_type``:
+            #
+            # 0 : <form>.pre_action
+            # 1 : action with value (<textarea>, checkbox ...)
+            # 2 : action without value (radio button)
+            # 3 : <form>.post_action
+            # 4 : action with continuation and without value (<a>, submit button ...)
+            # 5 : action with continuation and with value (special case for <input type='image'>)
 
-        # ``callback_type``:
-        #
-        # 0 : <form>.pre_action
-        # 1 : action with value (<textarea>, checkbox ...)
-        # 2 : action without value (radio button)
-        # 3 : <form>.post_action
-        # 4 : action with continuation and without value (<a>, submit button ...)
-        # 5 : action with continuation and with value (special case for <input type='image'>)
-
-        if with_request:
-            if callback_type == 1:
-                f(request, response, value)
-            elif callback_type == 4:
-                Continuation(f, request, response)
-            elif callback_type == 5:
-                if param.endswith(('.x', '.y')):
-                    Continuation(f, request, response, param.endswith('.y'), int(value))
-            else:  # 0, 2, 3
-                f(request, response)
-        else:
-            if callback_type == 1:
-                f(value)
-            elif callback_type == 4:
-                Continuation(f)
-            elif callback_type == 5:
-                if param.endswith(('.x', '.y')):
-                    Continuation(f, param.endswith('.y'), int(value))
-            else:  # 0, 2, 3
-                f()
+            if with_request:
+                if callback_type == 1:
+                    f(request, response, value)
+                elif callback_type == 4:
+                    Continuation(f, request, response)
+                elif callback_type == 5:
+                    if param.endswith(('.x', '.y')):
+                        Continuation(f, request, response, param.endswith('.y'), int(value))
+                else:  # 0, 2, 3
+                    f(request, response)
+            else:
+                if callback_type == 1:
+                    f(value)
+                elif callback_type == 4:
+                    Continuation(f)
+                elif callback_type == 5:
+                    if param.endswith(('.x', '.y')):
+                        Continuation(f, param.endswith('.y'), int(value))
+                else:  # 0, 2, 3
+                    f()
 
     return render
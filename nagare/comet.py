@@ -9,11 +9,30 @@
 
 """Comet-style channels i.e HTTP push channels
 
-This implementation is only working with a multi-threaded publisher
+This implementation is only working with a multi-threaded or an events based
+publisher.
+
+The waiting clients are parked into an engine. With ``epoll``, a single thread
+of the engine watches the sockets of all the waiting clients and forgets a
+client as soon as it's disconnected, without scanning the other clients. But
+each waiting client still holds a thread of a multi-threaded publisher.
+
+The eventlet publisher sets its own engine: a waiting client only holds a
+green thread and its disconnection is watched by the eventlet hub.
+
+The messages are sent to the channels through a backend. By default, only
+the channels of the current process receive them. With the
+``UnixSocketBackend``, they are published to a broker which forwards them to
+the channels of all the processes.
 """
 
 from __future__ import with_statement
 
+import os
+import errno
+import fcntl
+import socket
+import struct
 import threading
 import select
 
@@ -23,17 +42,18 @@ from nagare import presentation, ajax
 class Client(object):
     """A connected client"""
 
-    def __init__(self, fileno, response):
+    def __init__(self, fileno, response, event=None):
         """Initialization
 
         In:
           - ``fileno`` -- the I/O file handle
           - ``response`` -- ``webob`` response object
+          - ``event`` -- the event the client waits for (a ``threading.Event`` by default)
         """
         self._fileno = fileno
         self._response = response
 
-        self._event = threading.Event()
+        self._event = event or threading.Event()
 
     def block(self):
         self._event.wait()
@@ -57,11 +77,206 @@ class Client(object):
         if not self.is_blocked():
             self.release()
 
+# ----------------------------------------------------------------------------
+
+class SelectEngine(object):
+    """Engine scanning all the clients of a channel with ``select()``
+
+    Only for the platforms without ``epoll``: a scan is O(number of clients)
+    and ``select()`` is limited to ``FD_SETSIZE`` (generally 1024) file handles
+    """
+    create_event = staticmethod(threading.Event)  # Event a parked client waits for
+
+    def watch(self, channel, client):
+        """A client is waiting for a message
+
+        In:
+          - ``channel`` -- the channel
+          - ``client`` -- the client
+        """
+        pass
+
+    def unwatch(self, client):
+        """A client is no longer waiting
+
+        In:
+          - ``client`` -- the client
+        """
+        pass
+
+    def discard_disconnected_clients(self, channel):
+        """Forgot about the disconnected clients of a channel
+
+        In:
+          - ``channel`` -- the channel
+        """
+        with channel.lock:
+            if not channel.clients:
+                return
+
+            clients_to_discard = select.select(channel.clients, [], [], 0)[0]
+            channel.clients.difference_update(clients_to_discard)
+
+        for client in clients_to_discard:
+            client.release()
+
+
+class EpollEngine(SelectEngine):
+    """Engine watching the sockets of all the waiting clients with ``epoll``
+
+    A single thread receives the disconnection events, so the cost of a
+    disconnection doesn't depend on the number of waiting clients
+    """
+    def __init__(self):
+        self.clients = {}  # Dict: file handle -> (channel, client)
+        self.lock = threading.Lock()
+
+        self.poller = None
+        self.thread = None
+
+    def start(self):
+        """Start the thread of the engine
+        """
+        self.poller = select.epoll()
+
+        self.thread = threading.Thread(target=self.run, name='comet engine')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def watch(self, channel, client):
+        """A client is waiting for a message
+
+        In:
+          - ``channel`` -- the channel
+          - ``client`` -- the client
+        """
+        with self.lock:
+            if self.thread is None:
+                self.start()
+
+            self.clients[client.fileno()] = (channel, client)
+            self.poller.register(client.fileno(), select.EPOLLIN | select.EPOLLERR | select.EPOLLHUP)
+
+    def _unwatch(self, fileno):
+        """Stop to watch a file handle
+
+        In:
+          - ``fileno`` -- the file handle
+
+        Return:
+          - the tuple (channel, client) watched or ``None``
+        """
+        with self.lock:
+            watched = self.clients.pop(fileno, None)
+            if watched is not None:
+                try:
+                    self.poller.unregister(fileno)
+                except (IOError, OSError, ValueError):
+                    # The file handle is already closed
+                    pass
+
+        return watched
+
+    def unwatch(self, client):
+        """A client is no longer waiting
+
+        In:
+          - ``client`` -- the client
+        """
+        self._unwatch(client.fileno())
+
+    def discard_disconnected_clients(self, channel):
+        """The disconnected clients are discarded by the thread of the engine
+        """
+        pass
+
+    def run(self):
+        """Thread of the engine: discard the clients as soon as they are disconnected
+        """
+        while True:
+            try:
+                events = self.poller.poll()
+            except IOError:
+                # Interrupted system call
+                continue
+
+            for (fileno, event) in events:
+                watched = self._unwatch(fileno)
+                if watched is not None:
+                    (channel, client) = watched
+                    channel.discard(client)
+
+
+default_engine = EpollEngine() if hasattr(select, 'epoll') else SelectEngine()
+
+
+def set_default_engine(engine):
+    """Change the engine of the channels created without engine
+
+    In:
+      - ``engine`` -- the new engine
+    """
+    global default_engine
+    default_engine = engine
+
+# ----------------------------------------------------------------------------
+
+class History(object):
+    """The latest messages of a channel, into a fixed-size ring buffer
+
+    The messages are identified by their sending order, from 0
+    """
+    def __init__(self, size):
+        """Initialization
+
+        In:
+          - ``size`` -- maximum number of messages kept
+        """
+        self.size = size
+        self.nb = 0  # Number of messages appended i.e. identifier of the next message
+        self.messages = [None] * size
+
+    def append(self, msg):
+        """Add a message, dropping the oldest one if the buffer is full
+
+        In:
+          - ``msg`` -- the message
+        """
+        if self.size:
+            self.messages[self.nb % self.size] = msg
+
+        self.nb += 1
+
+    def first(self):
+        """Return the identifier of the oldest message kept
+        """
+        return max(self.nb - self.size, 0)
+
+    def get(self, nb, count=None):
+        """Return the messages from an identifier
+
+        In:
+          - ``nb`` -- identifier of the first wanted message (the oldest
+            message kept is the first one if this message is dropped)
+          - ``count`` -- maximum number of messages to return (all by default)
+
+        Return:
+          - list of the messages
+        """
+        start = max(nb, self.first())
+        end = self.nb if count is None else min(self.nb, start + count)
+
+        return [self.messages[i % self.size] for i in xrange(start, end)]
+
+    def __len__(self):
+        return self.nb - self.first()
+
+# ----------------------------------------------------------------------------
 
 class Channel(object):
     """A comet-style channel i.e XHR long polling channel"""
 
-    def __init__(self, id, js, history_size=0, poll_time=1000):
+    def __init__(self, id, js, history_size=0, poll_time=1000, engine=None):
         """Initialization
 
         In:
@@ -69,55 +284,81 @@ class Channel(object):
           - ``js`` -- the javascript function to call when a message is received
           - ``history_size`` -- number of messages kept on the server
           - ``poll_time`` -- time the brower waits, before to retry to reconnect, after an error occurs
+          - ``engine`` -- the engine where the clients wait (``default_engine`` by default)
         """
         self.id = id
         self.js = js
         self.poll_time = poll_time
+        self._engine = engine
 
         self.history_size = history_size
-        self.history_nb = 0
-        self.history = []
+        self.history = History(history_size)  # The messages, already encoded
 
         self.lock = threading.Lock()
         self.clients = set()
 
-    def connect(self, nb, fileno, response):
-        """A browser wants to be connected to this channel
+    @property
+    def engine(self):
+        """The engine of this channel, resolved when used so the engine set by
+        a publisher is used by the channels created before it
+        """
+        return self._engine or default_engine
+
+    def park(self, nb, fileno, response):
+        """A browser wants to be connected to this channel, without blocking
 
         In:
           - ``nb`` -- identifier of the next wanted message
           - ``fileno`` -- the I/O file handle
           - ``response`` -- ``webob`` response object
+
+        Return:
+          - the client, already released if a message was available
         """
-        client = Client(fileno, response)
+        client = Client(fileno, response, self.engine.create_event())
 
-        with self.lock:
-            self.discard_disconnected_clients()
+        self.discard_disconnected_clients()
 
+        with self.lock:
             # Is a msg already available to send ?
             (new_nb, msg) = self.get_old_msg(nb)
             if not msg:
                 self.clients.add(client)
+                self.engine.watch(self, client)
 
         if msg:
             # Msg found into the history
             # Send it directly
             self._send(client, new_nb, msg)
-        else:
-            # No msg found
-            # Wait for a new msg to be sent
-            client.block()
 
-    def discard_disconnected_clients(self):
-        """Forgot about the disconnected clients
+        return client
+
+    def connect(self, nb, fileno, response):
+        """A browser wants to be connected to this channel
+
+        In:
+          - ``nb`` -- identifier of the next wanted message
+          - ``fileno`` -- the I/O file handle
+          - ``response`` -- ``webob`` response object
         """
-        if self.clients:
-            clients_to_discard = select.select(self.clients, [], [], 0)[0]
+        # Wait for a new msg to be sent, if none was found into the history
+        self.park(nb, fileno, response).block()
 
-            for client in clients_to_discard:
-                client.release()
+    def discard(self, client):
+        """Forgot about a disconnected client
 
-            self.clients = self.clients - set(clients_to_discard)
+        In:
+          - ``client`` -- the client
+        """
+        with self.lock:
+            self.clients.discard(client)
+
+        client.release()
+
+    def discard_disconnected_clients(self):
+        """Forgot about the disconnected clients
+        """
+        self.engine.discard_disconnected_clients(self)
 
     def send(self, msg):
         """Send a message to all the connected clients
@@ -125,19 +366,22 @@ class Channel(object):
         In:
           - ``msg`` -- message to send
         """
+        msg = msg.encode('utf-8')
+
         with self.lock:
             # Keep the msg into the history
             self.history.append(msg)
 
-            if len(self.history) > self.history_size:
-                self.history.pop(0)
-                self.history_nb += 1
-
             clients, self.clients = self.clients, set()
+            nb = self.history.nb
+
+        # The raw message, built once for all the clients
+        msg = '%09d%s' % (nb, msg)
 
         # Send the msg to all the waiting clients
         for client in clients:
-            self._send(client, self.history_nb + len(self.history), msg)
+            self.engine.unwatch(client)
+            client.send(msg)
 
     def close(self):
         """Close a channel
@@ -147,6 +391,7 @@ class Channel(object):
 
         # Send a "Service Unavailable" status to all the connected clients
         for client in clients:
+            self.engine.unwatch(client)
             client.send(status=503)   # "Service Unavailable"
 
     def _send(self, client, nb, msg):
@@ -155,10 +400,10 @@ class Channel(object):
         In:
           - ``client`` -- client to send the message to
           - ``nb`` -- message id
-          - ``msg`` -- the message
+          - ``msg`` -- the encoded message
         """
         # The raw message sent contains the msg identifier and the data
-        client.send('%09d%s' % (nb, msg.encode('utf-8')))
+        client.send('%09d%s' % (nb, msg))
 
     def get_old_msg(self, nb):
         """Check if a message in the history is ready to be sent
@@ -171,14 +416,12 @@ class Channel(object):
             - identifier of the next msg to ask for
             - the msg if available or ``None``
         """
-        if nb >= self.history_nb + len(self.history):
+        # Return only one message
+        msgs = self.history.get(nb, 1)
+        if not msgs:
             return (None, None)
 
-        if nb < self.history_nb:
-            nb = self.history_nb
-
-        # Return only one message
-        return (nb + 1, self.history[nb - self.history_nb])
+        return (max(nb, self.history.first()) + 1, msgs[0])
 
     def __len__(self):
         return len(self.clients)
@@ -197,8 +440,8 @@ class TextChannel(Channel):
             - the msg if available or ``None``
         """
         # Concatenate all the available msgs
-        msgs = self.history[max(nb, self.history_nb) - self.history_nb:]
-        return (len(self.history) + self.history_nb, ''.join(msgs) if msgs else None)
+        msgs = self.history.get(nb)
+        return (self.history.nb, ''.join(msgs) if msgs else None)
 
 # ----------------------------------------------------------------------------
 
@@ -211,17 +454,306 @@ def render(self, h, *args):
 
 # ----------------------------------------------------------------------------
 
+class LocalBackend(object):
+    """The messages are only sent to the channels of the current process"""
+
+    multiprocess = False  # Are the messages received by the channels of all the processes?
+
+    def start(self, channels):
+        """Start to deliver the messages to channels
+
+        In:
+          - ``channels`` -- the channels manager
+        """
+        self.channels = channels
+
+    def check(self):
+        """Check the backend is ready into the current process
+        """
+        pass
+
+    def publish(self, id, msg):
+        """Send a message to a channel
+
+        In:
+          - ``id`` -- the channel identifier
+          - ``msg`` -- message to send
+        """
+        self.channels[id].send(msg)
+
+    def stop(self):
+        """Stop to deliver the messages
+        """
+        pass
+
+
+def _read_frame(f):
+    """Read a frame from a broker connection
+
+    In:
+      - ``f`` -- file of the connection
+
+    Return:
+      - the frame (``None`` if the connection is closed)
+    """
+    header = f.read(4)
+    if len(header) != 4:
+        return None
+
+    (size,) = struct.unpack('!I', header)
+    frame = f.read(size)
+
+    return frame if len(frame) == size else None
+
+
+class Broker(object):
+    """Forward the frames received from a process to all the connected processes
+    """
+    def __init__(self, listener):
+        """Initialization
+
+        In:
+          - ``listener`` -- the listening unix socket
+        """
+        self.listener = listener
+
+        self.connections = set()
+        self.lock = threading.Lock()
+        self.forward_lock = threading.Lock()  # Only one frame at a time is forwarded
+
+    def start(self):
+        """Start the thread of the broker
+        """
+        thread = threading.Thread(target=self.run, name='comet broker')
+        thread.daemon = True
+        thread.start()
+
+    def run(self):
+        """Accept the connections of the processes
+        """
+        while True:
+            connection = self.listener.accept()[0]
+
+            with self.lock:
+                self.connections.add(connection)
+
+            thread = threading.Thread(target=self.forward, args=(connection,), name='comet broker connection')
+            thread.daemon = True
+            thread.start()
+
+    def forward(self, connection):
+        """Forward the frames received from a process
+
+        In:
+          - ``connection`` -- connection of the process
+        """
+        f = connection.makefile('rb', 0)
+
+        try:
+            while True:
+                frame = _read_frame(f)
+                if frame is None:
+                    break
+
+                frame = struct.pack('!I', len(frame)) + frame
+
+                # The whole fan-out is serialized: all the processes receive
+                # the frames in the same order and the frames are never
+                # interleaved on a connection
+                with self.forward_lock:
+                    with self.lock:
+                        connections = list(self.connections)
+
+                    for c in connections:
+                        try:
+                            c.sendall(frame)
+                        except socket.error:
+                            pass
+        except socket.error:
+            pass
+        finally:
+            with self.lock:
+                self.connections.discard(connection)
+
+            connection.close()
+
+
+class UnixSocketBackend(LocalBackend):
+    """The messages are published to a broker, listening on a unix socket, which
+    forwards them to the channels of all the processes
+
+    The first process not finding a running broker starts it, into a thread.
+    As all the processes receive the messages in the same order, a channel must
+    be created into all the processes before messages are sent to it, so the
+    identifiers of the messages are the same everywhere.
+    """
+    multiprocess = True
+
+    def __init__(self, path):
+        """Initialization
+
+        In:
+          - ``path`` -- path of the unix socket of the broker
+        """
+        self.path = path
+
+        self.pid = None  # Process the connection to the broker was created into
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def start_broker(self):
+        """Start the broker into this process if no broker is running
+        """
+        with open(self.path + '.lock', 'w') as lock:
+            # Only one process at a time can elect itself as the broker
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                connection.connect(self.path)
+            except socket.error:
+                # No running broker
+                pass
+            else:
+                connection.close()
+                return
+
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            listener.bind(self.path)
+            listener.listen(128)
+
+            Broker(listener).start()
+
+    def connect(self):
+        """Connect to the broker, starting it if needed, and receive the messages into a thread
+        """
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.connect(self.path)
+        except socket.error, e:
+            if e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+                raise
+
+            self.start_broker()
+            connection.connect(self.path)
+
+        self.connection = connection
+        self.pid = os.getpid()
+
+        thread = threading.Thread(target=self.receive, args=(connection,), name='comet backend')
+        thread.daemon = True
+        thread.start()
+
+    def check(self):
+        """Connect to the broker if this process is not connected
+        """
+        with self.lock:
+            if self.pid != os.getpid():
+                # First use or new forked process
+                self.connect()
+
+    def receive(self, connection):
+        """Deliver the messages forwarded by the broker to the channels of this process
+
+        In:
+          - ``connection`` -- the connection to the broker
+        """
+        f = connection.makefile('rb', 0)
+
+        while True:
+            try:
+                frame = _read_frame(f)
+            except socket.error:
+                frame = None
+
+            if frame is None:
+                break
+
+            id, msg = frame.split('\0', 1)
+            channel = self.channels.get(id.decode('utf-8'))
+            if channel is not None:
+                channel.send(msg.decode('utf-8'))
+
+        with self.lock:
+            if self.connection is not connection:
+                # Backend stopped
+                return
+
+            self.connection = self.pid = None
+
+        # The broker is stopped, connect to the new one
+        try:
+            self.check()
+        except socket.error:
+            pass
+
+    def publish(self, id, msg):
+        """Send a message to a channel of all the processes
+
+        In:
+          - ``id`` -- the channel identifier
+          - ``msg`` -- message to send
+        """
+        frame = unicode(id).encode('utf-8') + '\0' + msg.encode('utf-8')
+        frame = struct.pack('!I', len(frame)) + frame
+
+        self.check()
+        with self.lock:
+            self.connection.sendall(frame)
+
+    def stop(self):
+        """Stop to receive the messages
+        """
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = self.pid = None
+
+
 class Channels(dict):
     """Channels manager
     """
     channel_factory = Channel
 
+    def __init__(self, backend=None):
+        """Initialization
+
+        In:
+          - ``backend`` -- the backend sending the messages (``LocalBackend`` by default)
+        """
+        super(Channels, self).__init__()
+        self.set_backend(backend or LocalBackend())
+
+    def set_backend(self, backend):
+        """Change the backend sending the messages
+
+        In:
+          - ``backend`` -- the new backend
+        """
+        old = getattr(self, 'backend', None)
+        if old is not None:
+            old.stop()
+
+        self.backend = backend
+        backend.start(self)
+
+    @property
+    def multiprocess(self):
+        """Are the messages received by the channels of all the processes?
+        """
+        return self.backend.multiprocess
+
     def create(self, id, *args, **kw):
         """Create a new channel
 
         In:
           - ``id`` -- the channel identifier
         """
+        self.backend.check()
+
         if id not in self:
             self[id] = self.channel_factory(id, *args, **kw)
 
@@ -234,6 +766,8 @@ class Channels(dict):
           - ``fileno`` -- the I/O file handle
           - ``response`` -- ``webob`` response object
         """
+        self.backend.check()
+
         channel = self.get(id)
 
         if channel is None:
@@ -254,7 +788,7 @@ class Channels(dict):
           - ``id`` -- the channel identifier
           - ``msg`` -- message to send
         """
-        self[id].send(msg)
+        self.backend.publish(id, msg)
 
     def has_clients(self, id):
         self.discard_disconnected_clients()
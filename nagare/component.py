@@ -14,11 +14,12 @@ replace and call a component. It's described in `ComponentModel`
 """
 
 import sys
+import time
 import types
 
 from peak.rules import when
 
-from nagare import presentation, callbacks, continuation, partial
+from nagare import presentation, callbacks, continuation, partial, profiler
 
 _marker = object()
 
@@ -242,6 +243,7 @@ class Component(object):
 @when(presentation.render, (Component, object, object, int))
 @when(presentation.render, (Component, object, object, types.NoneType))
 @when(presentation.render, (Component, object, object, str))
+@presentation.bypass_cache_for(Component)
 def render(self, renderer, comp, model):
     """Rendering of a ``Component``
 
@@ -259,7 +261,14 @@ def render(self, renderer, comp, model):
     if model == 0:
         model = self.model
 
-    output = presentation.render(self(), renderer, self, model)
+    profile = profiler.current()
+    if profile is None:
+        output = presentation.dispatch(self(), renderer, self, model)
+    else:
+        t0 = time.time()
+        output = presentation.dispatch(self(), renderer, self, model)
+        profile.add_render(self(), model, time.time() - t0)
+
     return renderer.end_rendering(output)
 
 
@@ -311,6 +320,7 @@ def render(self, renderer, comp, *args):
 
 @when(presentation.render, (types.FunctionType,))
 @when(presentation.render, (types.MethodType,))
+@presentation.bypass_cache_for(types.FunctionType, types.MethodType)
 def render(f, renderer, comp, *args):
     continuation.Continuation(f, comp)
     return comp.render(renderer.parent)
@@ -7,6 +7,10 @@
 # this distribution.
 #--
 
+from __future__ import with_statement
+
+import threading
+
 # -----------------------------------------------------------------------------
 
 # If the framework haven't the SQLAlchemy or Elixir packages installed,
@@ -77,6 +81,139 @@ query = session.query
 
 # -----------------------------------------------------------------------------
 
+class Transactions(object):
+    """Transactions of the requests, begun only when the database is used
+
+    The database session of a thread is created at the first database
+    access. So, in a request, the transaction is begun when the session is
+    created or, if the session of the thread already exists, at the
+    beginning of the request. A thread never touching the database costs
+    neither a session, nor a transaction, nor a connection checkout.
+
+    A transaction only checks out a connection at its first database
+    access, so the transactions are counted when their connection is
+    bound (``after_begin`` event), not when they are begun.
+    """
+    def __init__(self, session):
+        """Initialization
+
+        In:
+          - ``session`` -- the scoped database session
+        """
+        self.session = session
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.reset()
+
+        registry = getattr(session, 'registry', None)
+        if registry is not None:
+            registry.createfunc = self.create_session(registry.createfunc)
+
+        try:
+            from sqlalchemy import event, orm
+
+            event.listen(orm.Session, 'after_begin', self.after_begin)
+        except ImportError:
+            pass
+
+    def reset(self):
+        """Reset the counters
+        """
+        self.nb_requests = 0       # Number of requests
+        self.nb_transactions = 0   # Number of requests having used the database
+        self.nb_rollbacks = 0      # Number of transactions having used the database rolled back
+
+    def create_session(self, createfunc):
+        """Wrap the creation of the database sessions
+
+        In:
+          - ``createfunc`` -- the function creating a database session
+
+        Return:
+          - function creating a database session, in a transaction during a request
+        """
+        def _(*args, **kw):
+            session = createfunc(*args, **kw)
+            if getattr(self.local, 'in_request', False):
+                self.begin(session)
+
+            return session
+
+        return _
+
+    def begin(self, session):
+        """Begin the transaction of the current request
+
+        In:
+          - ``session`` -- the database session of the thread
+        """
+        session.begin()
+        self.local.transaction = True
+
+    def after_begin(self, session, transaction, connection):
+        """A connection is bound to a transaction: the database is used
+
+        In:
+          - ``session`` -- the database session
+          - ``transaction`` -- the transaction
+          - ``connection`` -- the connection
+        """
+        if getattr(self.local, 'transaction', False) and not self.local.used:
+            self.local.used = True
+
+            with self.lock:
+                self.nb_transactions += 1
+
+    def __enter__(self):
+        """A request begins
+        """
+        self.local.in_request = True
+        self.local.transaction = False
+        self.local.used = False
+
+        with self.lock:
+            self.nb_requests += 1
+
+        registry = getattr(self.session, 'registry', None)
+        if (registry is not None) and registry.has():
+            # The session of the thread already exists
+            self.begin(registry())
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """A request ends: commit or rollback its transaction, if begun
+        """
+        self.local.in_request = False
+
+        if self.local.transaction:
+            self.local.transaction = False
+
+            # The session is kept: the entities of the objects graphs kept
+            # unpickled by the sessions manager must stay attached to it
+            if exc_type is None:
+                self.session.commit()
+            else:
+                if self.local.used:
+                    with self.lock:
+                        self.nb_rollbacks += 1
+                self.session.rollback()
+
+    def stats(self):
+        """Statistics of the transactions
+
+        Return:
+          - dictionary of the statistics
+        """
+        return {
+                'nb_requests': self.nb_requests,
+                'nb_transactions': self.nb_transactions,
+                'nb_rollbacks': self.nb_rollbacks,
+                'ratio': float(self.nb_transactions) / self.nb_requests if self.nb_requests else 0.
+               }
+
+transactions = Transactions(session)
+
+# -----------------------------------------------------------------------------
+
 def entity_getstate(entity):
     """Return the state of an SQLAlchemy entity
 
@@ -239,6 +239,110 @@ class HeadRenderer(xhtml_base.HeadRenderer):
         """
         return [(url, attributes) for (url, (order, attributes)) in sorted(self._javascript_url.items(), key=operator.itemgetter(1))]
 
+    def get_assets_ids(self):
+        """Return the ids of the named css, css URLs, named javascripts and javascript URLs
+
+        The anonymous css and javascripts have no ids: they are not tracked
+
+        Return:
+          - frozenset of the (asset type, name or URL) ids
+        """
+        return frozenset(
+                         [('css', name) for name in self._named_css] +
+                         [('css_url', url) for url in self._css_url] +
+                         [('js', name) for name in self._named_javascript] +
+                         [('js_url', url) for url in self._javascript_url]
+                        )
+
+    def _get_assets(self):
+        """Return the tags to create for the css and javascript
+
+        Return:
+          - list of (tag name, text, attributes, keywords attributes)
+        """
+        return (
+                [('link', None, {'rel': 'stylesheet', 'type': 'text/css', 'href': url}, kw) for (url, kw) in self._get_css_url()] +
+                [('script', None, {'type': 'text/javascript', 'src': url}, kw) for (url, kw) in self._get_javascript_url()] +
+                [('style', css, {'type': 'text/css'}, kw) for (name, css, kw) in self._get_named_css()] +
+                [('script', js, {'type': 'text/javascript'}, kw) for (name, js, kw) in self._get_named_javascript()]
+               )
+
+    def _get_assets_tags(self):
+        """Create the tags of the css and javascript
+
+        The keywords attributes are set through ``add_attribute()``, which can
+        register new assets (i.e the javascript code of an ``ajax.JS``
+        attribute), so the tags are created again until no new assets are
+        registered
+
+        Return:
+          - list of the tags
+        """
+        while True:
+            assets = self.get_assets_ids()
+
+            tags = [
+                    getattr(self, tag)(*(() if text is None else (text,)), **dict(attributes, **kw))
+                    for (tag, text, attributes, kw) in self._get_assets()
+                   ]
+
+            if self.get_assets_ids() == assets:
+                return tags
+
+    def can_fill(self):
+        """Can ``fill()`` be used instead of the rendering of this renderer?
+
+        Only if this renderer is rendered by the default view of the head
+        renderers, i.e no other view or rule of ``presentation.render()``
+        applies to its class
+
+        Return:
+          - a boolean
+        """
+        return presentation.get_view(self.__class__, None) is _head_view
+
+    def fill(self, head, canonical_url=None):
+        """Add the content of the ``<head>`` section directly into a ``<head>`` tag
+
+        Same result than merging the view of this renderer into ``head`` but
+        the tags of the css and javascript are directly created into ``head``
+
+        In:
+          - ``head`` -- the ``<head>`` tag
+          - ``canonical_url`` -- URL of the canonical link to add if none was set
+        """
+        root = self.root
+
+        if isinstance(root, ET.ElementBase) and (root.tag == 'head'):
+            # If a ``<head>`` tag already exist, take its content
+            head.attrib.update(root.attrib)
+            root = root[:]
+        elif not isinstance(root, list):
+            root = [root]
+
+        # As when a ``<head>`` tag is merged, its leading text is dropped
+        while root and isinstance(root[0], basestring):
+            root = root[1:]
+
+        for child in root:
+            head.add_child(child)
+
+            if canonical_url and isinstance(child, ET._Element) and (child.tag == 'link') and (child.get('rel') == 'canonical'):
+                canonical_url = None
+
+        sub_element = ET.SubElement
+
+        assets = self._get_assets()
+        if any(kw for (tag, text, attributes, kw) in assets):
+            head.extend(self._get_assets_tags())
+        else:
+            # Only string attributes: no need to dispatch them
+            for (tag, text, attributes, kw) in assets:
+                sub_element(head, tag, attributes).text = text
+
+        if canonical_url:
+            sub_element(head, 'link', rel='canonical', href=canonical_url)
+
 
 @presentation.render_for(HeadRenderer)
 def render(self, h, *args):
@@ -262,14 +366,13 @@ def render(self, h, *args):
     else:
         head = self.head(head)
 
-    head.extend([self.link(rel='stylesheet', type='text/css', href=url, **attributes) for (url, attributes) in self._get_css_url()])
-    head.extend([self.script(type='text/javascript', src=url, **attributes) for (url, attributes) in self._get_javascript_url()])
-
-    head.extend([self.style(css, type='text/css', **attributes) for (name, css, attributes) in self._get_named_css()])
-    head.extend([self.script(js, type='text/javascript', **attributes) for (name, js, attributes) in self._get_named_javascript()])
+    head.extend(self._get_assets_tags())
 
     return head
 
+
+_head_view = presentation.lookup(HeadRenderer, None)  # The default view of the head renderers, reproduced by ``fill()``
+
 # ----------------------------------------------------------------------------------
 
 class _HTMLActionTag(xhtml_base._HTMLTag):
@@ -1184,6 +1287,8 @@ class AsyncHeadRenderer(HeadRenderer):
         self._anonymous_css = []         # CSS
         self._anonymous_javascript = []  # Javascript code
 
+        self.loaded_assets = frozenset()  # Ids of the assets already loaded by the browser, never sent again
+
     def _css(self, style):
         """Memorize an in-line anonymous css style
 
@@ -1229,6 +1334,46 @@ class AsyncHeadRenderer(HeadRenderer):
         """
         return [js for (order, js) in sorted(self._anonymous_javascript)]
 
+    def get_assets(self):
+        """Return the assets to load on the client, for a JSON response
+
+        Return:
+          - dictionary of the named css, anonymous css, css URLs, named
+            javascripts, anonymous javascripts and javascript URLs
+        """
+        return {
+                'named_css': self._get_named_css(),
+                'css': '\n'.join(self._get_anonymous_css()),
+                'css_urls': self._get_css_url(),
+                'named_js': self._get_named_javascript(),
+                'js': ';'.join(self._get_anonymous_javascript()),
+                'js_urls': self._get_javascript_url()
+               }
+
+    def _get_named_css(self):
+        """Return the in-line named css styles not already loaded by the browser
+        """
+        loaded = self.loaded_assets
+        return [css for css in super(AsyncHeadRenderer, self)._get_named_css() if ('css', css[0]) not in loaded]
+
+    def _get_css_url(self):
+        """Return the css URLs not already loaded by the browser
+        """
+        loaded = self.loaded_assets
+        return [url for url in super(AsyncHeadRenderer, self)._get_css_url() if ('css_url', url[0]) not in loaded]
+
+    def _get_named_javascript(self):
+        """Return the named javascript codes not already loaded by the browser
+        """
+        loaded = self.loaded_assets
+        return [js for js in super(AsyncHeadRenderer, self)._get_named_javascript() if ('js', js[0]) not in loaded]
+
+    def _get_javascript_url(self):
+        """Return the javascript URLs not already loaded by the browser
+        """
+        loaded = self.loaded_assets
+        return [url for url in super(AsyncHeadRenderer, self)._get_javascript_url() if ('js_url', url[0]) not in loaded]
+
 
 @presentation.render_for(AsyncHeadRenderer)
 def render(self, h, *args):
@@ -66,6 +66,36 @@ class _HTMLTag(xml._Tag):
 
         return ET.tostring(self.decorate_error(), encoding=encoding, method='html', **kw)
 
+    def write_xmlchunks(self, encoding='utf-8', pipeline=True, chunk_size=xml.CHUNK_SIZE, **kw):
+        """Serialize in XML, chunk by chunk, the tree beginning at this tag
+
+        In:
+          - ``encoding`` -- encoding of the XML
+          - ``pipeline`` -- if False, the ``meld:id`` attributes are deleted
+          - ``chunk_size`` -- minimum size of the chunks
+
+        Return:
+          - generator of the XML chunks
+        """
+        return xml._Tag.write_xmlchunks(self.decorate_error(), encoding, pipeline, chunk_size, **kw)
+
+    def write_htmlchunks(self, encoding='utf-8', pipeline=True, chunk_size=xml.CHUNK_SIZE, **kw):
+        """Serialize in XHTML, chunk by chunk, the tree beginning at this tag
+
+        In:
+          - ``encoding`` -- encoding of the XML
+          - ``pipeline`` -- if False, the ``meld:id`` attributes are deleted
+          - ``chunk_size`` -- minimum size of the chunks
+
+        Return:
+          - generator of the XHTML chunks
+        """
+        if not pipeline:
+            for element in self.xpath('.//*[@meld:id]', namespaces={'meld': xml._MELD_NS}):
+                del element.attrib[xml._MELD_ID]
+
+        return xml.iterwrite(self.decorate_error(), 'html', encoding, chunk_size, **kw)
+
     def error(self, err):
         """Mark this tag as erroneous
 
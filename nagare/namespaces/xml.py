@@ -28,6 +28,95 @@ CHECK_ATTRIBUTES = False
 _MELD_NS = 'http://www.plope.com/software/meld3'
 _MELD_ID = '{%s}id' % _MELD_NS
 
+# Size of the chunks of a streamed serialization
+CHUNK_SIZE = 64 * 1024
+# An element with more descendants is serialized incrementally, else at once
+STREAMED_SIZE = 256
+
+_count_descendants = ET.XPath('count(descendant::*)')
+
+# ---------------------------------------------------------------------------
+
+class _Chunks(object):
+    """A write-only file collecting the serialized chunks"""
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+
+    def pop(self):
+        """Return and forget the collected chunks
+        """
+        data = ''.join(self.chunks)
+
+        self.chunks = []
+        self.size = 0
+
+        return data
+
+
+def iterwrite(element, method='xml', encoding='utf-8', chunk_size=CHUNK_SIZE, xml_declaration=False, doctype=None, pretty_print=False):
+    """Incremental serialization of a tree
+
+    The elements with more than ``STREAMED_SIZE`` descendants are opened and
+    closed by an incremental writer, the others are serialized at once. So the
+    serialization of a big tree never lives entirely in memory.
+
+    In:
+      - ``element`` -- the root of the tree
+      - ``method`` -- ``'xml'`` or ``'html'``
+      - ``encoding`` -- encoding of the serialization
+      - ``chunk_size`` -- minimum size of the generated chunks (the last one excepted)
+      - ``xml_declaration`` -- is the XML declaration to be generated?
+      - ``doctype`` -- the (optional) doctype
+      - ``pretty_print`` -- pretty print the elements serialized at once?
+
+    Return:
+      - generator of the serialized chunks
+    """
+    f = _Chunks()
+
+    with (ET.htmlfile if method == 'html' else ET.xmlfile)(f, encoding=encoding, buffered=False) as xf:
+        if xml_declaration:
+            xf.write_declaration()
+
+        if doctype:
+            xf.write_doctype(doctype)
+
+        # Stack of (opened element, its writer context, iterator on its children)
+        stack = [(None, None, iter((element,)))]
+        while stack:
+            parent, context, children = stack[-1]
+
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+
+                if context is not None:
+                    context.__exit__(None, None, None)
+                    if parent.tail and (parent is not element):
+                        xf.write(parent.tail)
+                continue
+
+            if isinstance(child.tag, basestring) and (_count_descendants(child) > STREAMED_SIZE):
+                context = xf.element(child.tag, dict(child.attrib), child.nsmap if child is element else None)
+                context.__enter__()
+
+                if child.text:
+                    xf.write(child.text)
+
+                stack.append((child, context, iter(child)))
+            else:
+                xf.write(child, with_tail=child is not element, pretty_print=pretty_print)
+
+            if f.size >= chunk_size:
+                yield f.pop()
+
+    yield f.pop()
+
 # ---------------------------------------------------------------------------
 
 class _Tag(ET.ElementBase):
@@ -68,6 +157,23 @@ class _Tag(ET.ElementBase):
 
         return ET.tostring(self, encoding=encoding, method='xml', **kw)
 
+    def write_xmlchunks(self, encoding='utf-8', pipeline=True, chunk_size=CHUNK_SIZE, **kw):
+        """Serialize in XML, chunk by chunk, the tree beginning at this tag
+
+        In:
+          - ``encoding`` -- encoding of the XML
+          - ``pipeline`` -- if False, the ``meld:id`` attributes are deleted
+          - ``chunk_size`` -- minimum size of the chunks
+
+        Return:
+          - generator of the XML chunks
+        """
+        if not pipeline:
+            for element in self.xpath('.//*[@meld:id]', namespaces={'meld': _MELD_NS}):
+                del element.attrib[_MELD_ID]
+
+        return iterwrite(self, 'xml', encoding, chunk_size, **kw)
+
     def xpath(self, *args, **kw):
         """Override ``xpath()`` to associate a renderer to all the returned nodes
         """
@@ -10,15 +10,28 @@
 """Generic methods to associate views and URLs to objects"""
 
 import types
+import inspect
 
 from peak.rules import when
 from webob.exc import HTTPNotFound
 
+try:
+    from peak.rules.core import rules_for
+except ImportError:
+    rules_for = None
+
 
 class ModelError(LookupError):
     pass
 
 
+_views = {}  # Dict: class -> dict: name of the view -> view registered with ``render_for()``
+_cache = {}  # Dict: (class, name of the view) -> view (``None`` for the generic dispatch)
+
+_rules = set()  # The implementations of the rules of ``render()``
+_declared_rules = {}  # Dict: implementation of a rule of ``render()`` -> classes it bypasses the cache for
+
+
 def render(self, renderer, comp, model):
     """Generic method to associate views to an object
 
@@ -54,13 +67,183 @@ def render_for(cls, model=None):
         # No name give, dispatch only on the arguments type
         cond = (cls, object, object, types.NoneType)
 
-    return when(render, cond)
+    def _(view):
+        _views.setdefault(cls, {})[model] = view
+        _declared_rules[view] = ()
+        _cache.clear()
+
+        return when(render, cond)(view)
+
+    return _
+
+
+def bypass_cache_for(*classes):
+    """Decorator to declare the classes of objects a rule added directly to
+    ``render()`` (with ``when()``, ``around()``...) can be applied to
+
+    The objects of these classes, or of their subclasses, are always rendered
+    by the ``render()`` generic function, not from the views cache. A rule
+    added to ``render()`` without this declaration disables the views cache.
+
+    Use it under the ``when()`` decorators:
+
+    .. code-block:: python
+
+        @when(presentation.render, (MyClass, object, object, str))
+        @presentation.bypass_cache_for(MyClass)
+        def render(self, renderer, comp, model):
+            ...
+
+    In:
+      - ``classes`` -- the classes
+
+    Return:
+      - a closure
+    """
+    def _(rule):
+        _declared_rules[rule] = classes
+        _cache.clear()
+
+        return rule
+
+    return _
+
+
+class _RulesListener(object):
+    """Keep track of the rules of ``render()`` to invalidate the views cache"""
+
+    def actions_changed(self, added, removed):
+        """Rules are added to or removed from ``render()``
+
+        In:
+          - ``added`` -- the added rules
+          - ``removed`` -- the removed rules
+        """
+        _rules.difference_update(_rule_body(rule) for rule in removed)
+        _rules.update(_rule_body(rule) for rule in added)
+        _cache.clear()
+
+
+def _rule_body(rule):
+    """Return the implementation of a rule
+
+    In:
+      - ``rule`` -- the rule, or the (signature, action) tuple, notified by PEAK-Rules
+
+    Return:
+      - the implementation (``None`` if not found)
+    """
+    body = getattr(rule, 'body', None)
+    if (body is None) and isinstance(rule, tuple) and rule:
+        body = getattr(rule[-1], 'body', None)
+
+    return body
+
+
+def _bypassed_classes():
+    """Return the classes whose objects are rendered without the views cache
+
+    Return:
+      - tuple of the classes (``None`` if the cache can't be used at all)
+    """
+    if rules_for is None:
+        # The rules of ``render()`` can't be known
+        return None
+
+    classes = []
+    for rule in _rules:
+        declared = _declared_rules.get(rule)
+        if declared is None:
+            # Rule not declared: it can be applied to any object
+            return None
+
+        classes.extend(declared)
+
+    return tuple(classes)
+
+
+def lookup(cls, model):
+    """Return the view registered with ``render_for()`` for a class of objects
+
+    In:
+      - ``cls`` -- the class
+      - ``model`` -- the name of the view
+
+    Return:
+      - the view of the nearest class in the MRO of ``cls`` or ``None``
+    """
+    for base in inspect.getmro(cls):
+        view = _views.get(base, {}).get(model)
+        if view is not None:
+            return view
+
+    return None
+
+
+def get_view(cls, model):
+    """Return the view, from the cache, of a class of objects
+
+    In:
+      - ``cls`` -- the class
+      - ``model`` -- the name of the view
+
+    Return:
+      - the view registered with ``render_for()`` or ``None`` if the objects
+        of ``cls`` must be rendered by the ``render()`` generic method
+    """
+    if isinstance(model, int):
+        # Same as the ``render()`` rule for the integer names
+        model = None
+
+    key = (cls, model)
+    try:
+        view = _cache[key]
+    except KeyError:
+        bypassed = _bypassed_classes()
+        if (bypassed is None) or issubclass(cls, bypassed):
+            view = None
+        else:
+            view = lookup(cls, model)
+
+        _cache[key] = view
+    except TypeError:
+        # Unhashable name of view
+        view = None
+
+    return view
+
+
+def dispatch(self, renderer, comp, model):
+    """Render an object, with a cache of the views
+
+    The views registered with ``render_for()`` are cached by class and name of
+    view, the other objects are rendered by the ``render()`` generic method.
+
+    The cache is cleared each time a rule of ``render()`` is added or removed
+    and it's only used when all the other rules of ``render()`` are declared
+    with ``bypass_cache_for()``, so the generic method semantic is kept
+
+    In:
+      - ``self`` -- the object
+      - ``renderer`` -- the renderer
+      - ``comp`` -- the component
+      - ``model`` -- the name of the view
+
+    Return:
+      - the view of the object
+    """
+    return (get_view(self.__class__, model) or render)(self, renderer, comp, model)
 
 
 @when(render, (object, object, object, int))
+@bypass_cache_for()  # The integer names are resolved by ``dispatch()``
 def render(self, renderer, comp, model):
     return render(self, renderer, comp, None)
 
+
+if rules_for is not None:
+    rules_for(render).subscribe(_RulesListener())
+
 # ---------------------------------------------------------------------------
 
 def init(self, url, comp, http_method, request):
@@ -0,0 +1,303 @@
+#--
+# Copyright (c) 2008-2013 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+#--
+
+"""Profiling of the requests processing
+
+When a ``Profile`` object is found into ``environ['nagare.profile']``, the
+``WSGIApp`` measures the time spent into each step of the request: session
+fetch and unpickling, callbacks processing, rendering of each component,
+``<html>`` wrapping, serialization, state pickling and storing.
+
+The ``Profiler`` WSGI middleware creates these objects, sends the timings
+into a ``Server-Timing`` response header and / or a log line and keeps the
+latest profiles for the administrative interface. To activate it, set the
+``wsgi_pipe`` option of the ``[application]`` section to
+``nagare.profiler:create_pipe``.
+
+Without ``Profile`` object, the cost of the instrumentation is only a test
+per step.
+"""
+
+from __future__ import with_statement
+
+import time
+import logging
+import threading
+import collections
+
+import configobj
+
+from nagare import local, log, config
+
+DEFAULT_HISTORY = 100
+
+
+class _NullTimer(object):
+    """Timer used when the current request is not profiled"""
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+_null_timer = _NullTimer()
+
+
+class _Timer(object):
+    """Measure the time spent into a step"""
+    def __init__(self, profile, name):
+        """Initialization
+
+        In:
+          - ``profile`` -- the profile of the current request
+          - ``name`` -- name of the step
+        """
+        self.profile = profile
+        self.name = name
+        self.t0 = None
+
+    def __enter__(self):
+        self.t0 = time.time()
+
+    def __exit__(self, *args):
+        self.profile.add(self.name, time.time() - self.t0)
+
+
+class Profile(object):
+    """The timings of a request"""
+
+    def __init__(self, url=''):
+        """Initialization
+
+        In:
+          - ``url`` -- URL of the request
+        """
+        self.url = url
+        self.start = time.time()
+        self.duration = None
+
+        self.steps = []  # List of the (step name, time) in the order of their end
+        self.renders = {}  # Dict: (class name, view name) -> [number of renderings, total time]
+
+    def add(self, name, t):
+        """Add the time of a step
+
+        In:
+          - ``name`` -- name of the step
+          - ``t`` -- time spent, in seconds
+        """
+        self.steps.append((name, t))
+
+    def add_render(self, o, model, t):
+        """Add the time of a view rendering
+
+        In:
+          - ``o`` -- the rendered object
+          - ``model`` -- name of the view
+          - ``t`` -- time spent, in seconds, including the rendering of the
+            inner components
+        """
+        if isinstance(model, int):
+            model = None  # The default view
+
+        cls = o.__class__
+        key = ('%s.%s' % (cls.__module__, cls.__name__), model)
+
+        render = self.renders.get(key)
+        if render is None:
+            self.renders[key] = [1, t]
+        else:
+            render[0] += 1
+            render[1] += t
+
+    def timer(self, name):
+        """Return a context manager measuring a step
+
+        In:
+          - ``name`` -- name of the step
+        """
+        return _Timer(self, name)
+
+    def end(self):
+        """The request is processed"""
+        self.duration = time.time() - self.start
+
+    def server_timing(self):
+        """Return the timings as the value of a ``Server-Timing`` header
+        """
+        timings = ['%s;dur=%.2f' % (name.replace(' ', '-'), t * 1000) for (name, t) in self.steps]
+        if self.duration is not None:
+            timings.append('total;dur=%.2f' % (self.duration * 1000))
+
+        return ', '.join(timings)
+
+    def __str__(self):
+        steps = ', '.join('%s=%.2fms' % (name, t * 1000) for (name, t) in self.steps)
+        return '%s %.2fms (%s)' % (self.url, (self.duration or 0) * 1000, steps)
+
+
+def current():
+    """Return the profile of the current request
+
+    Return:
+      - the ``Profile`` object or ``None`` if the request is not profiled
+    """
+    return getattr(local.request, 'profile', None)
+
+
+def timer(name):
+    """Return a context manager measuring a step of the current request
+
+    In:
+      - ``name`` -- name of the step
+    """
+    profile = current()
+    return _null_timer if profile is None else profile.timer(name)
+
+# ---------------------------------------------------------------------------
+
+class Profiler(object):
+    """WSGI middleware profiling the requests of an application"""
+
+    def __init__(self, app, header=True, log_level=None, history=DEFAULT_HISTORY):
+        """Initialization
+
+        In:
+          - ``app`` -- the wrapped WSGI application
+          - ``header`` -- send the timings into a ``Server-Timing`` header?
+          - ``log_level`` -- level of the log line of the timings (``None`` for no log)
+          - ``history`` -- number of the latest profiles to keep
+        """
+        self.app = app
+        self.header = header
+        self.log_level = log_level
+
+        self.profiles = collections.deque(maxlen=history)
+        self.lock = threading.Lock()
+
+        _profilers.append(self)
+
+    def __call__(self, environ, start_response):
+        """WSGI interface
+
+        In:
+          - ``environ`` -- dictionary of the received elements
+          - ``start_response`` -- callback to send the headers to the browser
+
+        Return:
+          - the content to send back to the browser
+        """
+        profile = environ['nagare.profile'] = Profile(environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', ''))
+
+        def _start_response(status, headers, *args):
+            # The response is sent when the request is processed
+            profile.end()
+
+            if self.header:
+                headers = headers + [('Server-Timing', profile.server_timing())]
+
+            return start_response(status, headers, *args)
+
+        response = self.app(environ, _start_response)
+
+        if profile.duration is None:
+            profile.end()
+
+        if self.log_level is not None:
+            log.get_logger('nagare.profiler').log(self.log_level, str(profile))
+
+        with self.lock:
+            self.profiles.append(profile)
+
+        return response
+
+    def get_profiles(self):
+        """Return the latest profiles
+
+        Return:
+          - list of the ``Profile`` objects
+        """
+        with self.lock:
+            return list(self.profiles)
+
+
+_profilers = []  # The created profiling middlewares
+
+
+def get_profiles():
+    """Return the latest profiles of all the profiled applications
+
+    Return:
+      - list of the ``Profile`` objects
+    """
+    return sorted((profile for profiler in _profilers for profile in profiler.get_profiles()), key=lambda profile: profile.start)
+
+
+def stats(profiles):
+    """Aggregate the timings of profiles
+
+    In:
+      - ``profiles`` -- list of ``Profile`` objects
+
+    Return:
+      - tuple (dictionary: step name -> (number, total time, maximum time),
+        dictionary: (class name, view name) -> (number, total time))
+    """
+    steps = {}
+    renders = {}
+
+    for profile in profiles:
+        for (name, t) in profile.steps:
+            nb, total, maximum = steps.get(name, (0, 0., 0.))
+            steps[name] = (nb + 1, total + t, max(maximum, t))
+
+        for (key, (nb, t)) in profile.renders.items():
+            nb2, total = renders.get(key, (0, 0.))
+            renders[key] = (nb + nb2, total + t)
+
+    return steps, renders
+
+# ---------------------------------------------------------------------------
+
+profiler_spec = {
+                 'profiler': {
+                              'header': 'boolean(default=True)',
+                              'log_level': 'string(default="")',
+                              'history': 'integer(default=%d)' % DEFAULT_HISTORY
+                             }
+                }
+
+
+def create_pipe(app, options, config_filename, conf, error):
+    """Wrap an application into the ``Profiler`` middleware
+
+    To use as the ``wsgi_pipe`` option of the ``[application]`` section. The
+    middleware is configured by the optional ``[profiler]`` section.
+
+    In:
+      - ``app`` -- the application
+      - ``options`` -- options in the command line
+      - ``config_filename`` -- the path to the configuration file
+      - ``conf`` -- the ``ConfigObj`` object, created from the configuration file
+      - ``error`` -- the function to call in case of configuration errors
+
+    Return:
+      - the wsgi pipe
+    """
+    conf = configobj.ConfigObj(conf, configspec=configobj.ConfigObj(profiler_spec))
+    config.validate(config_filename, conf, error)
+
+    conf = conf['profiler']
+    log_level = conf['log_level']
+    if log_level:
+        log_level = logging.getLevelName(log_level.upper())
+        if not isinstance(log_level, int):
+            error("Invalid log level '%s' in the [profiler] section" % conf['log_level'])
+
+    return Profiler(app, conf['header'], log_level or None, conf['history'])
@@ -12,10 +12,88 @@
 __ http://wiki.secondlife.com/wiki/Eventlet
 """
 
-from eventlet import api, wsgi
+from eventlet import api, wsgi, event, hubs
 
+from nagare import comet
 from nagare.publishers import common
 
+DEFAULT_MAX_SIZE = 10000  # Maximum number of simultaneous requests, the waiting comet clients included
+DEFAULT_BACKLOG = 1024
+
+
+class Event(object):
+    """A green event with the interface of a ``threading.Event``"""
+    def __init__(self):
+        self.event = event.Event()
+
+    def wait(self):
+        self.event.wait()
+
+    def set(self):
+        if not self.event.ready():
+            self.event.send()
+
+    def is_set(self):
+        return self.event.ready()
+
+
+class Engine(comet.SelectEngine):
+    """Engine of the comet channels for the eventlet publisher
+
+    A waiting client only blocks its green thread and its disconnection is
+    detected by the eventlet hub, without thread nor scan of the other
+    clients.
+
+    The messages must be sent from the green threads of the publisher (i.e.
+    with the ``local`` comet backend), not from an other system thread.
+    """
+    create_event = Event  # Event a parked client waits for
+
+    def __init__(self):
+        self.listeners = {}  # Dict: file handle -> listener of the hub
+
+    def watch(self, channel, client):
+        """A client is waiting for a message
+
+        In:
+          - ``channel`` -- the channel
+          - ``client`` -- the client
+        """
+        def disconnected(fileno):
+            self.unwatch(client)
+            channel.discard(client)
+
+        hub = hubs.get_hub()
+        self.listeners[client.fileno()] = hub.add(hub.READ, client.fileno(), disconnected)
+
+    def unwatch(self, client):
+        """A client is no longer waiting
+
+        In:
+          - ``client`` -- the client
+        """
+        listener = self.listeners.pop(client.fileno(), None)
+        if listener is not None:
+            hubs.get_hub().remove(listener)
+
+    def discard_disconnected_clients(self, channel):
+        """The disconnected clients are discarded by the hub
+        """
+        pass
+
+
+def server(listener, app, max_size=DEFAULT_MAX_SIZE, **kw):
+    """Serve a WSGI application, the waiting comet clients only holding a green thread
+
+    In:
+      - ``listener`` -- the listening socket
+      - ``app`` -- the WSGI application
+      - ``max_size`` -- maximum number of simultaneous requests
+      - ``kw`` -- others parameters of the eventlet WSGI server
+    """
+    comet.set_default_engine(Engine())
+    wsgi.server(listener, app, max_size=max_size, **kw)
+
 
 class Publisher(common.Publisher):
     """The eventlet publisher"""
@@ -23,7 +101,11 @@ class Publisher(common.Publisher):
     # Possible command line options with the default values
     # ------------------------------------------------------
 
-    spec = dict(host='string(default=None)', port='integer(default=None)')
+    spec = dict(
+                host='string(default=None)', port='integer(default=None)',
+                max_size='integer(default=%d)' % DEFAULT_MAX_SIZE,
+                backlog='integer(default=%d)' % DEFAULT_BACKLOG
+               )
 
     def serve(self, filename, conf, error):
         """Run the publisher
@@ -38,4 +120,4 @@ class Publisher(common.Publisher):
         # The publisher is an events based server so call once the ``on_new_process()`` method
         self.on_new_process()
 
-        wsgi.server(api.tcp_listener((host, port)), self.urls)
+        server(api.tcp_listener((host, port), conf['backlog']), self.urls, conf['max_size'])
@@ -165,3 +165,100 @@ def serialize(output, content_type, doctype, declaration):
     second = ''.join(serialize(e, content_type, doctype, False)[1] for e in output[1:])
 
     return (content_type, first + second)
+
+# -----------------------------------------------------------------------------
+
+def stream(output, content_type, doctype, declaration):
+    """Generic method to generate, chunk by chunk, the content for the browser
+
+    In:
+      - ``output`` -- the rendered content
+      - ``content_type`` -- the rendered content type
+      - ``doctype`` -- the (optional) doctype
+      - ``declaration`` -- is the XML declaration to be outputed?
+
+    Return:
+      - a tuple (content_type, iterable of the content chunks)
+    """
+    (content_type, output) = serialize(output, content_type, doctype, declaration)
+    return (content_type, [output])
+
+
+@peak.rules.when(stream, (xhtml_base._HTMLTag,))
+def stream(next_method, output, content_type, doctype, declaration):
+    """Generic method to generate, chunk by chunk, a (X)HTML text from a tree
+
+    In:
+      - ``output`` -- the rendered content
+      - ``content_type`` -- the rendered content type
+      - ``doctype`` -- the (optional) doctype
+      - ``declaration`` -- is the XML declaration to be outputed?
+
+    Return:
+      - a tuple (content_type, generator of the content chunks)
+    """
+    if 'xmlns' in output.attrib:
+        # Let ``lxml`` generate the correct namespaces
+        del output.attrib['xmlns']
+
+    if content_type == 'application/xhtml+xml':
+        # The browser accepts XHTML
+        output = next_method(output, content_type, doctype, declaration)[1]
+    else:
+        # The browser only accepts HTML
+        lxml.html.xhtml_to_html(output)
+
+        output = output.write_htmlchunks(pretty_print=True, doctype=doctype if declaration else None)
+
+    return (content_type, output)
+
+
+@peak.rules.when(stream, (xml._Tag,))
+def stream(next_method, output, content_type, doctype, declaration):
+    """Generic method to generate, chunk by chunk, a XML text from a tree
+
+    In:
+      - ``output`` -- the rendered content
+      - ``content_type`` -- the rendered content type
+      - ``doctype`` -- the (optional) doctype
+      - ``declaration`` -- is the XML declaration to be outputed?
+
+    Return:
+      - a tuple (content_type, generator of the content chunks)
+    """
+    if content_type == 'text/html':
+        output = next_method(output, content_type, doctype, declaration)[1]
+    else:
+        output = output.write_xmlchunks(xml_declaration=declaration, doctype=doctype if declaration else None)
+
+    return (content_type, output)
+
+
+@peak.rules.when(stream, (etree._Element,))
+def stream(output, content_type, doctype, declaration):
+    """Generic method to generate, chunk by chunk, a XML text from a tree
+
+    In:
+      - ``output`` -- the rendered content
+      - ``content_type`` -- the rendered content type
+      - ``doctype`` -- the (optional) doctype
+      - ``declaration`` -- is the XML declaration to be outputed?
+
+    Return:
+      - a tuple (content_type, generator of the content chunks)
+    """
+    if content_type == 'text/html':
+        lxml.html.xhtml_to_html(output)
+        method = 'html'
+        pretty_print = True
+    else:
+        method = 'xml'
+        pretty_print = False
+
+    return (
+            content_type,
+            xml.iterwrite(
+                output, method, pretty_print=pretty_print,
+                xml_declaration=declaration, doctype=doctype if declaration else None
+            )
+           )
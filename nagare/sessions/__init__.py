@@ -18,3 +18,15 @@ class SessionSecurityError(LookupError):
     """Raised when the secure id of a session is not valid
     """
     pass
+
+
+class LockTimeoutError(Exception):
+    """Raised when the lock of a session can't be acquired in time or was lost
+    """
+    pass
+
+
+class ReadOnlyStateError(Exception):
+    """Raised when actions are registered during the rendering of a read-only state
+    """
+    pass
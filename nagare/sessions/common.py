@@ -9,19 +9,55 @@
 
 """Base classes for the sessions management"""
 
-import random
+from __future__ import with_statement
+
+import os
+import time
 
 import configobj
 
-from nagare import config
+from nagare import config, local, callbacks, profiler
 from nagare.admin import reference
-from nagare.sessions import SessionSecurityError, serializer
+from nagare.sessions import ExpirationError, SessionSecurityError, ReadOnlyStateError, serializer, compression
+
+# Number of states for which the head assets loaded by the browser are tracked
+ASSETS_HISTORY = 10
+
+
+def new_id():
+    """Generate a new random id, from the cryptographically strong ``os.urandom()``
+
+    Return:
+      - a positive 63 bits integer
+    """
+    return int(os.urandom(8).encode('hex'), 16) >> 1
+
+
+def create_serializer(serializer, pickler, unpickler, codec):
+    """Create a serializer
+
+    The codec is only given to the serializer when the pickles are really
+    encoded, so the serializers only taking a pickler and an unpickler still work
+
+    In:
+      - ``serializer`` -- the serializer class
+      - ``pickler`` -- pickler used by the serializer
+      - ``unpickler`` -- unpickler used by the serializer
+      - ``codec`` -- codec used by the serializer to compress the pickles
+
+    Return:
+      - the serializer
+    """
+    if (codec is None) or (type(codec) is compression.Identity):
+        return serializer(pickler, unpickler)
+
+    return serializer(pickler, unpickler, codec)
 
 
 class State(object):
     """A state (objects graph serialized / de-serialized by a sessions manager)
     """
-    def __init__(self, sessions_manager, session_id, state_id, secure_id, use_same_state):
+    def __init__(self, sessions_manager, session_id, state_id, secure_id, use_same_state, readonly=False):
         """Initialization
 
         In:
@@ -30,14 +66,22 @@ class State(object):
           - ``state_id`` -- id of this state (``None`` to create a new state)
           - ``secure_id`` -- the secure number associated to the session
           - ``use_same_state`` -- is a copy of this state to create?
+          - ``readonly`` -- is this state only rendered, without lock and without being stored?
         """
         self.sessions_manager = sessions_manager
         self.session_id = session_id
         self.state_id = state_id
         self.secure_id = secure_id
         self.use_same_state = use_same_state
+        self.readonly = readonly
 
         self.back_used = False  # Is this state a snapshot of a previous objects graph?
+        self.assets = {}  # Dict: state id -> ids of the head assets loaded by the browser
+        self.loaded_assets = None  # Ids of the head assets loaded by the browser for this state (``None`` if unknown)
+        self.next_callback_id = None  # Callbacks ids counter when the objects graph was retrieved
+        self.locked = False
+        self.acquisition_time = None
+        self.lock_hold_time = 0.  # Time, in seconds, the session was locked
         self.lock = (sessions_manager.create_lock if state_id is None else sessions_manager.get_lock)(self.session_id)
 
     def sessionid_in_url(self, request, response):
@@ -67,14 +111,20 @@ class State(object):
         return self.sessions_manager.sessionid_in_form(self.session_id, self.state_id, h, request, response)
 
     def acquire(self):
-        """Lock the state
+        """Lock the state, if not read-only
         """
-        self.lock.acquire()  # Lock the session
+        if not self.readonly:
+            self.lock.acquire()  # Lock the session
+            self.locked = True
+            self.acquisition_time = time.time()
 
     def release(self):
-        """Release the state
+        """Release the state, if it was locked
         """
-        self.lock.release()  # Release the session
+        if self.locked:
+            self.lock.release()  # Release the session
+            self.locked = False
+            self.lock_hold_time = time.time() - self.acquisition_time
 
     def get_root(self):
         """Retrieve the objects graph of this state
@@ -87,6 +137,8 @@ class State(object):
             self.sessions_manager.create(self.session_id, self.secure_id, self.lock)
             self.state_id = 0
             data = None
+
+            callbacks.set_next_id(0)
         else:
             # Existing state
             new_state_id, secure_id, data = self.sessions_manager.get_root(self.session_id, self.state_id)
@@ -97,8 +149,26 @@ class State(object):
                 self.back_used = (self.state_id != new_state_id - 1)
                 self.state_id = new_state_id
 
+            self.assets = getattr(local.request, 'head_assets', {})
+            self.loaded_assets = self.assets.get(self.state_id)
+
+        # The callbacks ids counter can't move during a read-only rendering
+        self.next_callback_id = callbacks.get_next_id()
+
         return data
 
+    def add_assets(self, assets, reset):
+        """Memorize the head assets now loaded by the browser for this state
+
+        In:
+          - ``assets`` -- ids of the head assets sent to the browser
+          - ``reset`` -- is a new page loaded by the browser?
+        """
+        if reset or (self.loaded_assets is None):
+            self.loaded_assets = assets
+        else:
+            self.loaded_assets = self.loaded_assets | assets
+
     def set_root(self, use_same_state, data):
         """Store the objects graph of this state
 
@@ -106,7 +176,27 @@ class State(object):
           - ``use_same_state`` -- is the objects graph to be stored in this state or in a new one?
           - ``data`` -- the objects graph
         """
-        self.sessions_manager.set_root(self.session_id, self.state_id, self.secure_id, self.use_same_state or use_same_state, data)
+        if self.readonly:
+            # The objects graph is a snapshot of an existing state, never stored
+            if callbacks.get_next_id() != self.next_callback_id:
+                # So the registered actions would be lost and their ids reused
+                raise ReadOnlyStateError('actions registered by the read-only rendering of state %d of session %d' % (self.state_id, self.session_id))
+
+            stored_assets = self.assets.get(self.state_id)
+            if (stored_assets is not None) and (self.loaded_assets != stored_assets):
+                # So the next XHR responses would rely on stale head assets
+                raise ReadOnlyStateError('head assets changed by the read-only rendering of state %d of session %d' % (self.state_id, self.session_id))
+
+            return
+
+        assets = self.assets
+        if self.loaded_assets is not None:
+            # Only the assets of the latest states are kept
+            state_ids = sorted(set(assets) | set([self.state_id]))[-ASSETS_HISTORY:]
+            assets = dict((state_id, assets.get(state_id)) for state_id in state_ids)
+            assets[self.state_id] = self.loaded_assets
+
+        self.sessions_manager.set_root(self.session_id, self.state_id, self.secure_id, self.use_same_state or use_same_state, data, assets)
 
     def delete(self):
         """Delete the session of this state
@@ -122,14 +212,17 @@ class Sessions(object):
             'states_history': 'boolean(default=True)',
             'pickler': 'string(default="cPickle:Pickler")',
             'unpickler': 'string(default="cPickle:Unpickler")',
-            'serializer': 'string(default="nagare.sessions.serializer:Dummy")'
+            'serializer': 'string(default="nagare.sessions.serializer:Dummy")',
+            'codec': 'string(default="nagare.sessions.compression:Identity")',
+            'codec_level': 'integer(default=6, min=1, max=9)',
+            'codec_dictionary': 'string(default="")'
            }
 
     def __init__(
                     self,
                     states_history=True,
                     security_cookie_name='_nagare',
-                    serializer=serializer.Dummy, pickler=None, unpickler=None
+                    serializer=serializer.Dummy, pickler=None, unpickler=None, codec=None
                 ):
         """Initialization
 
@@ -139,10 +232,11 @@ class Sessions(object):
           - ``serializer`` -- serializer / deserializer of the states
           - ``pickler`` -- pickler used by the serializer
           - ``unpickler`` -- unpickler used by the serializer
+          - ``codec`` -- codec used by the serializer to compress the pickles
         """
         self.states_history = states_history
         self.security_cookie_name = security_cookie_name
-        self.serializer = serializer(pickler, unpickler)
+        self.serializer = create_serializer(serializer, pickler, unpickler, codec)
 
     def set_config(self, filename, conf, error):
         """Read the configuration parameters
@@ -162,7 +256,14 @@ class Sessions(object):
         pickler = reference.load_object(conf['pickler'])[0]
         unpickler = reference.load_object(conf['unpickler'])[0]
         serializer = reference.load_object(conf['serializer'])[0]
-        self.serializer = serializer(pickler, unpickler)
+
+        dictionary = None
+        if conf['codec_dictionary']:
+            with open(conf['codec_dictionary'], 'rb') as f:
+                dictionary = f.read()
+        codec = reference.load_object(conf['codec'])[0](conf['codec_level'], dictionary)
+
+        self.serializer = create_serializer(serializer, pickler, unpickler, codec)
 
         return conf
 
@@ -226,13 +327,14 @@ class Sessions(object):
         """
         return False
 
-    def get_state(self, request, response, use_same_state):
+    def get_state(self, request, response, use_same_state, readonly=False):
         """Create a new state or return an existing one
 
         In:
           - ``request`` -- the web request object
           - ``response`` -- the web response object
           - ``use_same_state`` -- is a copy of the state to created?
+          - ``readonly`` -- can an existing state be rendered from a snapshot, without lock?
 
         Return:
           - the state
@@ -242,20 +344,21 @@ class Sessions(object):
         except (KeyError, ValueError, TypeError):
             state_id = None
 
-            # Create a new session id
-            while True:
-                session_id = random.randint(1000000000000000, 9999999999999999)
-                if not self.check_session_id(session_id):
-                    break
+            # Create a new session id. With 63 random bits, a collision with
+            # an existing session is too unlikely to be checked
+            session_id = new_id()
 
         secure_id = None
         if self.security_cookie_name:
             secure_id = request.cookies.get(self.security_cookie_name)
             if not secure_id:
-                secure_id = str(random.randint(1000000000000000, 9999999999999999))
+                secure_id = os.urandom(16).encode('hex')
                 response.set_cookie(self.security_cookie_name, secure_id, path=request.script_name + '/')
 
-        return State(self, session_id, state_id, secure_id, use_same_state or not self.states_history)
+        # Without lock, only an unpickled copy of a state can be rendered
+        readonly = readonly and (state_id is not None) and self.serializer.snapshots
+
+        return State(self, session_id, state_id, secure_id, use_same_state or readonly or not self.states_history, readonly)
 
     def get_root(self, session_id, state_id):
         """Retrieve the objects graph of a state
@@ -269,10 +372,27 @@ class Sessions(object):
           - secure number associated to the session
           - objects graph
         """
-        new_state_id, secure_id, session_data, state_data = self.fetch_state(session_id, state_id)
-        return new_state_id, secure_id, self.serializer.loads(session_data, state_data)
+        with profiler.timer('session fetch'):
+            new_state_id, secure_id, session_data, state_data = self.fetch_state(session_id, state_id)
+
+        # The callbacks ids counter is kept into the session, not into the
+        # states, so the ids are never reused even when going back in history
+        if not isinstance(session_data, tuple) or (len(session_data) != 3):
+            # Session stored by a previous version
+            raise ExpirationError()
+
+        next_callback_id, assets, session_data = session_data
+        callbacks.set_next_id(next_callback_id)
 
-    def set_root(self, session_id, state_id, secure_id, use_same_state, data):
+        # Same for the head assets loaded by the browser for the latest states
+        local.request.head_assets = assets
+
+        with profiler.timer('session unpickle'):
+            data = self.serializer.loads(session_data, state_data)
+
+        return new_state_id, secure_id, data
+
+    def set_root(self, session_id, state_id, secure_id, use_same_state, data, assets=None):
         """Store the state
 
         In:
@@ -281,9 +401,13 @@ class Sessions(object):
           - ``secure_id`` -- the secure number associated to the session
           - ``use_same_state`` -- is a copy of this state to be created?
           - ``data`` -- the objects graph
+          - ``assets`` -- dictionary: state id -> ids of the head assets loaded by the browser
         """
-        session_data, state_data = self.serializer.dumps(data, not use_same_state)
-        self.store_state(session_id, state_id, secure_id, use_same_state, session_data, state_data)
+        with profiler.timer('state pickle'):
+            session_data, state_data = self.serializer.dumps(data, not use_same_state)
+
+        with profiler.timer('state store'):
+            self.store_state(session_id, state_id, secure_id, use_same_state, (callbacks.get_next_id(), assets or {}, session_data), state_data)
 
     # -------------------------------------------------------------------------
 
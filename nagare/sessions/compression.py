@@ -0,0 +1,181 @@
+#--
+# Copyright (c) 2008-2013 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+#--
+
+"""Codecs to compress the pickled states
+
+A codec records the number of bytes and the time spent to encode and
+decode the states, to give its compression ratio and CPU cost.
+"""
+
+from __future__ import with_statement
+
+import time
+import zlib
+import threading
+
+from nagare.sessions import ExpirationError
+
+# The zlib window is 32Kb, minus a margin of 262 bytes
+MAX_DICTIONARY_SIZE = 32 * 1024 - 262
+
+
+class Identity(object):
+    """Codec keeping the states uncompressed"""
+
+    def __init__(self, level=None, dictionary=None):
+        """Initialization
+
+        In:
+          - ``level`` -- compression level
+          - ``dictionary`` -- compression dictionary
+        """
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Reset the statistics
+        """
+        self.nb_encoded = self.nb_decoded = 0   # Number of encoded / decoded states
+        self.raw_size = self.encoded_size = 0   # Total size of the states before / after the encoding
+        self.encode_time = self.decode_time = 0.  # Total time spent to encode / decode the states
+
+    def _encode(self, data):
+        return data
+
+    def _decode(self, data):
+        return data
+
+    def encode(self, data):
+        """Encode a pickled state
+
+        In:
+          - ``data`` -- the pickled state
+
+        Return:
+          - the encoded state
+        """
+        t0 = time.time()
+        encoded = self._encode(data)
+        t = time.time() - t0
+
+        with self.lock:
+            self.nb_encoded += 1
+            self.raw_size += len(data)
+            self.encoded_size += len(encoded)
+            self.encode_time += t
+
+        return encoded
+
+    def decode(self, data):
+        """Decode a pickled state
+
+        In:
+          - ``data`` -- the encoded state
+
+        Return:
+          - the pickled state
+        """
+        t0 = time.time()
+        decoded = self._decode(data)
+        t = time.time() - t0
+
+        with self.lock:
+            self.nb_decoded += 1
+            self.decode_time += t
+
+        return decoded
+
+    @property
+    def ratio(self):
+        """Compression ratio of all the encoded states
+        """
+        return float(self.raw_size) / self.encoded_size if self.encoded_size else 1.
+
+    def stats(self):
+        """Statistics of the codec
+
+        Return:
+          - dictionary of the statistics
+        """
+        return {
+                'nb_encoded': self.nb_encoded,
+                'nb_decoded': self.nb_decoded,
+                'raw_size': self.raw_size,
+                'encoded_size': self.encoded_size,
+                'ratio': self.ratio,
+                'encode_time': self.encode_time,
+                'decode_time': self.decode_time,
+                'mean_encode_time': self.encode_time / self.nb_encoded if self.nb_encoded else 0.,
+                'mean_decode_time': self.decode_time / self.nb_decoded if self.nb_decoded else 0.
+               }
+
+
+class Zlib(Identity):
+    """Codec compressing the states with zlib
+
+    With a dictionary, the states are compressed as if they were following
+    the dictionary. As the pickles of an application share a lot of strings
+    (modules, classes and attributes names ...), a dictionary made of typical
+    pickles improves the compression of the small states.
+    """
+
+    def __init__(self, level=6, dictionary=None):
+        """Initialization
+
+        In:
+          - ``level`` -- compression level, from 1 (fastest) to 9 (best)
+          - ``dictionary`` -- compression dictionary
+        """
+        super(Zlib, self).__init__(level, dictionary)
+
+        self.level = level
+        self.compressor = self.decompressor = None
+
+        if dictionary:
+            # Compression and decompression objects are primed with the
+            # dictionary, then copied for each state
+            self.compressor = zlib.compressobj(level)
+            prefix = self.compressor.compress(dictionary[-MAX_DICTIONARY_SIZE:])
+            prefix += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+            self.decompressor = zlib.decompressobj()
+            self.decompressor.decompress(prefix)
+
+    def _encode(self, data):
+        if self.compressor is None:
+            return zlib.compress(data, self.level)
+
+        compressor = self.compressor.copy()
+        return compressor.compress(data) + compressor.flush()
+
+    def _decode(self, data):
+        try:
+            if self.decompressor is None:
+                return zlib.decompress(data)
+
+            decompressor = self.decompressor.copy()
+            return decompressor.decompress(data) + decompressor.flush()
+        except zlib.error:
+            # State encoded with another dictionary or codec
+            raise ExpirationError('state not decodable')
+
+
+def train_dictionary(samples, size=MAX_DICTIONARY_SIZE):
+    """Create a compression dictionary from typical pickled states
+
+    In:
+      - ``samples`` -- the pickled states
+      - ``size`` -- maximum size of the dictionary
+
+    Return:
+      - the dictionary
+    """
+    # The last samples are the closest to the compressed data so, if the
+    # dictionary is too big, the first samples are truncated
+    return ''.join(samples)[-size:]
@@ -0,0 +1,232 @@
+#--
+# Copyright (c) 2008-2013 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+#--
+
+"""Sessions managed in memory, with the pickled states kept in files
+
+The pickled states are appended to segment files, memory mapped to be read.
+Only an index (segment, offset, length) of the states is kept in memory.
+
+When a segment is full, a new one is created and the segments with too many
+states of expired sessions, or expired states, are compacted.
+
+The index of the states is only read and modified under the lock of the
+sessions manager, and the location of a state is an immutable tuple, swapped
+when the state is moved by a compaction.
+"""
+
+from __future__ import with_statement
+
+import mmap
+import tempfile
+import threading
+
+from nagare.sessions import memory_sessions
+from nagare.sessions.serializer import Pickle
+
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+DEFAULT_COMPACTION_RATIO = 0.5
+
+
+class Segment(object):
+    """An append-only file of pickled states
+
+    The file is temporary, automatically deleted when closed or when the
+    process ends.
+    """
+    def __init__(self, directory=None):
+        """Initialization
+
+        In:
+          - ``directory`` -- directory where to create the file (system temporary directory by default)
+        """
+        self.file = tempfile.TemporaryFile(prefix='nagare-sessions-', dir=directory)
+        self.size = 0
+        self.map = None
+
+    def append(self, data):
+        """Append a pickled state
+
+        In:
+          - ``data`` -- the pickled state
+
+        Return:
+          - offset of the state into the file
+        """
+        offset = self.size
+
+        self.file.write(data)
+        self.size += len(data)
+
+        return offset
+
+    def read(self, offset, length):
+        """Read a pickled state
+
+        In:
+          - ``offset`` -- offset of the state into the file
+          - ``length`` -- size of the state
+
+        Return:
+          - a read-only ``buffer`` on the state, without copy
+        """
+        m = self.map
+        if (m is None) or (offset + length > len(m)):
+            # The states written since the last mapping are not mapped yet.
+            # The previous mapping is not closed as buffers can still use it
+            self.file.flush()
+            m = self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return buffer(m, offset, length)
+
+    def close(self):
+        """Close and delete the file
+        """
+        self.file.close()
+
+
+class Sessions(memory_sessions.Sessions):
+    """Sessions manager for states pickled into memory mapped files
+    """
+    spec = memory_sessions.Sessions.spec.copy()
+    spec['serializer'] = 'string(default="nagare.sessions.serializer:Pickle")'
+    spec['directory'] = 'string(default="")'
+    spec['segment_size'] = 'integer(default=%d)' % DEFAULT_SEGMENT_SIZE
+    spec['compaction_ratio'] = 'float(default=%f, min=0, max=1)' % DEFAULT_COMPACTION_RATIO
+
+    def __init__(
+                    self,
+                    directory=None,
+                    segment_size=DEFAULT_SEGMENT_SIZE,
+                    compaction_ratio=DEFAULT_COMPACTION_RATIO,
+                    serializer=None,
+                    **kw
+                ):
+        """Initialization
+
+        In:
+          - ``directory`` -- directory of the segment files (system temporary directory by default)
+          - ``segment_size`` -- size, in bytes, of a segment file before a new one is created
+          - ``compaction_ratio`` -- a segment with a lower ratio of valid states is compacted
+          - ``serializer`` -- serializer / deserializer of the states
+        """
+        super(Sessions, self).__init__(serializer=serializer or Pickle, **kw)
+
+        self.directory = directory or None
+        self.segment_size = segment_size
+        self.compaction_ratio = compaction_ratio
+
+        self.lock = threading.Lock()
+        self.segments = [Segment(self.directory)]
+
+    def set_config(self, filename, conf, error):
+        """Read the configuration parameters
+
+        In:
+          - ``filename`` -- path to the configuration file
+          - ``conf`` -- ``ConfigObj`` object created from the configuration file
+          - ``error`` -- function to call in case of configuration errors
+        """
+        # Let's the super class validate the configuration file
+        conf = super(Sessions, self).set_config(filename, conf, error)
+
+        self.directory = conf['directory'] or None
+        self.segment_size = conf['segment_size']
+        self.compaction_ratio = conf['compaction_ratio']
+
+        with self.lock:
+            for segment in self.segments:
+                segment.close()
+
+            self.segments = [Segment(self.directory)]
+
+        return conf
+
+    def fetch_state(self, session_id, state_id):
+        """Retrieve a state with its associated objects graph
+
+        In:
+          - ``session_id`` -- session id of this state
+          - ``state_id`` -- id of this state
+
+        Return:
+          - id of the latest state
+          - secure number associated to the session
+          - data kept into the session
+          - data kept into the state
+        """
+        with self.lock:
+            last_state_id, secure_id, session_data, location = super(Sessions, self).fetch_state(session_id, state_id)
+
+            segment, offset, length = location[0]
+            state_data = segment.read(offset, length)
+
+        return last_state_id, secure_id, session_data, state_data
+
+    def store_state(self, session_id, state_id, secure_id, use_same_state, session_data, state_data):
+        """Store a state and its associated objects graph
+
+        In:
+          - ``session_id`` -- session id of this state
+          - ``state_id`` -- id of this state
+          - ``secure_id`` -- the secure number associated to the session
+          - ``use_same_state`` -- is this state to be stored in the previous snapshot?
+          - ``session_data`` -- data to keep into the session
+          - ``state_data`` -- data to keep into the state
+        """
+        with self.lock:
+            segment = self.segments[-1]
+            if segment.size and (segment.size + len(state_data) > self.segment_size):
+                segment = self.new_segment()
+
+            # Holder of the location of the state, swapped when the state is
+            # moved by a compaction. The state is registered before the lock
+            # is released, so a compaction always finds it
+            location = [(segment, segment.append(state_data), len(state_data))]
+
+            super(Sessions, self).store_state(session_id, state_id, secure_id, use_same_state, session_data, location)
+
+    def new_segment(self):
+        """Create a new segment and compact the old ones
+
+        Called under the lock of the sessions manager
+
+        Return:
+          - the new segment
+        """
+        segment = Segment(self.directory)
+        self.segments.append(segment)
+
+        self.compact()
+
+        return segment
+
+    def compact(self):
+        """Move the states of the segments with a ratio of valid states lower than
+        ``compaction_ratio`` to the last segment, then delete them
+
+        Called under the lock of the sessions manager
+        """
+        # Locations of the valid states for each segment
+        locations = dict((segment, []) for segment in self.segments[:-1])
+        for session in self._sessions.values():
+            for location in session[4].values():
+                if location[0][0] in locations:
+                    locations[location[0][0]].append(location)
+
+        last = self.segments[-1]
+        for segment, valid in locations.items():
+            if sum(location[0][2] for location in valid) >= segment.size * self.compaction_ratio:
+                continue
+
+            for location in valid:
+                (_, offset, length) = location[0]
+                location[0] = (last, last.append(str(segment.read(offset, length))), length)
+
+            self.segments.remove(segment)
+            segment.close()
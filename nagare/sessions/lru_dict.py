@@ -11,27 +11,45 @@
 
 When this maximum is reached, the last recently used key is deleted when a new
 key is added.
+
+Optionally, the dictionary can also have a maximum memory size. The size of
+each value is given by a ``sizeof`` function and, when the total size exceeds
+the maximum, the last recently used keys are deleted.
+
+The keys are kept into a circular doubly-linked list, from the last recently
+used to the most recently used, so all the operations are in O(1).
 """
 
 from __future__ import with_statement
 
 import threading
 
+# Fields of a link of the list
+PREVIOUS, NEXT, KEY, VALUE, SIZE = range(5)
+
 
 class LRUDict(object):
     """A LRU dictionary is a dictionary with a fixed maximum number of keys"""
 
-    def __init__(self, size):
+    def __init__(self, size, max_memory=0, sizeof=None):
         """Initialization
 
         In:
           -  ``size`` -- maximum number of keys
+          -  ``max_memory`` -- maximum total size of the values (``0`` for no limit)
+          -  ``sizeof`` -- function returning the size of a value
         """
         self.size = size
+        self.max_memory = max_memory
+        self.sizeof = sizeof or (lambda o: 0)
 
-        self.oldest = self.newest = 0  # Age of the oldest key / age of the last recently used key
-        self.age_to_items = {}         # Dict: key_age -> key
-        self.items = {}                # Dict: key -> (key_age, value)
+        self.memory = 0  # Total size of the values
+        self.items = {}  # Dict: key -> link [previous link, next link, key, value, size]
+
+        # Sentinel of the list: its next link is the last recently used key
+        # and its previous link the most recently used key
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None, 0]
 
     def __contains__(self, k):
         """Test if a key exists into this dictionary
@@ -44,16 +62,50 @@ class LRUDict(object):
         """
         return k in self.items
 
-    def _set_newest(self, k, o):
-        """Insert a key as the last recently used
+    def __len__(self):
+        return len(self.items)
+
+    def values(self):
+        """Return all the values, without changing the last recently used key
+
+        Return:
+          - list of the values
+        """
+        return [link[VALUE] for link in self.items.itervalues()]
+
+    def _unlink(self, link):
+        """Remove a link from the list
 
         In:
-           - ``k`` -- the key
-           - ``o`` -- the value
+          - ``link`` -- the link
         """
-        self.age_to_items[self.newest] = k
-        self.items[k] = (self.newest, o)
-        self.newest += 1
+        previous, next = link[PREVIOUS], link[NEXT]
+        previous[NEXT] = next
+        next[PREVIOUS] = previous
+
+    def _set_newest(self, link):
+        """Insert a link as the most recently used
+
+        In:
+           - ``link`` -- the link
+        """
+        root = self.root
+        newest = root[PREVIOUS]
+
+        link[PREVIOUS] = newest
+        link[NEXT] = root
+        newest[NEXT] = root[PREVIOUS] = link
+
+    def _evict(self):
+        """Delete the last recently used keys until the limits are respected
+
+        The most recently used key is never deleted
+        """
+        while (len(self.items) > self.size) or (self.max_memory and (self.memory > self.max_memory) and (len(self.items) > 1)):
+            oldest = self.root[NEXT]
+            self._unlink(oldest)
+            del self.items[oldest[KEY]]
+            self.memory -= oldest[SIZE]
 
     def __getitem__(self, k):
         """Return the value of a key.
@@ -66,11 +118,12 @@ class LRUDict(object):
         Return:
           - the value
         """
-        (age, item) = self.items[k]
-        del self.age_to_items[age]
+        link = self.items[k]
+
+        self._unlink(link)
+        self._set_newest(link)
 
-        self._set_newest(k, item)
-        return item
+        return link[VALUE]
 
     def __setitem__(self, k, o):
         """Set the value of a key.
@@ -81,21 +134,17 @@ class LRUDict(object):
           - ``k`` -- the key
           - ``o`` -- the value
         """
-        try:
-            (age, item) = self.items[k]
-            del self.age_to_items[age]
-        except KeyError:
-            pass
+        link = self.items.get(k)
+        if link is not None:
+            self._unlink(link)
+            self.memory -= link[SIZE]
 
-        self._set_newest(k, o)
+        size = self.sizeof(o)
+        link = self.items[k] = [None, None, k, o, size]
+        self._set_newest(link)
+        self.memory += size
 
-        if len(self.items) > self.size:
-            # Maximum number of keys reached
-            # Delete the last recently used key
-            while not self.oldest in self.age_to_items:
-                self.oldest += 1
-
-            del self.items[self.age_to_items.pop(self.oldest)]
+        self._evict()
 
     def __delitem__(self, k):
         """Delete a key.
@@ -103,11 +152,34 @@ class LRUDict(object):
         In:
           - ``k`` -- the key
         """
-        (age, item) = self.items.pop(k)
-        del self.age_to_items[age]
+        link = self.items.pop(k)
+        self._unlink(link)
+        self.memory -= link[SIZE]
+
+    def set_memory(self, k, size):
+        """Change the size of a value
+
+        To call when a mutable value was modified in place. The key doesn't
+        become the most recently used key.
+
+        In:
+          - ``k`` -- the key
+          - ``size`` -- the new size of the value
+        """
+        link = self.items[k]
+        self.memory += size - link[SIZE]
+        link[SIZE] = size
+
+        self._evict()
 
     def debug(self):
-        print self.oldest, self.newest, self.age_to_items, self.items
+        keys = []
+        link = self.root[NEXT]
+        while link is not self.root:
+            keys.append((link[KEY], link[VALUE], link[SIZE]))
+            link = link[NEXT]
+
+        print self.memory, keys
 
 
 class ThreadSafeLRUDict(LRUDict):
@@ -115,7 +187,8 @@ class ThreadSafeLRUDict(LRUDict):
 
     def __init__(self, *args, **kw):
         super(ThreadSafeLRUDict, self).__init__(*args, **kw)
-        self.lock = threading.RLock()
+        # No method is reentrant so a simple lock, faster than a ``RLock``, is enough
+        self.lock = threading.Lock()
 
     def __contains__(self, k):
         """Test if a key exists into this dictionary
@@ -137,6 +210,19 @@ class ThreadSafeLRUDict(LRUDict):
         with self.lock:
             super(ThreadSafeLRUDict, self).__setitem__(k, o)
 
+    def __delitem__(self, k):
+        with self.lock:
+            super(ThreadSafeLRUDict, self).__delitem__(k)
+
+    def values(self):
+        with self.lock:
+            return super(ThreadSafeLRUDict, self).values()
+
+    def set_memory(self, k, size):
+        with self.lock:
+            super(ThreadSafeLRUDict, self).set_memory(k, size)
+
+
 # ----------------------------------------------------------------------------
 
 if __name__ == '__main__':
@@ -0,0 +1,422 @@
+#--
+# Copyright (c) 2008-2013 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+#--
+
+"""Pools of connections to several memcached servers
+
+All the keys of a session are stored on the same server, chosen by
+consistent hashing on the session id. So adding or removing a server only
+moves the sessions of this server.
+
+A dead server is removed from the hash ring, its sessions re-routed to the
+others servers, until it is retried. A session is never copied between the
+servers (a session not found is expired and a new one, with a new id, is
+created) so a revived server is put back with its sessions. The last live
+server is never removed: its connections retry it themselves.
+
+The hash ring is never modified in place but replaced, so that the keys are
+looked up without lock.
+"""
+
+from __future__ import with_statement
+
+import socket
+import hashlib
+import time
+import bisect
+import threading
+import contextlib
+import Queue
+
+import memcache
+
+DEFAULT_NB_REPLICAS = 100
+DEFAULT_DEAD_RETRY = 30
+
+
+class Client(memcache.Client):
+    """A ``memcache.Client`` connected to only one server
+
+    ``memcache.Client`` being thread local, each thread using it opens its
+    own sockets. Here the socket is created once and shared, a pool
+    guaranteeing that only one thread at a time uses it.
+    """
+    def __init__(self, host, debug=False):
+        """Initialization
+
+        In:
+          - ``host`` -- the ``memcache._Host`` connection to the server
+          - ``debug`` -- display the memcache requests / responses
+        """
+        super(Client, self).__init__([], debug=debug)
+
+        self.servers = [host]
+        self._init_buckets()
+
+    def is_dead(self):
+        """Was the server found dead during the last request?
+
+        Return:
+          - a boolean
+        """
+        return self.servers[0].deaduntil > time.time()
+
+    def check(self):
+        """Try to connect to the server, even if found dead
+
+        Return:
+          - is the server alive?
+        """
+        self.servers[0].deaduntil = 0
+        return bool(self.servers[0].connect())
+
+    def gets_multi(self, keys, key_prefix=''):
+        """Retrieve several keys with their CAS ids, in one round-trip
+
+        In:
+          - ``keys`` -- the keys
+          - ``key_prefix`` -- prefix added to each key
+
+        Return:
+          - dictionary key -> value of the keys found
+          - dictionary key -> CAS id of the keys found
+        """
+        values = {}
+        cas_ids = {}
+
+        server_keys, prefixed_to_orig_key = self._map_and_prefix_keys(keys, key_prefix)
+        for (server, server_keys) in server_keys.items():
+            try:
+                server.send_cmd('gets ' + ' '.join(server_keys))
+
+                line = server.readline()
+                while line and (line != 'END'):
+                    rkey, flags, rlen, cas_id = self._expect_cas_value(server, line)
+                    if rkey is not None:
+                        key = prefixed_to_orig_key[rkey]
+                        values[key] = self._recv_value(server, flags, rlen)
+                        cas_ids[key] = cas_id
+
+                    line = server.readline()
+            except (memcache._Error, socket.error), e:
+                server.mark_dead(e)
+
+        return values, cas_ids
+
+    def store_multi(self, commands, time=0, key_prefix='', min_compress_len=0):
+        """Store several keys, in one round-trip
+
+        The commands are sent in one write and executed in order by the
+        server, each one succeeding or failing independently
+
+        In:
+          - ``commands`` -- list of (``"set"``, ``"add"`` or ``"cas"``, key, value, CAS id)
+          - ``time`` -- expiration time
+          - ``key_prefix`` -- prefix added to each key
+          - ``min_compress_len`` -- the values are compressed if longer
+
+        Return:
+          - list of booleans: was each key stored?
+        """
+        server = self.servers[0]
+        if not server.connect():
+            return [False] * len(commands)
+
+        lines = []
+        for (cmd, key, value, cas_id) in commands:
+            flags, length, value = self._val_to_store_info(value, min_compress_len)
+
+            headers = '%d %d %d' % (flags, time, length)
+            if cmd == 'cas':
+                headers += ' %d' % cas_id
+
+            lines.append('%s %s%s %s\r\n%s' % (cmd, key_prefix, key, headers, value))
+
+        try:
+            server.send_cmd('\r\n'.join(lines))
+            return [server.expect('STORED', raise_exception=True) == 'STORED' for cmd in commands]
+        except (memcache._Error, socket.error), e:
+            server.mark_dead(e)
+            return [False] * len(commands)
+
+
+class HashRing(object):
+    """Consistent hashing of keys on nodes"""
+
+    def __init__(self, nodes=(), nb_replicas=DEFAULT_NB_REPLICAS):
+        """Initialization
+
+        In:
+          - ``nodes`` -- the initial nodes
+          - ``nb_replicas`` -- number of points of each node on the ring
+        """
+        self.nb_replicas = nb_replicas
+
+        self.hashes = []  # Sorted points of the ring
+        self.nodes = {}   # Dict: point -> node
+
+        for node in nodes:
+            self.add_node(node)
+
+    def copy(self):
+        """Return a copy of the ring
+
+        Return:
+          - the new ring
+        """
+        ring = HashRing(nb_replicas=self.nb_replicas)
+        ring.hashes = self.hashes[:]
+        ring.nodes = self.nodes.copy()
+
+        return ring
+
+    @staticmethod
+    def hash(key):
+        """Position of a key on the ring
+
+        In:
+          - ``key`` -- the key
+
+        Return:
+          - the position, an integer stable between processes
+        """
+        return int(hashlib.md5(key).hexdigest()[:8], 16)
+
+    def add_node(self, node):
+        """Add a node to the ring
+
+        In:
+          - ``node`` -- the node
+        """
+        for i in range(self.nb_replicas):
+            h = self.hash('%s-%d' % (node, i))
+            if h not in self.nodes:
+                bisect.insort(self.hashes, h)
+            self.nodes[h] = node
+
+    def remove_node(self, node):
+        """Remove a node from the ring
+
+        In:
+          - ``node`` -- the node
+        """
+        for i in range(self.nb_replicas):
+            h = self.hash('%s-%d' % (node, i))
+            if self.nodes.get(h) == node:
+                del self.nodes[h]
+                del self.hashes[bisect.bisect_left(self.hashes, h)]
+
+    def get_node(self, key):
+        """Return the node of a key
+
+        In:
+          - ``key`` -- the key
+
+        Return:
+          - the node
+        """
+        if not self.hashes:
+            raise LookupError('no node available')
+
+        i = bisect.bisect(self.hashes, self.hash(key)) % len(self.hashes)
+        return self.nodes[self.hashes[i]]
+
+
+class Pool(object):
+    """Bounded pool of connections to a memcached server"""
+
+    def __init__(self, create_client, size):
+        """Initialization
+
+        In:
+          - ``create_client`` -- function returning a new connection to the server
+          - ``size`` -- maximum number of connections
+        """
+        self.create_client = create_client
+        self.clients = Queue.LifoQueue()  # Idle connections
+        self.semaphore = threading.BoundedSemaphore(size)
+
+    def acquire(self):
+        """Take a connection, waiting if all the connections are used
+
+        Return:
+          - the connection
+        """
+        self.semaphore.acquire()
+
+        try:
+            return self.clients.get_nowait()
+        except Queue.Empty:
+            return self.create_client()
+
+    def release(self, client):
+        """Give back a connection
+
+        In:
+          - ``client`` -- the connection
+        """
+        self.clients.put(client)
+        self.semaphore.release()
+
+
+class Servers(object):
+    """Pools of connections to several memcached servers"""
+
+    def __init__(self, servers, pool_size=10, debug=False, dead_retry=DEFAULT_DEAD_RETRY, create_client=None):
+        """Initialization
+
+        In:
+          - ``servers`` -- list of the memcached servers, as ``"host:port"`` strings
+          - ``pool_size`` -- maximum number of connections to each server
+          - ``debug`` -- display the memcache requests / responses
+          - ``dead_retry`` -- time, in seconds, before a dead server is retried
+          - ``create_client`` -- function returning a new connection to a server
+        """
+        self.pool_size = pool_size
+        self.debug = debug
+        self.dead_retry = dead_retry
+        self.create_client = create_client or (lambda server: Client(memcache._Host(server, debug, dead_retry), debug))
+
+        self.lock = threading.Lock()
+        self.pools = {}  # Dict: server -> pool of connections
+        self.dead = {}   # Dict: dead server -> time to retry it
+        self.ring = HashRing()  # Immutable ring, replaced on each change
+
+        for server in servers:
+            self.add_server(server)
+
+    def _update_ring(self, add=None, remove=None):
+        """Replace the hash ring by a modified copy
+
+        The lock must be acquired
+
+        In:
+          - ``add`` -- server to add to the ring
+          - ``remove`` -- server to remove from the ring
+        """
+        ring = self.ring.copy()
+
+        if add is not None:
+            ring.add_node(add)
+        if remove is not None:
+            ring.remove_node(remove)
+
+        self.ring = ring
+
+    def add_server(self, server):
+        """Add a server
+
+        In:
+          - ``server`` -- the server, as a ``"host:port"`` string
+        """
+        with self.lock:
+            self.pools[server] = Pool(lambda: self.create_client(server), self.pool_size)
+            self.dead.pop(server, None)
+            self._update_ring(add=server)
+
+    def remove_server(self, server):
+        """Remove a server, its sessions going to the others servers
+
+        In:
+          - ``server`` -- the server, as a ``"host:port"`` string
+        """
+        with self.lock:
+            self.pools.pop(server, None)
+            self.dead.pop(server, None)
+            self._update_ring(remove=server)
+
+    def mark_dead(self, server):
+        """Temporary remove a server
+
+        In:
+          - ``server`` -- the server, as a ``"host:port"`` string
+        """
+        with self.lock:
+            if (server in self.pools) and (server not in self.dead):
+                if len(self.pools) - len(self.dead) == 1:
+                    # Last live server: never leave the ring empty
+                    return
+
+                self.dead[server] = time.time() + self.dead_retry
+                self._update_ring(remove=server)
+
+    def revive(self, server):
+        """Put back a dead server in the ring, if it's alive again
+
+        In:
+          - ``server`` -- the server, as a ``"host:port"`` string
+        """
+        pool = self.pools.get(server)
+        if pool is None:
+            return
+
+        client = pool.acquire()
+        try:
+            alive = client.check()
+        finally:
+            pool.release(client)
+
+        with self.lock:
+            if server in self.dead:
+                if not alive:
+                    # Still dead
+                    self.dead[server] = time.time() + self.dead_retry
+                else:
+                    del self.dead[server]
+                    self._update_ring(add=server)
+
+    def get_server(self, key):
+        """Return the server of a key
+
+        In:
+          - ``key`` -- the key
+
+        Return:
+          - the server, as a ``"host:port"`` string
+        """
+        if self.dead:
+            # Retry the dead servers
+            with self.lock:
+                now = time.time()
+                retried = [server for (server, retry) in self.dead.items() if retry < now]
+                for server in retried:
+                    # Only one thread retries a server
+                    self.dead[server] = now + self.dead_retry
+
+            for server in retried:
+                self.revive(server)
+
+        return self.ring.get_node(str(key))
+
+    @contextlib.contextmanager
+    def connection(self, key):
+        """Borrow a connection to the server of a key
+
+        In:
+          - ``key`` -- the key
+
+        Return:
+          - a context manager giving the connection
+        """
+        server = self.get_server(key)
+        pool = self.pools[server]
+
+        client = pool.acquire()
+        try:
+            yield client
+        finally:
+            pool.release(client)
+
+            if client.is_dead():
+                self.mark_dead(server)
+
+    def flush_all(self):
+        """Delete all the contents of all the servers
+        """
+        for server in self.pools:
+            memcache.Client([server], debug=self.debug).flush_all()
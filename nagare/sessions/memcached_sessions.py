@@ -7,45 +7,217 @@
 # this distribution.
 #--
 
-import time
+from __future__ import with_statement
 
-import memcache
+import time
+import random
+import threading
 
 from nagare import local
-from nagare.sessions import ExpirationError, common
+from nagare.sessions import ExpirationError, LockTimeoutError, common, memcached_pool
 from nagare.sessions.serializer import Pickle
 
 KEY_PREFIX = 'nagare_%d_'
 
 
+class LockCounters(object):
+    """Statistics about the acquisitions of the sessions locks
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Reset all the counters
+        """
+        self.acquisitions = 0    # Number of acquired locks
+        self.contentions = 0     # Number of locks not acquired at the first try
+        self.timeouts = 0        # Number of locks not acquired in time
+        self.losses = 0          # Number of locks expired while the state was processed
+        self.wait_time = 0.      # Total time spent to wait for the locks, in seconds
+        self.max_wait_time = 0.  # Longest wait for a lock, in seconds
+
+    def add_wait(self, wait_time, nb_tries, acquired):
+        """Record a lock acquisition
+
+        In:
+          - ``wait_time`` -- time spent to wait for the lock, in seconds
+          - ``nb_tries`` -- number of acquisition tries
+          - ``acquired`` -- was the lock acquired?
+        """
+        with self.lock:
+            if acquired:
+                self.acquisitions += 1
+            else:
+                self.timeouts += 1
+
+            if nb_tries > 1:
+                self.contentions += 1
+
+            self.wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+
+    def add_loss(self):
+        """Record a lock expired while the state was processed
+        """
+        with self.lock:
+            self.losses += 1
+
+
+def round_trip(nb=1):
+    """Count the round-trips to the memcached server of the current request
+
+    In:
+      - ``nb`` -- number of round-trips
+    """
+    local.request.memcached_round_trips = getattr(local.request, 'memcached_round_trips', 0) + nb
+
+
 class Lock(object):
-    def __init__(self, connection, lock_id, ttl, poll_time, max_wait_time):
+    def __init__(self, connections, lock_id, ttl, poll_time, max_poll_time, max_wait_time, counters=None):
         """Distributed lock in memcache
 
+        The session key is read with its CAS id and written back with a
+        compare-and-set, so a process whose lock expired can't overwrite the
+        session stored, meanwhile, by the new owner of the lock. As the CAS
+        id is read with the state, it costs no additional round-trip.
+
         In:
-          - ``connection`` -- connection object to the memcache server
+          - ``connections`` -- pools of connections to the memcached servers
           - ``lock_id`` -- unique lock identifier
           - ``ttl`` -- session locks timeout, in seconds (0 = no timeout)
-          - ``poll_time`` -- wait time between two lock acquisition tries, in seconds
+          - ``poll_time`` -- initial wait time between two lock acquisition tries, in seconds
+          - ``max_poll_time`` -- maximum wait time between two lock acquisition tries, in seconds
           - ``max_wait_time`` -- maximum time to wait to acquire the lock, in seconds
+          - ``counters`` -- the ``LockCounters`` where to record the acquisitions
         """
-        self.connection = connection
-        self.lock = (KEY_PREFIX + 'lock') % lock_id
+        self.connections = connections
+        self.lock_id = lock_id
+        self.prefix = KEY_PREFIX % lock_id
+        self.lock = self.prefix + 'lock'
         self.ttl = ttl
         self.poll_time = poll_time
+        self.max_poll_time = max_poll_time
         self.max_wait_time = max_wait_time
+        self.counters = counters or LockCounters()
+
+        self.owner = None  # Random value identifying the current acquisition
+        self.acquisition_time = None
+        self.cas_id = None  # CAS id of the session key when read (``None`` for a new session)
+        self.last_state_id = 0  # Id of the latest state when the session was read
+        self.state = (None, None)  # Id and CAS id of the state read
 
     def acquire(self):
         """Acquire the lock
+
+        Between two tries, the wait time is randomly chosen and its maximum
+        doubled each time ("exponential backoff with full jitter").
+
+        Raise:
+          - ``LockTimeoutError`` if the lock can't be acquired in ``max_wait_time`` seconds
         """
+        owner = random.getrandbits(48)
+
         t0 = time.time()
-        while not self.connection.add(self.lock, 1, self.ttl) and (time.time() < (t0 + self.max_wait_time)):
-            time.sleep(self.poll_time)
+        poll_time = self.poll_time
+        nb_tries = 1
+
+        round_trip()
+        while not self.add(owner):
+            remaining = t0 + self.max_wait_time - time.time()
+            if remaining <= 0:
+                self.counters.add_wait(time.time() - t0, nb_tries, False)
+                raise LockTimeoutError('lock "%s" not acquired after %.2fs' % (self.lock, self.max_wait_time))
+
+            time.sleep(min(remaining, random.uniform(0, poll_time)))
+            poll_time = min(poll_time * 2, self.max_poll_time)
+            nb_tries += 1
+
+            round_trip()
+
+        self.owner = owner
+        self.acquisition_time = time.time()
+        self.counters.add_wait(self.acquisition_time - t0, nb_tries, True)
+
+    def add(self, owner):
+        """Try to acquire the lock
+
+        In:
+          - ``owner`` -- value identifying this acquisition
+
+        Return:
+          - was the lock acquired?
+
+        Raise:
+          - ``LockTimeoutError`` if the memcached server is unavailable
+        """
+        with self.connections.connection(self.lock_id) as connection:
+            if connection.add(self.lock, owner, self.ttl):
+                return True
+
+            if connection.is_dead():
+                raise LockTimeoutError('lock "%s" not acquired: memcached server unavailable' % self.lock)
+
+            return False
+
+    def may_have_expired(self):
+        """Can the lock have expired since its acquisition?
+
+        The memcached server expires the keys with a resolution of 1 second
+
+        Return:
+          - a boolean
+        """
+        return bool(self.ttl) and (time.time() - self.acquisition_time > self.ttl - 1)
+
+    def check(self):
+        """Check that the lock is still acquired by us, before a state is stored
+
+        A round-trip to the memcached server is only done if the lock can
+        have expired
+
+        Raise:
+          - ``LockTimeoutError`` if the lock expired and was possibly acquired by an other process
+        """
+        if self.owner is None:
+            raise LockTimeoutError('lock "%s" not acquired' % self.lock)
+
+        if not self.may_have_expired():
+            return
+
+        round_trip()
+        with self.connections.connection(self.lock_id) as connection:
+            owner = connection.get(self.lock)
+
+        if owner != self.owner:
+            self.lost()
+
+    def lost(self):
+        """The lock was lost
+
+        Raise:
+          - ``LockTimeoutError``
+        """
+        self.counters.add_loss()
+        raise LockTimeoutError('lock "%s" lost' % self.lock)
 
     def release(self):
         """Release the lock
         """
-        self.connection.delete(self.lock)
+        if self.owner is None:
+            return
+
+        with self.connections.connection(self.lock_id) as connection:
+            # Don't release a lock expired and acquired by an other process
+            if self.may_have_expired():
+                round_trip()
+                if connection.get(self.lock) != self.owner:
+                    self.owner = None
+                    return
+
+            round_trip()
+            connection.delete(self.lock)
+            self.owner = None
 
 
 class Sessions(common.Sessions):
@@ -55,9 +227,13 @@ class Sessions(common.Sessions):
     spec.update(dict(
                 host='string(default="127.0.0.1")',
                 port='integer(default=11211)',
+                servers='string_list(default=list())',
+                pool_size='integer(default=10)',
+                dead_retry='integer(default=%d)' % memcached_pool.DEFAULT_DEAD_RETRY,
                 ttl='integer(default=0)',
                 lock_ttl='float(default=0.)',
-                lock_poll_time='float(default=0.1)',
+                lock_poll_time='float(default=0.01)',
+                lock_max_poll_time='float(default=0.5)',
                 lock_max_wait_time='float(default=5.)',
                 min_compress_len='integer(default=0)',
                 reset='boolean(default=True)',
@@ -68,8 +244,9 @@ class Sessions(common.Sessions):
     def __init__(
                  self,
                  host='127.0.0.1', port=11211,
+                 servers=(), pool_size=10, dead_retry=memcached_pool.DEFAULT_DEAD_RETRY,
                  ttl=0,
-                 lock_ttl=0, lock_poll_time=0.1, lock_max_wait_time=5,
+                 lock_ttl=0, lock_poll_time=0.01, lock_max_poll_time=0.5, lock_max_wait_time=5,
                  min_compress_len=0,
                  reset=False,
                  debug=True,
@@ -81,9 +258,13 @@ class Sessions(common.Sessions):
         In:
           - ``host`` -- address of the memcache server
           - ``port`` -- port of the memcache server
+          - ``servers`` -- list of ``"host:port"`` memcache servers (overwrite ``host`` and ``port``)
+          - ``pool_size`` -- maximum number of connections to each memcache server
+          - ``dead_retry`` -- time, in seconds, before a dead memcache server is retried
           - ``ttl`` -- sessions and continuations timeout, in seconds (0 = no timeout)
           - ``lock_ttl`` -- session locks timeout, in seconds (0 = no timeout)
-          - ``lock_poll_time`` -- wait time between two lock acquisition tries, in seconds
+          - ``lock_poll_time`` -- initial wait time between two lock acquisition tries, in seconds
+          - ``lock_max_poll_time`` -- maximum wait time between two lock acquisition tries, in seconds
           - ``lock_max_wait_time`` -- maximum time to wait to acquire the lock, in seconds
           - ``min_compress_len`` -- data longer than this value are sent compressed
           - ``reset`` -- do a reset of all the sessions on startup ?
@@ -92,13 +273,18 @@ class Sessions(common.Sessions):
         """
         super(Sessions, self).__init__(serializer or Pickle, **kw)
 
-        self.host = ['%s:%d' % (host, port)]
+        self.servers = list(servers) or ['%s:%d' % (host, port)]
+        self.pool_size = pool_size
+        self.dead_retry = dead_retry
         self.ttl = ttl
         self.lock_ttl = lock_ttl
         self.lock_poll_time = lock_poll_time
+        self.lock_max_poll_time = lock_max_poll_time
         self.lock_max_wait_time = lock_max_wait_time
         self.min_compress_len = min_compress_len
         self.debug = debug
+        self.lock_counters = LockCounters()
+        self.connections = memcached_pool.Servers(self.servers, pool_size, debug, dead_retry)
 
         if reset:
             self.flush_all()
@@ -114,39 +300,26 @@ class Sessions(common.Sessions):
         # Let's the super class validate the configuration file
         conf = super(Sessions, self).set_config(filename, conf, error)
 
-        self.host = ['%s:%d' % (conf['host'], conf['port'])]
+        self.servers = conf['servers'] or ['%s:%d' % (conf['host'], conf['port'])]
 
         for arg_name in (
-                            'ttl', 'lock_ttl', 'lock_poll_time', 'lock_max_wait_time',
+                            'pool_size', 'dead_retry',
+                            'ttl', 'lock_ttl', 'lock_poll_time', 'lock_max_poll_time', 'lock_max_wait_time',
                             'min_compress_len', 'debug'
                           ):
             setattr(self, arg_name, conf[arg_name])
 
+        self.connections = memcached_pool.Servers(self.servers, self.pool_size, self.debug, self.dead_retry)
+
         if conf['reset']:
             self.flush_all()
 
         return conf
 
-    def _get_connection(self):
-        """Get the connection to the memcache server
-
-        Return:
-          - the connection
-        """
-        # The connection objects are local to the workers
-        connection = getattr(local.worker, 'memcached_connection', None)
-
-        if connection is None:
-            connection = memcache.Client(self.host, debug=self.debug)
-            local.worker.memcached_connection = connection
-
-        return connection
-
     def flush_all(self):
-        """Delete all the contents in the memcached server
+        """Delete all the contents in the memcached servers
         """
-        memcached = memcache.Client(self.host, debug=self.debug)
-        memcached.flush_all()
+        self.connections.flush_all()
 
     def get_lock(self, session_id):
         """Retrieve the lock of a session
@@ -157,8 +330,16 @@ class Sessions(common.Sessions):
         Return:
           - the lock
         """
-        connection = self._get_connection()
-        return Lock(connection, session_id, self.lock_ttl, self.lock_poll_time, self.lock_max_wait_time)
+        lock = Lock(
+                    self.connections, session_id,
+                    self.lock_ttl, self.lock_poll_time, self.lock_max_poll_time, self.lock_max_wait_time,
+                    self.lock_counters
+                   )
+
+        # The lock of the current request, keeping the CAS id of the session
+        local.request.memcached_lock = lock
+
+        return lock
 
     def create(self, session_id, secure_id, lock):
         """Create a new session
@@ -168,11 +349,16 @@ class Sessions(common.Sessions):
           - ``secure_id`` -- the secure number associated to the session
           - ``lock`` -- the lock of the session
         """
-        self._get_connection().set_multi({
-            'state': 0,
-            'sess': (secure_id, None),
-            '00000': {}
-        }, self.ttl, KEY_PREFIX % session_id, self.min_compress_len)
+        round_trip()
+        with self.connections.connection(session_id) as connection:
+            connection.set_multi({
+                'sess': (0, secure_id, None),
+                '00000': {}
+            }, self.ttl, KEY_PREFIX % session_id, self.min_compress_len)
+
+        # New session, only known by the current request
+        lock.cas_id = None
+        lock.last_state_id = 0
 
     def delete(self, session_id):
         """Delete a session
@@ -180,7 +366,9 @@ class Sessions(common.Sessions):
         In:
           - ``session_id`` -- id of the session to delete
         """
-        self._get_connection().delete((KEY_PREFIX + 'sess') % session_id)
+        round_trip()
+        with self.connections.connection(session_id) as connection:
+            connection.delete((KEY_PREFIX + 'sess') % session_id)
 
     def fetch_state(self, session_id, state_id):
         """Retrieve a state with its associated objects graph
@@ -196,15 +384,32 @@ class Sessions(common.Sessions):
           - data kept into the state
         """
         state_id = '%05d' % state_id
-        session = self._get_connection().get_multi(('state', 'sess', state_id), KEY_PREFIX % session_id)
 
-        if len(session) != 3:
+        round_trip()
+        with self.connections.connection(session_id) as connection:
+            session, cas_ids = connection.gets_multi(('sess', 'state', state_id), KEY_PREFIX % session_id)
+
+        if ('sess' not in session) or (state_id not in session):
             raise ExpirationError()
 
-        last_state_id = session['state']
-        secure_id, session_data = session['sess']
+        session_data = session['sess']
+        if len(session_data) == 2:
+            # Session stored by a previous version, with the id of its latest
+            # state in its own key: migrated when the next state is stored
+            if 'state' not in session:
+                raise ExpirationError()
+
+            session_data = (session['state'],) + session_data
+
+        last_state_id, secure_id, session_data = session_data
         state_data = session[state_id]
 
+        # The session will be stored only if not modified meanwhile
+        lock = local.request.memcached_lock
+        lock.cas_id = cas_ids['sess']
+        lock.last_state_id = last_state_id
+        lock.state = (int(state_id), cas_ids[state_id])
+
         return last_state_id, secure_id, session_data, state_data
 
     def store_state(self, session_id, state_id, secure_id, use_same_state, session_data, state_data):
@@ -218,10 +423,42 @@ class Sessions(common.Sessions):
           - ``session_data`` -- data to keep into the session
           - ``state_data`` -- data to keep into the state
         """
-        if not use_same_state:
-            self._get_connection().incr((KEY_PREFIX + 'state') % session_id)
+        # Check the lock wasn't lost while the state was processed
+        lock = local.request.memcached_lock
+        lock.check()
 
-        self._get_connection().set_multi({
-            'sess': (secure_id, session_data),
-            '%05d' % state_id: state_data
-        }, self.ttl, KEY_PREFIX % session_id, self.min_compress_len)
+        if not use_same_state:
+            # As the session is locked, the id of the latest state is written
+            # with the session instead of incremented in its own round-trip
+            lock.last_state_id = state_id + 1
+
+        session = (lock.last_state_id, secure_id, session_data)
+        state_key = '%05d' % state_id
+
+        if lock.cas_id is None:
+            # New session, only known by the current request
+            commands = [('set', 'sess', session, None), ('set', state_key, state_data, None)]
+        else:
+            # A process which lost its lock must not overwrite the states of
+            # the new owner: a new state is only added and the state read
+            # only replaced if not modified meanwhile
+            fetched_state_id, state_cas_id = lock.state
+            commands = [
+                ('cas', 'sess', session, lock.cas_id),
+                ('cas', state_key, state_data, state_cas_id) if state_id == fetched_state_id else ('add', state_key, state_data, None)
+            ]
+
+        with self.connections.connection(session_id) as connection:
+            # The session and the state are sent in one round-trip
+            round_trip()
+            session_stored, state_stored = connection.store_multi(commands, self.ttl, KEY_PREFIX % session_id, self.min_compress_len)
+
+            if not session_stored:
+                # The session was stored by an other process
+                lock.lost()
+
+            if not state_stored:
+                # The session is ours: the state was written by a process
+                # which lost its lock
+                round_trip()
+                connection.set(KEY_PREFIX % session_id + state_key, state_data, self.ttl, self.min_compress_len)
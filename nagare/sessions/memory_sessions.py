@@ -12,11 +12,14 @@
 These sessions managers keep:
   - the last recently used ``DEFAULT_NB_SESSIONS`` sessions
   - for each session, the last recently used ``DEFAULT_NB_STATES`` states
+
+The memory used by the pickled states can also be limited, the last
+recently used sessions being deleted when the limit is reached.
 """
 
 from nagare import local
 from nagare.sessions import ExpirationError, common, lru_dict
-from nagare.sessions.serializer import Pickle
+from nagare.sessions.serializer import Pickle, Delta
 
 DEFAULT_NB_SESSIONS = 10000
 DEFAULT_NB_STATES = 20
@@ -28,18 +31,20 @@ class Sessions(common.Sessions):
     spec = common.Sessions.spec.copy()
     spec['nb_sessions'] = 'integer(default=%d)' % DEFAULT_NB_SESSIONS
     spec['nb_states'] = 'integer(default=%d)' % DEFAULT_NB_STATES
+    spec['max_memory'] = 'integer(default=0)'
 
-    def __init__(self, nb_sessions=DEFAULT_NB_SESSIONS, nb_states=DEFAULT_NB_STATES, **kw):
+    def __init__(self, nb_sessions=DEFAULT_NB_SESSIONS, nb_states=DEFAULT_NB_STATES, max_memory=0, **kw):
         """Initialization
 
         In:
           - ``nb_sessions`` -- maximum number of sessions kept in memory
           - ``nb_states`` -- maximum number of states, for each sessions, kept in memory
+          - ``max_memory`` -- maximum size, in bytes, of all the states kept in memory (``0`` for no limit)
         """
         super(Sessions, self).__init__(**kw)
 
         self.nb_states = nb_states
-        self._sessions = lru_dict.ThreadSafeLRUDict(nb_sessions)
+        self._sessions = lru_dict.ThreadSafeLRUDict(nb_sessions, max_memory)
 
     def set_config(self, filename, conf, error):
         """Read the configuration parameters
@@ -53,7 +58,7 @@ class Sessions(common.Sessions):
         conf = super(Sessions, self).set_config(filename, conf, error)
 
         self.nb_states = conf['nb_states']
-        self._sessions = lru_dict.ThreadSafeLRUDict(conf['nb_sessions'])
+        self._sessions = lru_dict.ThreadSafeLRUDict(conf['nb_sessions'], conf['max_memory'])
 
         return conf
 
@@ -101,7 +106,7 @@ class Sessions(common.Sessions):
           - ``secure_id`` -- the secure number associated to the session
           - ``lock`` -- the lock of the session
         """
-        self._sessions[session_id] = [0, lock, secure_id, None, lru_dict.LRUDict(self.nb_states)]
+        self._sessions[session_id] = [0, lock, secure_id, None, lru_dict.LRUDict(self.nb_states, sizeof=self.sizeof_state)]
 
     def delete(self, session_id):
         """Delete a session
@@ -125,7 +130,7 @@ class Sessions(common.Sessions):
           - data kept into the state
         """
         try:
-            last_state_id, _, secure_id, session_data, states = self._sessions[session_id]
+            last_state_id, _, secure_id, session_data, states = self._sessions[session_id][:5]
             state_data = states[state_id]
         except KeyError:
             raise ExpirationError()
@@ -151,17 +156,144 @@ class Sessions(common.Sessions):
         session[3] = session_data
         session[4][state_id] = state_data
 
+        self._sessions.set_memory(session_id, self.sizeof_states(session[4]))
+
+    def sizeof_states(self, states):
+        """Return the memory size of all the states of a session
+
+        In:
+          - ``states`` -- the LRU dictionary of the states
+
+        Return:
+          - size of the states, in bytes
+        """
+        return states.memory
+
+    def sizeof_state(self, state_data):
+        """Return the memory size of a state
+
+        The objects graphs are not measured so, with this sessions manager,
+        the ``max_memory`` limit is never reached
+
+        In:
+          - ``state_data`` -- data kept into the state
+
+        Return:
+          - size of the state, in bytes
+        """
+        return 0
+
 
 class SessionsWithPickledStates(Sessions):
     """Sessions manager for states pickled / unpickled in memory
+
+    With the ``delta`` option, the states are pickled component by component
+    and a state only keeps the pickles of the components modified since the
+    previous state. The others pickles are shared with the previous state.
     """
     spec = Sessions.spec.copy()
     spec['serializer'] = 'string(default="nagare.sessions.serializer:Pickle")'
+    spec['delta'] = 'boolean(default=False)'
 
-    def __init__(self, serializer=None, **kw):
+    def __init__(self, serializer=None, delta=False, **kw):
         """Initialization
 
         In:
           - ``serializer`` -- serializer / deserializer of the states
+          - ``delta`` -- share the unmodified components pickles between the states?
+        """
+        if delta and (serializer is not None) and not issubclass(serializer, Delta):
+            raise ValueError('the delta option needs a serializer derived from %s.Delta' % Delta.__module__)
+
+        super(SessionsWithPickledStates, self).__init__(serializer=serializer or (Delta if delta else Pickle), **kw)
+        self.delta = delta
+
+    def set_config(self, filename, conf, error):
+        """Read the configuration parameters
+
+        In:
+          - ``filename`` -- path to the configuration file
+          - ``conf`` -- ``ConfigObj`` object created from the configuration file
+          - ``error`` -- function to call in case of configuration errors
+        """
+        # Let's the super class validate the configuration file
+        conf = super(SessionsWithPickledStates, self).set_config(filename, conf, error)
+
+        self.delta = conf['delta']
+        if self.delta and not isinstance(self.serializer, Delta):
+            if type(self.serializer) is Pickle:
+                self.serializer = Delta(self.serializer.pickler, self.serializer.unpickler, self.serializer.codec)
+            else:
+                # A configured serializer can't be replaced
+                error('the "delta" option needs a serializer derived from %s.Delta' % Delta.__module__)
+
+        return conf
+
+    def create(self, session_id, secure_id, lock):
+        """Create a new session
+
+        In:
+          - ``session_id`` -- id of the session
+          - ``secure_id`` -- the secure number associated to the session
+          - ``lock`` -- the lock of the session
+        """
+        super(SessionsWithPickledStates, self).create(session_id, secure_id, lock)
+
+        # The pickles of the latest stored state
+        self._sessions[session_id].append({})
+
+    def store_state(self, session_id, state_id, secure_id, use_same_state, session_data, state_data):
+        """Store a state and its associated objects graph
+
+        In:
+          - ``session_id`` -- session id of this state
+          - ``state_id`` -- id of this state
+          - ``secure_id`` -- the secure number associated to the session
+          - ``use_same_state`` -- is this state to be stored in the previous snapshot?
+          - ``session_data`` -- data to keep into the session
+          - ``state_data`` -- data to keep into the state
         """
-        super(SessionsWithPickledStates, self).__init__(serializer=serializer or Pickle, **kw)
+        if self.delta:
+            latest = self._sessions[session_id][5]
+
+            # Share the unmodified pickles with the latest stored state
+            index, chunks = state_data
+            chunks = [latest.get(chunk, chunk) for chunk in chunks]
+
+            latest.clear()
+            latest.update((chunk, chunk) for chunk in chunks)
+
+            state_data = (index, chunks)
+
+        super(SessionsWithPickledStates, self).store_state(session_id, state_id, secure_id, use_same_state, session_data, state_data)
+
+    def sizeof_state(self, state_data):
+        """Return the memory size of a state
+
+        In:
+          - ``state_data`` -- data kept into the state
+
+        Return:
+          - size of the state, in bytes
+        """
+        if not self.delta:
+            return len(state_data)
+
+        # The pickles shared with others states are counted several times
+        return sum(len(chunk) for chunk in state_data[1])
+
+    def sizeof_states(self, states):
+        """Return the memory size of all the states of a session
+
+        In:
+          - ``states`` -- the LRU dictionary of the states
+
+        Return:
+          - size of the states, in bytes
+        """
+        if not self.delta:
+            return states.memory
+
+        # The pickles shared between the states are only counted once
+        chunks = dict((id(chunk), chunk) for (index, state_chunks) in states.values() for chunk in state_chunks)
+        return sum(len(chunk) for chunk in chunks.itervalues())
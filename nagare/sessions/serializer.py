@@ -7,11 +7,15 @@
 # this distribution.
 #--
 
+import types
+import random
 import cStringIO
 import cPickle
 
+from nagare.callbacks import Callbacks
 from nagare.continuation import Tasklet
 from nagare.component import Component
+from nagare.sessions import compression
 
 
 def persistent_id(o, clean_callbacks, callbacks, session_data, tasklets):
@@ -58,16 +62,26 @@ class DummyFile(object):
     def write(self, data):
         pass
 
+# Objects duplicated instead of shared between the chunks of the ``Delta`` serializer
+DELTA_UNSHARED_TYPES = frozenset((
+    types.NoneType, bool, int, long, float, complex, str, unicode, tuple,
+    type, types.ClassType, types.BuiltinFunctionType, types.ModuleType
+))
+
 
 class Dummy(object):
-    def __init__(self, pickler=None, unpickler=None):
+    snapshots = False  # Are the deserialized objects graphs independent copies of the states?
+
+    def __init__(self, pickler=None, unpickler=None, codec=None):
         """Initialization
 
           - ``pickler`` -- pickler to use
           - ``unpickler`` -- unpickler to use
+          - ``codec`` -- codec to encode / decode the pickles
         """
         self.pickler = pickler or cPickle.Pickler
         self.unpickler = unpickler or cPickle.Unpickler
+        self.codec = codec or compression.Identity()
 
     def _dumps(self, pickler, data, clean_callbacks):
         """Serialize an objects graph
@@ -83,7 +97,7 @@ class Dummy(object):
         """
         session_data = {}
         tasklets = set()
-        callbacks = {}
+        callbacks = Callbacks()
 
         # Serialize the objects graph and extract all the callbacks
         set_persistent_id(pickler, lambda o: persistent_id(o, clean_callbacks, callbacks, session_data, tasklets))
@@ -123,6 +137,8 @@ class Dummy(object):
 
 
 class Pickle(Dummy):
+    snapshots = True
+
     def dumps(self, data, clean_callbacks):
         """Serialize an objects graph
 
@@ -148,7 +164,7 @@ class Pickle(Dummy):
             t.kill()
 
         # The pickled data are returned
-        return (session_data, f.getvalue())
+        return (session_data, self.codec.encode(f.getvalue()))
 
     def loads(self, session_data, state_data):
         """Deserialize an objects graph
@@ -161,8 +177,163 @@ class Pickle(Dummy):
           - the objects graph
           - the callbacks
         """
-        p = self.unpickler(cStringIO.StringIO(state_data))
+        p = self.unpickler(cStringIO.StringIO(self.codec.decode(state_data)))
         if session_data:
             p.persistent_load = lambda i: session_data.get(int(i))
 
         return p.load(), p.load()
+
+
+class Delta(Pickle):
+    """Pickle each component of an objects graph into its own chunk
+
+    The chunk of a component is not modified if the component is not modified,
+    so the unchanged chunks can be shared between consecutive states.
+
+    A component is referenced in the other chunks by a persistent id
+    (``c<key>``) and an object pickled into a previous chunk is referenced by
+    its memo position (``r<key>:<position>``), to keep the objects identities.
+    The callbacks of the components are pickled into a dedicated last chunk.
+    """
+    def dumps(self, data, clean_callbacks):
+        """Serialize an objects graph
+
+        In:
+          - ``data`` -- the objects graph
+          - ``clean_callbacks`` -- do we have to forget the old callbacks?
+
+        Out:
+          - data kept into the session
+          - data kept into the state: the components keys and classes, and the chunks
+        """
+        session_data = {}
+        tasklets = set()
+        components = []  # The components, in pickling order
+        keys = set()     # The keys of the components
+        refs = {}        # Dict: id -> persistent id of the components
+        pickled = {}     # Dict: id -> (memo position, object) of the objects pickled in the previous chunks
+        owners = {}      # Dict: id -> key of the chunk where the object was pickled
+
+        def persistent_id(o):
+            if type(o) in DELTA_UNSHARED_TYPES:
+                # Immutable objects can be duplicated into several chunks
+                return None
+
+            ref = refs.get(id(o))
+            if ref is not None:
+                return ref
+
+            memo = pickled.get(id(o))
+            if memo is not None:
+                return 'r%s:%d' % (owners[id(o)], memo[0])
+
+            id_ = getattr(o, '_persistent_id', None)
+            if id_ is not None:
+                session_data[id_] = o
+                return str(id_)
+
+            if isinstance(o, Component):
+                # Keep the same key for a component between two states
+                key = o.__dict__.get('_chunk_key')
+                while (key is None) or (key in keys):
+                    key = random.randint(10000000, 99999999)
+                keys.add(key)
+
+                o._chunk_key = key
+                components.append(o)
+                refs[id(o)] = ref = 'c%d' % key
+                return ref
+
+            if type(o) is Tasklet:
+                tasklets.add(o)
+
+            return None
+
+        f = cStringIO.StringIO()
+        pickler = self.pickler(f, protocol=-1)
+        pickler.persistent_id = persistent_id
+
+        def dump(key, o):
+            f.seek(0)
+            f.truncate()
+            pickler.clear_memo()
+            pickler.dump(o)
+
+            # The objects of this chunk can be referenced by the next chunks
+            pickled.update(pickler.memo)
+            owners.update(dict.fromkeys(pickler.memo, key))
+
+            return self.codec.encode(f.getvalue())
+
+        chunks = [dump('', data)]
+
+        index = []
+        callbacks = {}  # Dict: key of a component -> callbacks of the component
+
+        # The list of the components grows as they are pickled
+        for comp in components:
+            key = comp._chunk_key
+
+            new = comp.serialize_callbacks(clean_callbacks)
+            if new:
+                callbacks[key] = new
+
+            index.append((key, comp.__class__))
+            chunks.append(dump(key, dict((k, v) for (k, v) in comp.__dict__.iteritems() if k not in ('_callbacks', '_chunk_key'))))
+
+        chunks.append(dump('callbacks', callbacks))
+
+        # Kill all the blocked tasklets, which are now serialized
+        for t in tasklets:
+            t.kill()
+
+        return (session_data, (index, chunks))
+
+    def loads(self, session_data, state_data):
+        """Deserialize an objects graph
+
+        In:
+          - ``session_data`` -- data from the session
+          - ``state_data`` -- data from the state
+
+        Out:
+          - the objects graph
+          - the callbacks
+        """
+        index, chunks = state_data
+
+        # Create all the components, filled when their chunk is unpickled
+        components = dict((key, cls.__new__(cls)) for (key, cls) in index)
+        memos = {}
+
+        def persistent_load(ref):
+            if ref[0] == 'c':
+                return components[int(ref[1:])]
+
+            if ref[0] == 'r':
+                key, position = ref[1:].split(':')
+                return memos[key][int(position)]
+
+            return session_data.get(int(ref))
+
+        def load(key, chunk):
+            p = self.unpickler(cStringIO.StringIO(self.codec.decode(chunk)))
+            p.persistent_load = persistent_load
+            o = p.load()
+
+            memos[str(key)] = p.memo
+            return o
+
+        data = load('', chunks[0])
+
+        for (key, cls), chunk in zip(index, chunks[1:-1]):
+            comp = components[key]
+            comp.__dict__.update(load(key, chunk))
+            comp._chunk_key = key
+
+        callbacks = Callbacks()
+        for key, new in load('callbacks', chunks[-1]).iteritems():
+            components[key]._callbacks = new
+            callbacks.update(new)
+
+        return data, callbacks
@@ -0,0 +1,542 @@
+#--
+# Copyright (c) 2008-2013 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+#--
+
+"""Sessions kept in memory by a local server, shared by several processes
+
+With a multi-processes publisher (i.e ``fastcgi``), the sessions kept in
+the memory of a process are unknown to the others processes. Here the
+pickled states are kept by a sessions server, started before the processes
+are forked, and all the processes talk to it through an unix socket.
+
+The locks of the sessions are also kept by the server, so a session is
+locked across all the processes. A lock held by a process that dies is
+automatically released.
+"""
+
+from __future__ import with_statement
+
+import os
+import time
+import errno
+import socket
+import atexit
+import signal
+import tempfile
+import threading
+from multiprocessing import connection
+
+from nagare.sessions import ExpirationError, LockTimeoutError, common, memory_sessions
+from nagare.sessions.serializer import Pickle
+
+
+class SessionLock(object):
+    """Lock of a session, in the sessions server
+
+    The lock is owned by a connection, i.e by a process (or a thread of a process)
+    """
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.owner = None
+
+    def acquire(self, owner, timeout):
+        """Acquire the lock
+
+        In:
+          - ``owner`` -- the connection acquiring the lock
+          - ``timeout`` -- maximum time to wait for the lock, in seconds
+
+        Return:
+          - was the lock acquired?
+        """
+        with self.condition:
+            deadline = time.time() + timeout
+
+            while self.owner is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+
+                self.condition.wait(remaining)
+
+            self.owner = owner
+            return True
+
+    def release(self, owner):
+        """Release the lock, if owned
+
+        In:
+          - ``owner`` -- the connection releasing the lock
+        """
+        with self.condition:
+            if self.owner is owner:
+                self.owner = None
+                self.condition.notify()
+
+
+class Store(memory_sessions.Sessions):
+    """The sessions, with their pickled states, kept by the sessions server"""
+
+    def sizeof_state(self, state_data):
+        """Return the memory size of a state
+
+        In:
+          - ``state_data`` -- the pickled state
+
+        Return:
+          - size of the state, in bytes
+        """
+        return len(state_data)
+
+
+class Server(object):
+    """Sessions server, listening to an unix socket
+
+    Each connection is served by a dedicated thread
+    """
+    def __init__(self, address, authkey=None, nb_sessions=memory_sessions.DEFAULT_NB_SESSIONS, nb_states=memory_sessions.DEFAULT_NB_STATES, max_memory=0):
+        """Initialization
+
+        In:
+          - ``address`` -- path of the unix socket
+          - ``authkey`` -- secret key the processes must know to connect (``None`` for no authentication)
+          - ``nb_sessions`` -- maximum number of sessions kept in memory
+          - ``nb_states`` -- maximum number of states, for each sessions, kept in memory
+          - ``max_memory`` -- maximum size, in bytes, of all the states kept in memory (``0`` for no limit)
+        """
+        self.address = address
+        self.authkey = authkey
+        self.store = Store(nb_sessions, nb_states, max_memory)
+
+    def serve_forever(self, ready=None):
+        """Accept the connections
+
+        In:
+          - ``ready`` -- function called when the server is listening
+        """
+        if os.path.exists(self.address):
+            if self.is_listening():
+                raise IOError('a sessions server is already listening on "%s"' % self.address)
+
+            # Socket of a previous, dead, server
+            os.unlink(self.address)
+
+        listener = connection.Listener(self.address, 'AF_UNIX', authkey=self.authkey)
+        if ready is not None:
+            ready()
+
+        while True:
+            try:
+                conn = listener.accept()
+            except (IOError, EOFError, connection.AuthenticationError):
+                continue
+
+            t = threading.Thread(target=self.handle, args=(conn,))
+            t.setDaemon(True)
+            t.start()
+
+    def is_listening(self):
+        """Is a server listening on the unix socket?
+
+        Return:
+          - a boolean
+        """
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            s.connect(self.address)
+        except socket.error, e:
+            if e.args[0] in (errno.ECONNREFUSED, errno.ENOENT):
+                return False
+            raise
+        finally:
+            s.close()
+
+        return True
+
+    def handle(self, conn):
+        """Serve the requests of a connection
+
+        In:
+          - ``conn`` -- the connection
+        """
+        locks = {}  # The sessions locks owned by this connection
+
+        try:
+            while True:
+                try:
+                    method, args = conn.recv()
+                except (IOError, EOFError):
+                    break
+
+                try:
+                    result = (True, getattr(self, 'do_' + method)(conn, locks, *args))
+                except Exception, e:
+                    result = (False, e)
+
+                conn.send(result)
+        finally:
+            # The process died or closed the connection without releasing its locks
+            for lock in locks.values():
+                lock.release(conn)
+
+            conn.close()
+
+    def do_check_session_id(self, conn, locks, session_id):
+        return self.store.check_session_id(session_id)
+
+    def do_create(self, conn, locks, session_id, secure_id):
+        self.store.create(session_id, secure_id, SessionLock())
+
+    def do_delete(self, conn, locks, session_id):
+        self.store.delete(session_id)
+
+    def do_fetch_state(self, conn, locks, session_id, state_id):
+        return self.store.fetch_state(session_id, state_id)
+
+    def do_store_state(self, conn, locks, session_id, state_id, secure_id, use_same_state, session_data, state_data):
+        self.store.store_state(session_id, state_id, secure_id, use_same_state, session_data, state_data)
+
+    def do_acquire(self, conn, locks, session_id, timeout):
+        try:
+            lock = self.store.get_lock(session_id)
+        except ExpirationError:
+            # The expiration is reported when the state is fetched
+            return False
+
+        if not lock.acquire(conn, timeout):
+            raise LockTimeoutError('lock of session %d not acquired after %.2fs' % (session_id, timeout))
+
+        locks[session_id] = lock
+        return True
+
+    def do_release(self, conn, locks, session_id):
+        lock = locks.pop(session_id, None)
+        if lock is not None:
+            lock.release(conn)
+
+
+class Client(object):
+    """Connections of a process to the sessions server
+
+    Each thread of each process uses its own connection
+    """
+    def __init__(self, address, authkey=None):
+        """Initialization
+
+        In:
+          - ``address`` -- path of the unix socket
+          - ``authkey`` -- secret key of the server (``None`` for no authentication)
+        """
+        self.address = address
+        self.authkey = authkey
+        self.local = threading.local()
+
+    def get_connection(self):
+        """Return the connection of the current thread
+
+        Return:
+          - the connection
+        """
+        pid = os.getpid()
+
+        # A connection inherited from the parent process can't be used
+        if getattr(self.local, 'pid', None) != pid:
+            self.local.connection = connection.Client(self.address, 'AF_UNIX', authkey=self.authkey)
+            self.local.pid = pid
+
+        return self.local.connection
+
+    def call(self, method, *args):
+        """Remote call of a method of the sessions server
+
+        In:
+          - ``method`` -- name of the method
+          - ``args`` -- arguments of the method
+
+        Return:
+          - the result of the method
+        """
+        conn = self.get_connection()
+
+        conn.send((method, args))
+        ok, result = conn.recv()
+        if not ok:
+            raise result
+
+        return result
+
+
+class Lock(object):
+    def __init__(self, client, session_id, max_wait_time):
+        """Lock of a session, kept by the sessions server
+
+        In:
+          - ``client`` -- connections to the sessions server
+          - ``session_id`` -- session id
+          - ``max_wait_time`` -- maximum time to wait to acquire the lock, in seconds
+        """
+        self.client = client
+        self.session_id = session_id
+        self.max_wait_time = max_wait_time
+        self.acquired = False
+
+    def acquire(self):
+        """Acquire the lock
+
+        Raise:
+          - ``LockTimeoutError`` if the lock can't be acquired in ``max_wait_time`` seconds
+        """
+        self.acquired = self.client.call('acquire', self.session_id, self.max_wait_time)
+
+    def release(self):
+        """Release the lock
+        """
+        if self.acquired:
+            self.client.call('release', self.session_id)
+            self.acquired = False
+
+
+class NewLock(object):
+    """Lock of a new session
+
+    Nobody else knowing the session yet, the lock is never contended
+    """
+    def acquire(self):
+        pass
+
+    def release(self):
+        pass
+
+
+class Sessions(common.Sessions):
+    """Sessions manager for sessions kept by a sessions server shared by several processes
+    """
+    spec = common.Sessions.spec.copy()
+    spec.update(dict(
+                address='string(default="")',
+                authkey='string(default="")',
+                start_server='boolean(default=True)',
+                nb_sessions='integer(default=%d)' % memory_sessions.DEFAULT_NB_SESSIONS,
+                nb_states='integer(default=%d)' % memory_sessions.DEFAULT_NB_STATES,
+                max_memory='integer(default=0)',
+                lock_max_wait_time='float(default=5.)',
+                serializer='string(default="nagare.sessions.serializer:Pickle")'
+               ))
+
+    def __init__(
+                    self,
+                    address='', authkey='', start_server=False,
+                    nb_sessions=memory_sessions.DEFAULT_NB_SESSIONS, nb_states=memory_sessions.DEFAULT_NB_STATES,
+                    max_memory=0,
+                    lock_max_wait_time=5,
+                    serializer=None,
+                    **kw
+                ):
+        """Initialization
+
+        In:
+          - ``address`` -- path of the unix socket of the sessions server (a new temporary file by default)
+          - ``authkey`` -- secret key of the sessions server (random if the server is started, else no authentication)
+          - ``start_server`` -- start the sessions server?
+          - ``nb_sessions`` -- maximum number of sessions kept by the server
+          - ``nb_states`` -- maximum number of states, for each sessions, kept by the server
+          - ``max_memory`` -- maximum size, in bytes, of all the states kept by the server (``0`` for no limit)
+          - ``lock_max_wait_time`` -- maximum time to wait to acquire the lock, in seconds
+          - ``serializer`` -- serializer / deserializer of the states
+        """
+        super(Sessions, self).__init__(serializer=serializer or Pickle, **kw)
+
+        self.lock_max_wait_time = lock_max_wait_time
+        self.server_pid = None
+
+        self.configure(address, authkey, start_server, nb_sessions, nb_states, max_memory)
+
+    def set_config(self, filename, conf, error):
+        """Read the configuration parameters
+
+        In:
+          - ``filename`` -- path to the configuration file
+          - ``conf`` -- ``ConfigObj`` object created from the configuration file
+          - ``error`` -- function to call in case of configuration errors
+        """
+        # Let's the super class validate the configuration file
+        conf = super(Sessions, self).set_config(filename, conf, error)
+
+        self.lock_max_wait_time = conf['lock_max_wait_time']
+        self.configure(
+                        conf['address'], conf['authkey'], conf['start_server'],
+                        conf['nb_sessions'], conf['nb_states'], conf['max_memory']
+                      )
+
+        return conf
+
+    def configure(self, address, authkey, start_server, nb_sessions, nb_states, max_memory):
+        """Connect to the sessions server, after having started it
+
+        In:
+          - ``address`` -- path of the unix socket of the sessions server
+          - ``authkey`` -- secret key of the sessions server
+          - ``start_server`` -- start the sessions server?
+          - ``nb_sessions`` -- maximum number of sessions kept by the server
+          - ``nb_states`` -- maximum number of states, for each sessions, kept by the server
+          - ``max_memory`` -- maximum size, in bytes, of all the states kept by the server
+        """
+        if not address:
+            # Each sessions manager of the process has its own server
+            address = os.path.join(tempfile.gettempdir(), 'nagare-sessions-%d-%s' % (os.getpid(), os.urandom(8).encode('hex')))
+
+        if start_server and not authkey:
+            authkey = os.urandom(20)
+
+        if start_server:
+            self.start_server(Server(address, authkey or None, nb_sessions, nb_states, max_memory))
+
+        self.client = Client(address, authkey or None)
+
+    def start_server(self, server):
+        """Launch the sessions server in a new process
+
+        The server must be started before the processes using it are forked
+
+        In:
+          - ``server`` -- the sessions server
+        """
+        self.stop_server()
+
+        r, w = os.pipe()
+        parent = os.getpid()
+
+        pid = os.fork()
+        if not pid:
+            # Sessions server process
+            # -----------------------
+
+            os.close(r)
+
+            def watch_parent():
+                # Exit when the parent process is dead
+                while os.getppid() == parent:
+                    time.sleep(1)
+                os._exit(0)
+
+            t = threading.Thread(target=watch_parent)
+            t.setDaemon(True)
+            t.start()
+
+            try:
+                server.serve_forever(lambda: os.write(w, 'r'))
+            finally:
+                os._exit(1)
+
+        # Wait until the server is listening
+        os.close(w)
+        ready = os.read(r, 1)
+        os.close(r)
+
+        if not ready:
+            os.waitpid(pid, 0)
+            raise IOError('sessions server not started on "%s"' % server.address)
+
+        self.server_pid = pid
+        self.server_address = server.address
+        atexit.register(self.stop_server, parent)
+
+    def stop_server(self, parent=None):
+        """Stop the sessions server launched by this process
+
+        In:
+          - ``parent`` -- only stop the server if the current process is this one
+        """
+        if self.server_pid and (parent in (None, os.getpid())):
+            try:
+                os.kill(self.server_pid, signal.SIGTERM)
+                os.waitpid(self.server_pid, 0)
+                os.unlink(self.server_address)
+            except OSError:
+                pass
+
+            self.server_pid = None
+
+    def check_session_id(self, session_id):
+        """Test if a session exist
+
+        In:
+          - ``session_id`` -- id of a session
+
+        Return:
+          - is ``session_id`` the id of an existing session?
+        """
+        return self.client.call('check_session_id', session_id)
+
+    def create_lock(self, session_id):
+        """Create a new lock for a session
+
+        In:
+          - ``session_id`` -- session id
+
+        Return:
+          - the lock
+        """
+        return NewLock()
+
+    def get_lock(self, session_id):
+        """Retrieve the lock of a session
+
+        In:
+          - ``session_id`` -- session id
+
+        Return:
+          - the lock
+        """
+        return Lock(self.client, session_id, self.lock_max_wait_time)
+
+    def create(self, session_id, secure_id, lock):
+        """Create a new session
+
+        In:
+          - ``session_id`` -- id of the session
+          - ``secure_id`` -- the secure number associated to the session
+          - ``lock`` -- the lock of the session
+        """
+        self.client.call('create', session_id, secure_id)
+
+    def delete(self, session_id):
+        """Delete a session
+
+        In:
+          - ``session_id`` -- id of the session to delete
+        """
+        self.client.call('delete', session_id)
+
+    def fetch_state(self, session_id, state_id):
+        """Retrieve a state with its associated objects graph
+
+        In:
+          - ``session_id`` -- session id of this state
+          - ``state_id`` -- id of this state
+
+        Return:
+          - id of the latest state
+          - secure number associated to the session
+          - data kept into the session
+          - data kept into the state
+        """
+        return self.client.call('fetch_state', session_id, state_id)
+
+    def store_state(self, session_id, state_id, secure_id, use_same_state, session_data, state_data):
+        """Store a state and its associated objects graph
+
+        In:
+          - ``session_id`` -- session id of this state
+          - ``state_id`` -- id of this state
+          - ``secure_id`` -- the secure number associated to the session
+          - ``use_same_state`` -- is this state to be stored in the previous snapshot?
+          - ``session_data`` -- data to keep into the session
+          - ``state_data`` -- data to keep into the state
+        """
+        self.client.call('store_state', session_id, state_id, secure_id, use_same_state, session_data, state_data)
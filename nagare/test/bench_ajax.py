@@ -0,0 +1,108 @@
+#--
+# Copyright (c) 2008-2013 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+#--
+
+"""Benchmarks of the XHR responses
+
+Run with ``python -m nagare.test.bench_ajax``
+"""
+
+import time
+
+from nagare import ajax, serializer, presentation
+from nagare.namespaces import xhtml
+
+
+def create_views(nb_views, nb_rows):
+    """Create the views updated by a XHR request
+
+    In:
+      - ``nb_views`` -- number of views
+      - ``nb_rows`` -- number of rows of the table of each view
+
+    Return:
+      - the ``ViewsToJs`` object
+    """
+    h = xhtml.Renderer().AsyncRenderer(async_header=True)
+
+    views = ajax.ViewsToJs()
+    for i in range(nb_views):
+        h.head.css('view%d' % i, '.view%d td { color: red }' % i)
+        h.head.javascript('view%d' % i, 'var view%d = "%d";' % (i, i))
+        h.head.javascript_url('/static/view%d.js' % i)
+
+        table = h.table([h.tr(h.td(u'row %d' % j), h.td(u'"caf\N{Latin Small Letter E With Acute}"'), h.td(h.a('link', href='#%d' % j))) for j in range(nb_rows)], class_='view%d' % i)
+        views.append(ajax.ViewToJs('nagare_updateNode', u'view%d' % i, h, table))
+
+    return views
+
+
+def serialize_js(views, content_type, doctype):
+    """The previous format: javascript statements wrapping each escaped view
+    """
+    bodies = []
+    for view_to_js in views:
+        body = serializer.serialize(view_to_js.output, content_type, doctype, False)[1]
+        bodies.append("%s('%s', %s)" % (view_to_js.js, view_to_js.id.encode('utf-8'), ajax.py2js(body, view_to_js.renderer)))
+
+    head = presentation.render(views[0].renderer.head, views[0].renderer, None, None)
+
+    return ('text/plain', '; '.join(bodies) + '; ' + head)
+
+
+def measure(serialize, views, nb):
+    """Return the time, in ms, of a XHR response serialization and its size, in KB
+    """
+    t0 = time.time()
+    for i in range(nb):
+        response = serialize(views, 'text/html', None)[1]
+
+    return (time.time() - t0) * 1000 / nb, len(response) / 1024.
+
+
+def bench_response(nb_views=10, nb_rows=500, nb=10):
+    """JSON response vs javascript response
+
+    In:
+      - ``nb_views`` -- number of views updated
+      - ``nb_rows`` -- number of rows of the table of each view
+      - ``nb`` -- number of serializations
+    """
+    views = create_views(nb_views, nb_rows)
+
+    print 'XHR response of %d views of %d rows' % (nb_views, nb_rows)
+
+    for (name, serialize) in (('JSON', ajax.serialize_updates), ('javascript', serialize_js)):
+        t, size = measure(serialize, views, nb)
+        print '  %-10s: %7.1fms, %7.1fKB' % (name, t, size)
+
+
+def bench_assets(nb_views=100, nb_rows=5, nb=10):
+    """XHR response with all the head assets vs only the new ones
+
+    In:
+      - ``nb_views`` -- number of views updated, each with its own assets
+      - ``nb_rows`` -- number of rows of the table of each view
+      - ``nb`` -- number of serializations
+    """
+    views = create_views(nb_views, nb_rows)
+    head = views[0].renderer.head
+
+    print 'XHR response of %d views with their assets' % nb_views
+
+    t, size = measure(ajax.serialize_updates, views, nb)
+    print '  %-10s: %7.1fms, %7.1fKB' % ('all', t, size)
+
+    head.loaded_assets = head.get_assets_ids()
+    t, size = measure(ajax.serialize_updates, views, nb)
+    print '  %-10s: %7.1fms, %7.1fKB' % ('new only', t, size)
+
+
+if __name__ == '__main__':
+    bench_response()
+    bench_assets()
@@ -0,0 +1,214 @@
+#--
+# Copyright (c) 2008-2013 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+#--
+
+"""Benchmarks of the callbacks registration, serialization and lookup
+
+Run with ``python -m nagare.test.bench_callbacks``
+"""
+
+import time
+import cPickle
+
+import webob
+
+from nagare import component, presentation, local, callbacks
+from nagare.sessions import serializer
+from nagare.namespaces import xhtml
+
+
+class Page(object):
+    def __init__(self, nb_actions):
+        self.nb_actions = nb_actions
+
+    def action(self):
+        pass
+
+
+@presentation.render_for(Page)
+def render(self, h, *args):
+    with h.ul:
+        for i in range(self.nb_actions):
+            h << h.li(h.a('action %d' % i).action(self.action))
+
+    return h.root
+
+
+def bench_registration(nb_actions=10000, nb_pages=10):
+    """Rendering of pages with a lot of actions
+
+    In:
+      - ``nb_actions`` -- number of actions on a page
+      - ``nb_pages`` -- number of pages rendered
+    """
+    local.request = local.Process()
+
+    page = component.Component(Page(nb_actions))
+
+    print 'Callbacks registration (%d pages of %d actions)' % (nb_pages, nb_actions)
+
+    t0 = time.time()
+    for i in range(nb_pages):
+        for j in range(nb_actions):
+            page.register_callback(None, 4, page().action, False, None)
+        assert len(page.serialize_callbacks(True)[None]) == nb_actions
+    t = time.time() - t0
+    print '  registration:        %9.0f callbacks/s' % (nb_pages * nb_actions / t)
+
+    t0 = time.time()
+    for i in range(nb_pages):
+        page.render(xhtml.Renderer())
+        assert len(page.serialize_callbacks(True)[None]) == nb_actions
+    t = time.time() - t0
+    print '  rendering:           %9.0f callbacks/s, %6.1fms per page' % (nb_pages * nb_actions / t, t * 1000 / nb_pages)
+
+
+def bench_serialization(nb_actions=10000, nb_pages=10):
+    """Serialization of a state with a lot of callbacks, compared to the
+    callbacks in a dictionary id -> (model, callback, with_request, render)
+
+    In:
+      - ``nb_actions`` -- number of actions on a page
+      - ``nb_pages`` -- number of serializations
+    """
+    local.request = local.Process()
+
+    page = component.Component(Page(nb_actions))
+    page.render(xhtml.Renderer())
+
+    print 'Callbacks serialization (%d actions)' % nb_actions
+
+    s = serializer.Pickle()
+    t0 = time.time()
+    for i in range(nb_pages):
+        session_data, state_data = s.dumps(page, False)
+    t = time.time() - t0
+    print '  buckets:    %7d bytes, %6.1fms' % (len(state_data), t * 1000 / nb_pages)
+
+    callbacks = dict(s.loads(session_data, state_data)[1].items())
+    t0 = time.time()
+    for i in range(nb_pages):
+        state_data = cPickle.dumps((dict(page.__dict__, _callbacks=callbacks), callbacks), -1)
+    t = time.time() - t0
+    print '  dictionary: %7d bytes, %6.1fms' % (len(state_data), t * 1000 / nb_pages)
+
+
+class Form(object):
+    def __init__(self, nb_fields):
+        self.values = [''] * nb_fields
+
+    def set_value(self, i, value):
+        self.values[i] = value
+
+    def commit(self):
+        pass
+
+
+@presentation.render_for(Form)
+def render(self, h, *args):
+    with h.form:
+        for i in range(len(self.values)):
+            h << h.input(value=self.values[i]).action(lambda v, i=i: self.set_value(i, v))
+        h << h.input(type='submit', value='Commit').action(self.commit)
+
+    return h.root
+
+
+def bench_process(nb_fields=1000, nb_posts=100):
+    """Processing of the callbacks received from a big form
+
+    In:
+      - ``nb_fields`` -- number of fields of the form
+      - ``nb_posts`` -- number of times the form is posted
+    """
+    local.request = local.Process()
+
+    form = component.Component(Form(nb_fields))
+    root = form.render(xhtml.Renderer())
+
+    state_callbacks = callbacks.Callbacks()
+    state_callbacks.update(form.serialize_callbacks(True))
+
+    params = [(e.get('name'), 'value %d' % i) for (i, e) in enumerate(root.xpath('.//input'))]
+    request = webob.Request.blank('/', POST=params + [('other', 'x')] * nb_fields)
+
+    print 'Callbacks processing (%d fields, %d other parameters)' % (nb_fields, nb_fields)
+
+    t0 = time.time()
+    for i in range(nb_posts):
+        callbacks.process(state_callbacks, request, None)
+    t = time.time() - t0
+    assert form().values[-1] == 'value %d' % (nb_fields - 1)
+
+    print '  process:   %6.2fms per post' % (t * 1000 / nb_posts)
+
+
+class List(object):
+    def __init__(self, nb_components, nb_actions):
+        self.items = [component.Component(Page(nb_actions)) for i in range(nb_components)]
+
+    def action(self):
+        pass
+
+
+@presentation.render_for(List)
+def render(self, h, *args):
+    with h.div:
+        h << h.a('first').action(self.action)
+        h << self.items
+        h << h.a('last').action(self.action)
+
+    return h.root
+
+
+def bench_lookup(nb_components=1000, nb_actions=10, nb_lookups=1000):
+    """Lookup of the callbacks of a page made of a lot of components, compared
+    to a scan of the buckets
+
+    In:
+      - ``nb_components`` -- number of components on the page
+      - ``nb_actions`` -- number of actions of each component
+      - ``nb_lookups`` -- number of callbacks looked up
+    """
+    local.request = local.Process()
+
+    page = component.Component(List(nb_components, nb_actions))
+    page.render(xhtml.Renderer())
+
+    buckets = [bucket for comp in [page] + page().items for bucket in comp.serialize_callbacks(True).values()]
+    ids = sorted(id_ for bucket in buckets for id_ in bucket.ids)
+    ids = ids[::max(1, len(ids) // nb_lookups)]
+
+    print 'Callbacks lookup (%d components of %d actions, %d lookups)' % (nb_components, nb_actions, len(ids))
+
+    t0 = time.time()
+    state_callbacks = callbacks.Callbacks(buckets)
+    for id_ in ids:
+        state_callbacks[id_]
+    t = time.time() - t0
+    print '  index: %8.2fms' % (t * 1000)
+
+    t0 = time.time()
+    for id_ in ids:
+        for bucket in buckets:
+            if bucket.ids[0] <= id_ <= bucket.ids[-1] and bucket.get(id_) is not None:
+                break
+    t = time.time() - t0
+    print '  scan:  %8.2fms' % (t * 1000)
+
+    t0 = time.time()
+    callbacks.Callbacks(buckets)[ids[-1]]
+    t = time.time() - t0
+    print '  first lookup, with the index built: %6.2fms' % (t * 1000)
+
+
+if __name__ == '__main__':
+    bench_registration()
+    bench_serialization()
+    bench_process()
+    bench_lookup()
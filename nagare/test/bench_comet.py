@@ -0,0 +1,342 @@
+#--
+# Copyright (c) 2008-2013 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+#--
+
+"""Load test of the comet channels
+
+Run with ``python -m nagare.test.bench_comet``
+
+A forked process opens the connections of the simulated browsers. The
+clients are first directly parked into a channel of the ``epoll`` engine,
+then served over HTTP by the eventlet publisher, each one only holding a
+green thread.
+"""
+
+import os
+import time
+import fcntl
+import socket
+import resource
+import threading
+
+from nagare import comet
+
+
+class Response(object):
+    status = 200
+    body = ''
+
+
+def open_connections(nb_clients):
+    """Open the connections of the simulated browsers
+
+    In:
+      - ``nb_clients`` -- number of browsers
+
+    Return:
+      - (pid of the browsers process, pipe to the browsers process, server sockets)
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1024)
+    address = listener.getsockname()
+
+    r, w = os.pipe()
+
+    pid = os.fork()
+    if not pid:
+        # The browsers
+        try:
+            os.close(w)
+            listener.close()
+
+            browsers = [socket.create_connection(address) for i in range(nb_clients)]
+
+            # Disconnect the number of browsers asked
+            nb = int(os.read(r, 100))
+            for browser in browsers[:nb]:
+                browser.close()
+
+            os.read(r, 100)
+        finally:
+            os._exit(0)
+
+    os.close(r)
+    sockets = [listener.accept()[0] for i in range(nb_clients)]
+    listener.close()
+
+    return pid, w, sockets
+
+
+def park(channel, sockets, nb=0):
+    """Park a client for each connection
+
+    In:
+      - ``channel`` -- the channel
+      - ``sockets`` -- the server sockets of the connections
+      - ``nb`` -- identifier of the next message wanted by the clients
+
+    Return:
+      - (time in ms, clients)
+    """
+    t0 = time.time()
+    clients = [channel.park(nb, s.fileno(), Response()) for s in sockets]
+
+    return (time.time() - t0) * 1000, clients
+
+
+def bench_comet(nb_clients=10000, nb_disconnected=1000):
+    """Waiting clients held by the ``epoll`` engine
+
+    In:
+      - ``nb_clients`` -- number of connected browsers
+      - ``nb_disconnected`` -- number of browsers disconnecting
+    """
+    print 'Comet channel with %d connected clients' % nb_clients
+
+    pid, w, sockets = open_connections(nb_clients)
+
+    channel = comet.Channel('bench', 'alert', engine=comet.EpollEngine())
+
+    t, clients = park(channel, sockets)
+    print '  parking:                %7.1fms, %d threads' % (t, threading.active_count())
+
+    t0 = time.time()
+    channel.send('hello')
+    t = (time.time() - t0) * 1000
+    assert all(client.is_blocked() and (client._response.body == '000000001hello') for client in clients)
+    print '  fan-out of a message:   %7.1fms' % t
+
+    park(channel, sockets, 1)
+
+    t0 = time.time()
+    os.write(w, '%d' % nb_disconnected)
+    while len(channel) != nb_clients - nb_disconnected:
+        time.sleep(0.001)
+    t = (time.time() - t0) * 1000
+    print '  %5d disconnections:    %7.1fms' % (nb_disconnected, t)
+
+    channel.close()
+    os.write(w, 'end')
+    os.waitpid(pid, 0)
+
+    # With ``select()``, each connection scans all the waiting clients
+    # and the file handles are limited to ``FD_SETSIZE``
+    channel = comet.Channel('bench', 'alert', engine=comet.SelectEngine())
+    try:
+        park(channel, sockets)
+    except ValueError:
+        print '  select() engine:        unusable with %d clients' % nb_clients
+
+    channel.close()
+
+
+def browse(address, nb_clients, nb_disconnected, commands, results):
+    """The simulated browsers, waiting for a message over HTTP
+
+    In:
+      - ``address`` -- address of the publisher
+      - ``nb_clients`` -- number of browsers
+      - ``nb_disconnected`` -- number of browsers disconnecting
+      - ``commands`` -- pipe from the publisher process
+      - ``results`` -- pipe to the publisher process
+    """
+    def connect(nb):
+        browsers = [socket.create_connection(address) for i in range(nb_clients)]
+        for browser in browsers:
+            browser.sendall('GET /?_channel=bench&_nb=%d HTTP/1.0\r\n\r\n' % nb)
+
+        return browsers
+
+    browsers = connect(0)
+
+    # Read all the responses
+    nb_received = 0
+    for browser in browsers:
+        response = ''.join(iter(lambda: browser.recv(4096), ''))
+        nb_received += response.endswith('000000001hello')
+        browser.close()
+    os.write(results, '%d' % nb_received)
+
+    # Wait again then disconnect the number of browsers asked
+    browsers = connect(1)
+    os.read(commands, 100)
+    for browser in browsers[:nb_disconnected]:
+        browser.close()
+
+    os.read(commands, 100)
+
+
+def bench_publisher(nb_clients=10000, nb_disconnected=1000):
+    """Waiting clients served over HTTP by the eventlet publisher
+
+    In:
+      - ``nb_clients`` -- number of connected browsers
+      - ``nb_disconnected`` -- number of browsers disconnecting
+    """
+    from eventlet import api, greenthread
+    from eventlet.green import os as green_os
+
+    from nagare import local, wsgi
+    from nagare.publishers import eventlet_publisher
+
+    print 'Eventlet publisher with %d connected clients' % nb_clients
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    local.worker = local.Process()
+    local.request = local.Process()
+
+    comet.channels.create('bench', 'alert')
+    channel = comet.channels['bench']
+
+    listener = api.tcp_listener(('127.0.0.1', 0), 1024)
+    address = listener.getsockname()
+    commands = os.pipe()
+    results = os.pipe()
+
+    t0 = time.time()
+    pid = os.fork()
+    if not pid:
+        try:
+            listener.close()
+            browse(address, nb_clients, nb_disconnected, commands[0], results[1])
+        finally:
+            os._exit(0)
+
+    fcntl.fcntl(results[0], fcntl.F_SETFL, os.O_NONBLOCK)
+
+    nb_threads = threading.active_count()
+    server = greenthread.spawn(eventlet_publisher.server, listener, wsgi.WSGIApp(lambda: None), nb_clients + 1, log=open(os.devnull, 'w'))
+
+    def wait_for(nb):
+        while len(channel) != nb:
+            greenthread.sleep(0.001)
+
+        return (time.time() - t0) * 1000
+
+    t = wait_for(nb_clients)
+    print '  connections:            %7.1fms, %d threads (%d before)' % (t, threading.active_count(), nb_threads)
+
+    t0 = time.time()
+    comet.channels.send('bench', u'hello')
+    nb_received = int(green_os.read(results[0], 100))
+    t = (time.time() - t0) * 1000
+    assert nb_received == nb_clients
+    print '  fan-out of a message:   %7.1fms' % t
+
+    wait_for(nb_clients)
+
+    t0 = time.time()
+    os.write(commands[1], 'disconnect')
+    t = wait_for(nb_clients - nb_disconnected)
+    print '  %5d disconnections:    %7.1fms' % (nb_disconnected, t)
+
+    os.write(commands[1], 'end')
+    while not os.waitpid(pid, os.WNOHANG)[0]:
+        greenthread.sleep(0.01)
+
+    server.kill()
+    listener.close()
+    channel.close()
+
+
+# ---------------------------------------------------------------------------
+
+class Engine(comet.SelectEngine):
+    """Engine without disconnection detection, for the clients without socket"""
+    def discard_disconnected_clients(self, channel):
+        pass
+
+
+class ListChannel(comet.TextChannel):
+    """The history into a list and the messages encoded for each client, as before"""
+
+    def __init__(self, *args, **kw):
+        super(ListChannel, self).__init__(*args, **kw)
+
+        self.history_nb = 0
+        self.history = []
+
+    def send(self, msg):
+        with self.lock:
+            self.history.append(msg)
+
+            if len(self.history) > self.history_size:
+                self.history.pop(0)
+                self.history_nb += 1
+
+            clients, self.clients = self.clients, set()
+
+        for client in clients:
+            client.send('%09d%s' % (self.history_nb + len(self.history), msg.encode('utf-8')))
+
+    def get_old_msg(self, nb):
+        msgs = self.history[max(nb, self.history_nb) - self.history_nb:]
+        return (len(self.history) + self.history_nb, ''.join(msgs).encode('utf-8') if msgs else None)
+
+
+def measure_history(channel_factory, history_size, nb_clients, msg):
+    """Return the times, in ms, of the history operations of a channel
+
+    In:
+      - ``channel_factory`` -- the channel class
+      - ``history_size`` -- number of messages kept
+      - ``nb_clients`` -- number of waiting clients
+      - ``msg`` -- the message
+
+    Return:
+      - (time to fill the history twice, time of the fan-out, time of the catch-up of 10 messages)
+    """
+    channel = channel_factory('bench', 'alert', history_size, engine=Engine())
+
+    t0 = time.time()
+    for i in range(2 * history_size):
+        channel.send(u'message %d' % i)
+    t1 = (time.time() - t0) * 1000
+
+    for i in range(nb_clients):
+        channel.park(2 * history_size, None, Response())
+
+    t0 = time.time()
+    channel.send(msg)
+    t2 = (time.time() - t0) * 1000
+
+    t0 = time.time()
+    for i in range(nb_clients):
+        channel.park(2 * history_size - 10, None, Response())
+    t3 = (time.time() - t0) * 1000
+
+    return t1, t2, t3
+
+
+def bench_history(history_size=50000, nb_clients=10000, msg_size=10000):
+    """History into a ring buffer with messages encoded once vs list
+
+    In:
+      - ``history_size`` -- number of messages kept
+      - ``nb_clients`` -- number of waiting clients
+      - ``msg_size`` -- size of the message sent to all the clients
+    """
+    msg = u'\N{Copyright Sign}' * (msg_size / 2)
+
+    print 'History of %d messages, %d waiting clients' % (history_size, nb_clients)
+
+    for (name, channel_factory) in (('ring buffer', comet.TextChannel), ('list', ListChannel)):
+        t1, t2, t3 = measure_history(channel_factory, history_size, nb_clients, msg)
+        print '  %-11s: %d sends %7.1fms, fan-out of %dKB %7.1fms, catch-ups %7.1fms' % (name, 2 * history_size, t1, msg_size / 1000, t2, t3)
+
+
+if __name__ == '__main__':
+    bench_comet()
+    bench_publisher()
+    bench_history()
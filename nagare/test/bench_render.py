@@ -0,0 +1,78 @@
+#--
+# Copyright (c) 2008-2013 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+#--
+
+"""Benchmarks of the components rendering
+
+Run with ``python -m nagare.test.bench_render``
+"""
+
+import time
+
+from nagare import component, presentation, local
+from nagare.namespaces import xhtml
+
+
+class Node(object):
+    def __init__(self, depth, width):
+        self.children = [component.Component(Node(depth - 1, width)) for i in range(width)] if depth else []
+
+
+@presentation.render_for(Node)
+def render(self, h, comp, *args):
+    with h.div:
+        h << comp.render(h, model='title')
+        h << self.children
+
+    return h.root
+
+
+@presentation.render_for(Node, model='title')
+def render(self, h, *args):
+    return h.h1('node')
+
+
+def measure(root, nb):
+    """Return the time, in ms, of a rendering of a tree of components
+
+    In:
+      - ``root`` -- root component of the tree
+      - ``nb`` -- number of renderings
+    """
+    t0 = time.time()
+    for i in range(nb):
+        root.render(xhtml.Renderer())
+
+    return (time.time() - t0) * 1000 / nb
+
+
+def bench_dispatch(depth=8, width=2, nb=10):
+    """Rendering of a tree of components, with and without the views cache
+
+    In:
+      - ``depth`` -- depth of the tree
+      - ``width`` -- number of children of each node
+      - ``nb`` -- number of renderings
+    """
+    local.request = local.Process()
+
+    root = component.Component(Node(depth, width))
+    print 'Rendering of a tree of %d components' % (width ** (depth + 1) - 1)
+
+    print '  views cache:      %7.1fms' % measure(root, nb)
+
+    dispatch = presentation.dispatch
+    presentation.dispatch = presentation.render
+    try:
+        print '  generic dispatch: %7.1fms' % measure(root, nb)
+    finally:
+        presentation.dispatch = dispatch
+
+
+if __name__ == '__main__':
+    bench_dispatch()
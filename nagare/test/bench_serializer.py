@@ -0,0 +1,92 @@
+#--
+# Copyright (c) 2008-2013 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+#--
+
+"""Benchmarks of the pages serialization
+
+Run with ``python -m nagare.test.bench_serializer``
+"""
+
+import os
+import time
+
+from nagare.namespaces import xhtml
+from nagare import serializer
+
+
+def create_table(nb_rows):
+    """Create the tree of a page with a big table
+
+    In:
+      - ``nb_rows`` -- number of rows of the table
+
+    Return:
+      - the root of the tree
+    """
+    rows = ''.join('<tr><td>%d</td><td>row %d</td><td><a href="#%d">link</a></td></tr>' % (i, i, i) for i in range(nb_rows))
+
+    h = xhtml.Renderer()
+    return h.parse_htmlstring('<html><body><table>%s</table></body></html>' % rows, fragment=False)
+
+
+def measure(serialize, nb_rows, content_type):
+    """Return the time, in ms, of the serialization of a page and the size, in
+    MB, of the biggest string it kept in memory, measured in a forked process
+
+    (the memory peak of the process is the one of the tree creation, so
+    the serialization is measured by the size of its biggest chunk)
+
+    In:
+      - ``serialize`` -- ``serializer.serialize`` or ``serializer.stream``
+      - ``nb_rows`` -- number of rows of the table
+      - ``content_type`` -- content type of the page
+
+    Return:
+      - (time, size of the biggest chunk)
+    """
+    r, w = os.pipe()
+
+    pid = os.fork()
+    if not pid:
+        os.close(r)
+
+        root = create_table(nb_rows)
+
+        t0 = time.time()
+        chunks = serialize(root, content_type, '<!DOCTYPE html>', True)[1]
+        if isinstance(chunks, str):
+            chunks = [chunks]
+
+        size = 0
+        for chunk in chunks:
+            size = max(size, len(chunk))  # The chunk is sent then forgotten
+        t = time.time() - t0
+
+        os.write(w, '%f %d' % (t * 1000, size))
+        os._exit(0)
+
+    os.close(w)
+    result = os.read(r, 100)
+    os.close(r)
+    os.waitpid(pid, 0)
+
+    t, size = result.split()
+    return float(t), int(size) / 1024. / 1024.
+
+
+def bench_streaming(nb_rows=50000):
+    print 'Pages serialization: one string vs chunks (table of %d rows)' % nb_rows
+
+    for content_type in ('text/html', 'application/xhtml+xml'):
+        for name, serialize in (('string', serializer.serialize), ('chunks', serializer.stream)):
+            t, size = measure(serialize, nb_rows, content_type)
+            print '  %-21s %s: %7.1fms, biggest chunk %5.2fMB' % (content_type, name, t, size)
+
+
+if __name__ == '__main__':
+    bench_streaming()
@@ -0,0 +1,220 @@
+#--
+# Copyright (c) 2008-2013 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+#--
+
+"""Benchmarks of the sessions managers
+
+Run with ``python -m nagare.test.bench_sessions``
+"""
+
+import time
+import random
+import threading
+
+from nagare import local, component
+from nagare.sessions import serializer, memory_sessions, lru_dict, compression, file_sessions
+
+
+class Node(object):
+    def __init__(self, depth, width):
+        self.title = 'node %d' % depth
+        self.items = [('item %d' % i, i, i * 1.5) for i in range(10)]
+        self.children = [component.Component(Node(depth - 1, width)) for i in range(width)] if depth else []
+
+    def action(self):
+        pass
+
+
+def create_tree(depth, width=2, nb_callbacks=3):
+    """Create a tree of components with registered callbacks
+
+    In:
+      - ``depth`` -- depth of the tree
+      - ``width`` -- number of children of each node
+      - ``nb_callbacks`` -- number of callbacks registered by each component
+
+    Return:
+      - the root component
+    """
+    root = component.Component(Node(depth, width))
+
+    stack = [root]
+    while stack:
+        comp = stack.pop()
+        for i in range(nb_callbacks):
+            comp.register_callback(None, 4, comp().action, False, None)
+        stack.extend(comp().children)
+
+    return root
+
+
+def timeit(f, nb=20):
+    """Return the mean time, in ms, of a call to ``f``
+    """
+    t0 = time.time()
+    for i in range(nb):
+        f()
+
+    return (time.time() - t0) * 1000 / nb
+
+# -----------------------------------------------------------------------------
+
+def states_size(sessions, session_id):
+    """Return the number of bytes of all the pickles kept in a session, counting only once the shared ones
+    """
+    pickles = {}
+    for state_id in range(sessions.nb_states * 2):
+        try:
+            state_data = sessions.fetch_state(session_id, state_id)[3]
+        except LookupError:
+            continue
+
+        if isinstance(state_data, tuple):
+            pickles.update((id(chunk), len(chunk)) for chunk in state_data[1])
+        else:
+            pickles[id(state_data)] = len(state_data)
+
+    return sum(pickles.values())
+
+
+def bench_delta_states(nb_requests=20):
+    print 'Pickled states: full pickles vs delta pickles (%d states)' % nb_requests
+
+    for depth in (4, 8, 10):
+        results = []
+
+        for delta in (False, True):
+            sessions = memory_sessions.SessionsWithPickledStates(delta=delta, nb_states=nb_requests)
+            sessions.create(1, None, None)
+            sessions.set_root(1, 0, None, False, create_tree(depth))
+
+            t0 = time.time()
+            for state_id in range(nb_requests):
+                root = sessions.get_root(1, state_id)[2][0]
+
+                # A request modifies one component and renders some of them
+                comp = root
+                while comp().children:
+                    comp().title += '.'
+                    comp.register_callback(None, 4, comp().action, False, None)
+                    comp = comp().children[state_id % len(comp().children)]
+
+                sessions.set_root(1, state_id + 1, None, False, root)
+            t = (time.time() - t0) * 1000 / nb_requests
+
+            results.append((states_size(sessions, 1) / 1024, t))
+
+        print '  depth %2d: full %6dKb - %7.2fms/request | delta %6dKb - %7.2fms/request' % ((depth,) + results[0] + results[1])
+
+
+def concurrent_accesses(store, nb_threads, nb_requests=10000, nb_sessions=1000):
+    """Return the time, in ms, for ``nb_threads`` threads to concurrently
+    access, as a request does, to random sessions of a sessions store
+    """
+    for session_id in range(nb_sessions):
+        store[session_id] = [0]
+
+    def worker():
+        for i in range(nb_requests):
+            session_id = random.randrange(nb_sessions)
+
+            try:
+                session = store[session_id]  # fetch_state()
+            except KeyError:
+                session = store[session_id] = [0]  # create()
+
+            session[0] += 1
+            store[session_id]  # store_state()
+            store.set_memory(session_id, 100)
+
+    threads = [threading.Thread(target=worker) for i in range(nb_threads)]
+
+    t0 = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return (time.time() - t0) * 1000
+
+
+class RLockLRUDict(lru_dict.ThreadSafeLRUDict):
+    """The sessions store as it was, locked by a ``RLock``"""
+    def __init__(self, *args, **kw):
+        super(RLockLRUDict, self).__init__(*args, **kw)
+        self.lock = threading.RLock()
+
+
+def bench_sessions_store():
+    print 'Sessions store: locked by a RLock vs by a Lock'
+
+    for nb_threads in (1, 4, 16, 64):
+        t1 = concurrent_accesses(RLockLRUDict(10000), nb_threads)
+        t2 = concurrent_accesses(lru_dict.ThreadSafeLRUDict(10000), nb_threads)
+
+        print '  %2d threads: RLock %8.2fms - Lock %8.2fms' % (nb_threads, t1, t2)
+
+
+def bench_codecs(nb=20):
+    print 'Codecs: compression ratio and CPU cost per state'
+
+    dictionary = compression.train_dictionary([serializer.Pickle().dumps(create_tree(3), True)[1]])
+
+    for depth in (0, 4, 8):
+        state = serializer.Pickle().dumps(create_tree(depth), True)[1]
+        print '  depth %d, %d bytes' % (depth, len(state))
+
+        for (name, codec) in (
+                                ('zlib 1', compression.Zlib(1)),
+                                ('zlib 6', compression.Zlib(6)),
+                                ('zlib 9', compression.Zlib(9)),
+                                ('zlib 6 + dictionary', compression.Zlib(6, dictionary))
+                             ):
+            for i in range(nb):
+                codec.decode(codec.encode(state))
+
+            stats = codec.stats()
+            print '    %-20s ratio %5.2f - encode %7.3fms - decode %7.3fms' % (name, stats['ratio'], stats['mean_encode_time'] * 1000, stats['mean_decode_time'] * 1000)
+
+
+def bench_file_sessions(nb_sessions=100, nb_requests=5):
+    print 'Pickled states kept in memory vs in memory mapped files (%d sessions)' % nb_sessions
+
+    for depth in (4, 8):
+        results = []
+
+        for sessions in (memory_sessions.SessionsWithPickledStates(), file_sessions.Sessions()):
+            root = create_tree(depth)
+
+            t0 = time.time()
+            for session_id in range(nb_sessions):
+                sessions.create(session_id, None, None)
+                sessions.set_root(session_id, 0, None, False, root)
+
+                for state_id in range(nb_requests):
+                    sessions.set_root(session_id, state_id + 1, None, False, sessions.get_root(session_id, state_id)[2][0])
+            t = (time.time() - t0) * 1000 / (nb_sessions * nb_requests)
+
+            if isinstance(sessions, file_sessions.Sessions):
+                size = sum(segment.size for segment in sessions.segments)
+            else:
+                size = sum(len(sessions.fetch_state(session_id, state_id)[3]) for session_id in range(nb_sessions) for state_id in range(nb_requests + 1))
+
+            results.append((size / 1024, t))
+
+        print '  depth %d: %6dKb in heap - %6.2fms/request | %6dKb in files - %6.2fms/request' % ((depth,) + results[0] + results[1])
+
+
+if __name__ == '__main__':
+    local.worker = local.Process()
+    local.request = local.Process()
+
+    bench_delta_states()
+    bench_sessions_store()
+    bench_codecs()
+    bench_file_sessions()
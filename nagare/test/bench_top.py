@@ -0,0 +1,87 @@
+#--
+# Copyright (c) 2008-2013 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+#--
+
+"""Benchmarks of the ``<head>`` assembly of the pages
+
+Run with ``python -m nagare.test.bench_top``
+"""
+
+import time
+
+from webob import Request, Response
+
+from nagare.namespaces import xhtml
+from nagare import top
+
+
+def create_page(nb_components):
+    """Create the renderer of a page where each component registers its assets
+
+    In:
+      - ``nb_components`` -- number of components
+
+    Return:
+      - the renderer
+    """
+    response = Response()
+    response.xml_output = False
+    h = xhtml.Renderer(request=Request({'PATH_INFO': '/page'}), response=response)
+
+    h.head << h.head.title('page')
+    for i in range(nb_components):
+        h.head.css_url('/css/component%d.css' % i)
+        h.head.javascript_url('/js/component%d.js' % i)
+        h.head.css('component%d' % i, '.component%d { color: red }' % i)
+        h.head.javascript('component%d' % i, 'var component%d = %d;' % (i, i))
+
+        h << h.div('component %d' % i)
+
+    return h
+
+
+def measure(nb_components, nb):
+    """Return the time, in ms, of the wrapping of a page into ``<html>``
+
+    In:
+      - ``nb_components`` -- number of components of the page
+      - ``nb`` -- number of wrappings
+
+    Return:
+      - the time
+    """
+    pages = [create_page(nb_components) for i in range(nb)]
+
+    t0 = time.time()
+    for h in pages:
+        top.wrap('text/html', h, h.root)
+
+    return (time.time() - t0) * 1000 / nb
+
+
+def bench_head(nb_components=500, nb=20):
+    """Direct assembly of the ``<head>`` vs rendering and merging of the head renderer
+
+    In:
+      - ``nb_components`` -- number of components registering assets
+      - ``nb`` -- number of wrappings
+    """
+    print '<head> assembly of a page of %d components' % nb_components
+
+    print '  direct:           %7.1fms' % measure(nb_components, nb)
+
+    can_fill = xhtml.HeadRenderer.can_fill
+    xhtml.HeadRenderer.can_fill = lambda self: False
+    try:
+        print '  render and merge: %7.1fms' % measure(nb_components, nb)
+    finally:
+        xhtml.HeadRenderer.can_fill = can_fill
+
+
+if __name__ == '__main__':
+    bench_head()
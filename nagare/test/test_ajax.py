@@ -0,0 +1,64 @@
+#--
+# Copyright (c) 2008-2013 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+#--
+
+import json
+
+from nagare import ajax, serializer
+from nagare.namespaces import xhtml
+
+
+def create_renderer():
+    h = xhtml.Renderer().AsyncRenderer(async_header=True)
+    h.head.css('a', 'p {}')
+    h.head.javascript_url('/a.js')
+
+    return h
+
+
+def test_json_response():
+    """Ajax - the views are serialized into a JSON response"""
+    h = create_renderer()
+
+    views = ajax.ViewsToJs([
+                            ajax.ViewToJs('nagare_updateNode', u'id1', h, h.p(u'\N{Copyright Sign} "hello"')),
+                            ajax.ViewToJs('nagare_replaceNode', u'id2', h, None),
+                            ajax.ViewToJs('nagare_replaceNode', u'id3', h, h.div('world'))
+                           ])
+
+    content_type, response = serializer.serialize(views, 'text/html', None, False)
+    assert content_type == 'text/plain'
+
+    response = json.loads(response)
+    assert response['updates'] == [
+                                   {'id': 'id1', 'js': 'nagare_updateNode', 'html': u'<p>\N{Copyright Sign} "hello"</p>\n'},
+                                   {'id': 'id3', 'js': 'nagare_replaceNode', 'html': '<div>world</div>\n'}
+                                  ]
+    assert response['head']['named_css'] == [['a', 'p {}', {}]]
+    assert response['head']['js_urls'] == [['/a.js', {}]]
+
+
+def test_empty_response():
+    """Ajax - an empty view is serialized into an empty response"""
+    h = create_renderer()
+
+    assert serializer.serialize(ajax.ViewToJs('nagare_updateNode', u'id1', h, None), 'text/html', None, False) == ('text/plain', '')
+
+
+def test_loaded_assets():
+    """Ajax - the head assets already loaded by the browser are not sent again"""
+    h = create_renderer()
+    h.head.css('b', 'div {}')
+    h.head.javascript_url('/b.js')
+    h.head.loaded_assets = frozenset([('css', 'a'), ('js_url', '/a.js')])
+
+    assets = h.head.get_assets()
+    assert assets['named_css'] == [('b', 'div {}', {})]
+    assert assets['js_urls'] == [('/b.js', {})]
+
+    assert h.head.get_assets_ids() == frozenset([('css', 'a'), ('css', 'b'), ('js_url', '/a.js'), ('js_url', '/b.js')])
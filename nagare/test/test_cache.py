@@ -0,0 +1,113 @@
+#--
+# Copyright (c) 2008-2013 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+#--
+
+import time
+
+from nagare import component, presentation, cache, local
+from nagare.namespaces import xhtml
+
+
+class Menu(object):
+    def __init__(self, lang):
+        self.lang = lang
+        self.nb_renderings = 0
+
+    def select(self):
+        pass
+
+
+@presentation.render_for(Menu)
+@cache.cached(lambda self: self.lang, ttl=0.1, size=2)
+def render(self, h, *args):
+    self.nb_renderings += 1
+    return h.ul(h.li('menu'), h.li(self.lang))
+
+
+@presentation.render_for(Menu, model='actions')
+@cache.cached(lambda self: self.lang)
+def render(self, h, *args):
+    return h.a('select').action(self.select)
+
+
+@cache.cached(lambda self: self.lang)
+def render_model(self, h, comp, model):
+    return h.span(model)
+
+presentation.render_for(Menu, model='short')(render_model)
+presentation.render_for(Menu, model='long')(render_model)
+
+
+def setup():
+    local.request = local.Process()
+
+
+def test1():
+    """Views cache - a fragment is rendered once by key"""
+    menu = Menu('en')
+    comp = component.Component(menu)
+
+    html = comp.render(xhtml.Renderer()).write_htmlstring()
+    for i in range(3):
+        assert comp.render(xhtml.Renderer()).write_htmlstring() == html
+    assert menu.nb_renderings == 1
+
+    comp.becomes(Menu('fr'))
+    assert '<li>fr</li>' in comp.render(xhtml.Renderer()).write_htmlstring()
+
+    stats = presentation.lookup(Menu, None).cache.stats()
+    assert (stats['nb_hits'], stats['nb_misses'], stats['nb_fragments']) == (3, 2, 2)
+
+
+def test2():
+    """Views cache - the fragments expire"""
+    menu = Menu('de')
+    comp = component.Component(menu)
+
+    comp.render(xhtml.Renderer())
+    comp.render(xhtml.Renderer())
+    assert menu.nb_renderings == 1
+
+    time.sleep(0.1)
+    comp.render(xhtml.Renderer())
+    assert menu.nb_renderings == 2
+
+
+def test3():
+    """Views cache - a view registering callbacks is not cached"""
+    comp = component.Component(Menu('en'))
+
+    for i in range(2):
+        comp.render(xhtml.Renderer(), model='actions')
+        assert len(comp.serialize_callbacks(True)['actions']) == 1
+
+    stats = presentation.lookup(Menu, 'actions').cache.stats()
+    assert (stats['nb_hits'], stats['nb_misses'], stats['nb_refused']) == (0, 2, 2)
+    assert any(name.startswith('nagare.test.test_cache.render:') for name in cache.stats())
+
+
+def test4():
+    """Views cache - the fragments of the models rendered by the same view are distinct"""
+    comp = component.Component(Menu('en'))
+
+    for i in range(2):
+        assert comp.render(xhtml.Renderer(), model='short').write_htmlstring() == '<span>short</span>'
+        assert comp.render(xhtml.Renderer(), model='long').write_htmlstring() == '<span>long</span>'
+
+    stats = render_model.cache.stats()
+    assert (stats['nb_hits'], stats['nb_misses'], stats['nb_fragments']) == (2, 2, 2)
+
+
+def test5():
+    """Views cache - a view called with unhashable parameters is not cached"""
+    menu = Menu('it')
+    view = presentation.lookup(Menu, None)
+
+    for i in range(2):
+        view(menu, xhtml.Renderer(), None, None, [])
+    assert menu.nb_renderings == 2
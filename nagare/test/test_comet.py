@@ -0,0 +1,285 @@
+#--
+# Copyright (c) 2008-2013 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+#--
+
+import os
+import time
+import socket
+import struct
+import shutil
+import tempfile
+import threading
+
+from nagare import comet
+
+
+class Response(object):
+    status = 200
+    body = ''
+
+
+def test_send():
+    """Comet - a message is sent to the waiting clients"""
+    browser, server = socket.socketpair()
+
+    channel = comet.Channel('test', 'alert', engine=comet.EpollEngine())
+    client = channel.park(0, server.fileno(), Response())
+    assert not client.is_blocked() and (len(channel) == 1)
+
+    channel.send(u'hello')
+    assert client.is_blocked() and (len(channel) == 0)
+    assert client._response.body == '000000001hello'
+    assert not channel.engine.clients
+
+
+def test_history():
+    """Comet - a message in the history is sent directly"""
+    browser, server = socket.socketpair()
+
+    channel = comet.TextChannel('test', 'alert', history_size=2)
+    channel.send(u'hello')
+    channel.send(u'world')
+
+    client = channel.park(0, server.fileno(), Response())
+    assert client.is_blocked() and (len(channel) == 0)
+    assert client._response.body == '000000002helloworld'
+
+
+def test_epoll_disconnection():
+    """Comet - the epoll engine discards a disconnected client"""
+    browser, server = socket.socketpair()
+
+    channel = comet.Channel('test', 'alert', engine=comet.EpollEngine())
+    client = channel.park(0, server.fileno(), Response())
+    assert len(channel) == 1
+
+    browser.close()
+
+    for i in range(100):
+        if not len(channel):
+            break
+        time.sleep(0.01)
+
+    assert client.is_blocked() and (len(channel) == 0)
+    assert not channel.engine.clients
+
+
+def test_select_disconnection():
+    """Comet - the select engine discards a disconnected client"""
+    browser, server = socket.socketpair()
+
+    channel = comet.Channel('test', 'alert', engine=comet.SelectEngine())
+    client = channel.park(0, server.fileno(), Response())
+    assert len(channel) == 1
+
+    browser.close()
+    channel.discard_disconnected_clients()
+
+    assert client.is_blocked() and (len(channel) == 0)
+
+
+def test_ring_history():
+    """Comet - only the latest messages are kept into the history"""
+    history = comet.History(3)
+    for i in range(5):
+        history.append(i)
+
+    assert (len(history) == 3) and (history.first() == 2)
+    assert history.get(0) == [2, 3, 4]
+    assert history.get(3) == [3, 4]
+    assert history.get(3, 1) == [3]
+    assert history.get(5) == []
+
+    history = comet.History(0)
+    history.append(0)
+    assert (len(history) == 0) and (history.get(0) == [])
+
+
+def test_channel_history():
+    """Comet - a client behind receives the oldest message kept"""
+    browser, server = socket.socketpair()
+
+    channel = comet.Channel('test', 'alert')
+    channel.send(u'hello')
+    client = channel.park(0, server.fileno(), Response())
+    assert not client.is_blocked()
+    channel.close()
+
+    channel = comet.Channel('test', 'alert', history_size=2)
+    for msg in (u'a', u'b', u'\N{Copyright Sign}'):
+        channel.send(msg)
+
+    client = channel.park(0, server.fileno(), Response())
+    assert client._response.body == '000000002b'
+
+    client = channel.park(2, server.fileno(), Response())
+    assert client._response.body == '000000003\xc2\xa9'
+
+
+def wait_message(client):
+    for i in range(200):
+        if client.is_blocked():
+            break
+        time.sleep(0.01)
+
+    return client._response.body
+
+
+def test_unix_socket_backend():
+    """Comet - a message sent from an other process is received through the broker"""
+    browser, server = socket.socketpair()
+
+    path = tempfile.mkdtemp()
+    try:
+        channels = comet.Channels(comet.UnixSocketBackend(os.path.join(path, 'comet')))
+        assert channels.multiprocess
+
+        channels.create('test', 'alert')
+        client = channels['test'].park(0, server.fileno(), Response())
+
+        pid = os.fork()
+        if not pid:
+            # The channels of a forked process are connected to the broker
+            try:
+                channels.send('test', u'hello')
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+
+        assert wait_message(client) == '000000001hello'
+
+        # The messages of this process are also sent through the broker
+        client = channels['test'].park(1, server.fileno(), Response())
+        channels.send('test', u'world')
+        assert wait_message(client) == '000000002world'
+
+        channels.backend.stop()
+    finally:
+        shutil.rmtree(path)
+
+
+def test_broker_order():
+    """Comet - all the processes receive the frames of the broker in the same order"""
+    path = tempfile.mkdtemp()
+    try:
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(os.path.join(path, 'comet'))
+        listener.listen(10)
+        comet.Broker(listener).start()
+
+        def connect():
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.connect(os.path.join(path, 'comet'))
+            connection.settimeout(10)  # A corrupted frame makes the reception fail
+            return connection
+
+        # Each process sends its frames and receives all the frames
+        connections = [connect() for i in range(2)]
+        time.sleep(0.1)
+
+        def send(connection, c):
+            for i in range(50):
+                frame = c * 100000
+                connection.sendall(struct.pack('!I', len(frame)) + frame)
+
+        frames = [[], []]
+
+        def receive(connection, frames):
+            f = connection.makefile('rb', 0)
+            for i in range(100):
+                frames.append(comet._read_frame(f))
+
+        threads = [threading.Thread(target=send, args=(connection, c)) for (connection, c) in zip(connections, 'ab')]
+        threads += [threading.Thread(target=receive, args=args) for args in zip(connections, frames)]
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        assert frames[0] == frames[1]
+        assert all(frame in ('a' * 100000, 'b' * 100000) for frame in frames[0])
+    finally:
+        shutil.rmtree(path)
+
+
+def test_eventlet_engine():
+    """Comet - with the eventlet engine, a waiting client only holds a green thread"""
+    from eventlet import greenthread
+    from nagare.publishers import eventlet_publisher
+
+    browser, server = socket.socketpair()
+    channel = comet.Channel('test', 'alert', engine=eventlet_publisher.Engine())
+
+    response = Response()
+    client = greenthread.spawn(channel.connect, 0, server.fileno(), response)
+    greenthread.sleep(0)
+    assert len(channel) == 1
+
+    channel.send(u'hello')
+    client.wait()
+    assert (len(channel) == 0) and (response.body == '000000001hello')
+    assert not channel.engine.listeners
+
+    # A disconnected client is discarded by the hub
+    client = greenthread.spawn(channel.connect, 1, server.fileno(), Response())
+    greenthread.sleep(0)
+    assert len(channel) == 1
+
+    browser.close()
+    client.wait()
+    assert len(channel) == 0
+    assert not channel.engine.listeners
+
+
+def test_eventlet_publisher():
+    """Comet - the clients of the eventlet publisher wait without thread and receive the message"""
+    from eventlet import api, greenthread
+    from eventlet.green import socket as green_socket
+    from nagare import local, wsgi
+    from nagare.publishers import eventlet_publisher
+
+    local.worker = local.Process()
+    local.request = local.Process()
+
+    channels = comet.channels
+    comet.channels = comet.TextChannels()
+    comet.channels.create('test', 'alert')
+
+    default_engine = comet.default_engine
+    listener = api.tcp_listener(('127.0.0.1', 0))
+    server = greenthread.spawn(eventlet_publisher.server, listener, wsgi.WSGIApp(lambda: None), log=open(os.devnull, 'w'))
+    try:
+        nb_threads = threading.active_count()
+
+        browsers = []
+        for i in range(50):
+            browser = green_socket.socket()
+            browser.connect(listener.getsockname())
+            browser.sendall('GET /?_channel=test&_nb=0 HTTP/1.0\r\n\r\n')
+            browsers.append(browser)
+
+        for i in range(200):
+            if len(comet.channels['test']) == 50:
+                break
+            greenthread.sleep(0.01)
+
+        assert len(comet.channels['test']) == 50
+        assert threading.active_count() == nb_threads
+
+        comet.channels.send('test', u'hello')
+
+        for browser in browsers:
+            response = ''.join(iter(lambda: browser.recv(4096), ''))
+            assert response.startswith('HTTP/1.1 200') and response.endswith('\r\n\r\n000000001hello')
+            browser.close()
+    finally:
+        server.kill()
+        listener.close()
+        comet.set_default_engine(default_engine)
+        comet.channels = channels
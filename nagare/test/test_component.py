@@ -7,7 +7,12 @@
 # this distribution.
 #--
 
-from nagare import component, presentation, continuation, var
+import types
+
+import webob
+from peak.rules import when
+
+from nagare import component, presentation, continuation, var, callbacks, local
 from nagare.namespaces import xhtml
 
 
@@ -125,3 +130,132 @@ def test4():
     foo.becomes(model='foo')
     assert foo.render(h).write_htmlstring(pretty_print=True).strip() == "<h1>I'm bar in foo</h1>"
 
+
+
+def test5():
+    """Component - the callbacks are called by priority, in the order received"""
+    local.request = local.Process()
+
+    calls = []
+    comp = component.Component(Foo())
+    register = lambda priority, f: comp.register_callback(None, priority, f, False, None)
+
+    post = register(3, lambda: calls.append('post'))
+    values = register(1, lambda v: calls.append(v))
+    radio = register(2, lambda: calls.append('radio'))
+    text = register(1, lambda v: calls.append(v))
+    image = register(5, lambda y, v: calls.append((y, v)))
+    pre = register(0, lambda: calls.append('pre'))
+
+    params = [
+        (post, ''), (values, 'a'), ('choice', radio), (text, 'b'), (values, 'c'),
+        (image + '.x', '10'), (image + '.y', '20'), (pre, ''), ('other', 'x')
+    ]
+    state_callbacks = callbacks.Callbacks()
+    state_callbacks.update(comp.serialize_callbacks(True))
+
+    callbacks.process(state_callbacks, webob.Request.blank('/', POST=params), None)
+    assert calls == ['pre', 'b', ('a', 'c'), 'radio', 'post', (False, 10), (True, 20)]
+
+    try:
+        callbacks.process(state_callbacks, webob.Request.blank('/?_action4999'), None)
+    except callbacks.CallbackLookupError:
+        pass
+    else:
+        assert False
+
+
+class Baz(Bar):
+    pass
+
+
+def test6():
+    """Component - the views are cached by class and name of view"""
+    h = xhtml.Renderer()
+    baz = component.Component(Baz())
+
+    assert baz.render(h).write_htmlstring() == "<table><tr><td>I'm Bar</td></tr></table>"
+    assert presentation._cache[(Baz, None)] is presentation.lookup(Bar, None)
+
+    # A new view invalidates the cache
+    @presentation.render_for(Baz)
+    def render(self, h, *args):
+        return h.h1("I'm Baz")
+
+    assert (Baz, None) not in presentation._cache
+    assert baz.render(h).write_htmlstring() == "<h1>I'm Baz</h1>"
+    assert baz.render(h, 'foo').write_htmlstring() == "<h1>I'm bar in foo</h1>"
+
+
+class Qux(Bar):
+    pass
+
+
+def test7():
+    """Component - a rule added directly to the generic method is not bypassed by the views cache"""
+    h = xhtml.Renderer()
+    qux = component.Component(Qux())
+
+    assert qux.render(h).write_htmlstring() == "<table><tr><td>I'm Bar</td></tr></table>"
+    assert presentation._cache[(Qux, None)] is not None
+
+    @when(presentation.render, (Qux, object, object, types.NoneType))
+    def render(self, h, *args):
+        return h.h1("I'm Qux")
+
+    assert not presentation._cache
+    assert qux.render(h).write_htmlstring() == "<h1>I'm Qux</h1>"
+    assert presentation._cache[(Qux, None)] is None
+
+
+class Item(object):
+    def action(self):
+        pass
+
+
+class Items(object):
+    def __init__(self, nb_items):
+        self.items = [component.Component(Item()) for i in range(nb_items)]
+
+    def action(self):
+        pass
+
+
+@presentation.render_for(Item)
+def render(self, h, *args):
+    return h.a('item').action(self.action)
+
+
+@presentation.render_for(Items)
+def render(self, h, *args):
+    with h.div:
+        h << h.a('first').action(self.action)
+        h << self.items
+        h << h.a('last').action(self.action)
+
+    return h.root
+
+
+def test8():
+    """Component - the callbacks are found into the interleaved buckets of the components"""
+    local.request = local.Process()
+
+    items = component.Component(Items(3))
+    items.render(xhtml.Renderer())
+
+    state_callbacks = callbacks.Callbacks()
+    action = lambda id_: state_callbacks[id_][1].f
+
+    state_callbacks.update(items.serialize_callbacks(True))
+    assert [action(id_) for id_ in (0, 4)] == [items().action] * 2
+
+    for item in items().items:
+        state_callbacks.update(item.serialize_callbacks(True))
+    assert [action(id_) for id_ in range(5)] == [items().action] + [item().action for item in items().items] + [items().action]
+
+    try:
+        state_callbacks[5]
+    except KeyError:
+        pass
+    else:
+        assert False
@@ -21,18 +21,19 @@ from nagare.namespaces import xml
 from nagare import presentation
 from nagare import component
 from nagare import wsgi
+from nagare import database
 from nagare import local
-from nagare.sessions.memory_sessions import SessionsWithPickledStates
+from nagare.sessions.memory_sessions import Sessions, SessionsWithPickledStates
 
 from exceptions import Exception
 
 
-def create_FixtureApp(app):
+def create_FixtureApp(app, sessions_manager=None):
     local.worker = local.Process()
     local.request = local.Process()
 
     app = wsgi.create_WSGIApp(app)
-    app.set_sessions_manager(SessionsWithPickledStates())
+    app.set_sessions_manager(sessions_manager or SessionsWithPickledStates())
     app.start()
 
     return TestApp(app)
@@ -271,3 +272,48 @@ def test8():
     assert u"Mary Ingalls" in res
     res = res.click(linkid="get_name")
     assert u"Charles Ingalls" in res
+
+
+class No_database_app(object):
+    pass
+
+
+@presentation.render_for(No_database_app)
+def render(self, h, *args):
+    return h.div('No database')
+
+
+@with_setup(setup_func_2, teardown_func)
+def test9():
+    """ database - a transaction is only begun by the requests using the database """
+    session.remove()
+    database.transactions.reset()
+
+    res = create_FixtureApp(No_database_app).get('/')
+    assert u"No database" in res
+    assert (database.transactions.nb_requests, database.transactions.nb_transactions) == (1, 0)
+
+    res = create_FixtureApp(My_database_app).get('/')
+    assert u"Charles Ingalls" in res
+    assert (database.transactions.nb_requests, database.transactions.nb_transactions) == (2, 1)
+
+    # The session of the thread now exists, but the database isn't used
+    res = create_FixtureApp(No_database_app).get('/')
+    assert u"No database" in res
+    assert (database.transactions.nb_requests, database.transactions.nb_transactions) == (3, 1)
+
+
+@with_setup(setup_func_2, teardown_func)
+def test10():
+    """ database - the entities of an objects graph kept unpickled stay attached between the requests """
+    app = create_FixtureApp(My_database_app, Sessions())
+    res = app.get('/')
+    assert u"Charles Ingalls" in res
+
+    res = res.click(linkid="add_mary")
+    assert u"Charles Ingalls" in res
+    assert u"Mary Ingalls" in res
+
+    res = res.click(linkid="add_carrie")
+    assert u"Carrie Ingalls" in res
+    assert u"Mary Ingalls" in res
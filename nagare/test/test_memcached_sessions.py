@@ -0,0 +1,428 @@
+#--
+# Copyright (c) 2008-2013 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+#--
+
+import threading
+
+from nagare import local
+from nagare.sessions import ExpirationError, LockTimeoutError, memcached_sessions, memcached_pool
+
+
+class Memcache(object):
+    """In memory fake of a ``memcache.Client``"""
+
+    def __init__(self):
+        self.data = {}
+        self.cas_ids = {}  # Key -> CAS id, changed at each write
+        self.nb_calls = 0
+        self.dead = False
+
+    def is_dead(self):
+        return self.dead
+
+    def check(self):
+        return not self.dead
+
+    def _write(self, key, value):
+        self.data[key] = value
+        self.cas_ids[key] = self.cas_ids.get(key, 0) + 1
+
+    def add(self, key, value, time=0):
+        self.nb_calls += 1
+        if self.dead or (key in self.data):
+            return False
+
+        self._write(key, value)
+        return True
+
+    def incr(self, key, delta=1):
+        self.nb_calls += 1
+        if key not in self.data:
+            return None
+
+        self._write(key, self.data[key] + delta)
+        return self.data[key]
+
+    def set(self, key, value, time=0, min_compress_len=0):
+        self.nb_calls += 1
+        self._write(key, value)
+        return True
+
+    def store_multi(self, commands, time=0, key_prefix='', min_compress_len=0):
+        self.nb_calls += 1
+
+        stored = []
+        for (cmd, key, value, cas_id) in commands:
+            key = key_prefix + key
+            ok = (cmd == 'set') or ((cmd == 'add') and (key not in self.data)) or ((cmd == 'cas') and (self.cas_ids.get(key) == cas_id))
+            if ok:
+                self._write(key, value)
+            stored.append(ok)
+
+        return stored
+
+    def get(self, key):
+        self.nb_calls += 1
+        return self.data.get(key)
+
+    def delete(self, key, time=0):
+        self.nb_calls += 1
+        return self.data.pop(key, None) is not None
+
+    def get_multi(self, keys, key_prefix=''):
+        self.nb_calls += 1
+        return dict((key, self.data[key_prefix + key]) for key in keys if key_prefix + key in self.data)
+
+    def gets_multi(self, keys, key_prefix=''):
+        self.nb_calls += 1
+        keys = [key for key in keys if key_prefix + key in self.data]
+        return (
+            dict((key, self.data[key_prefix + key]) for key in keys),
+            dict((key, self.cas_ids[key_prefix + key]) for key in keys)
+        )
+
+    def set_multi(self, mapping, time=0, key_prefix='', min_compress_len=0):
+        self.nb_calls += 1
+        for (key, value) in mapping.items():
+            self._write(key_prefix + key, value)
+        return []
+
+    def flush_all(self):
+        self.data.clear()
+
+
+def create_sessions(servers=('127.0.0.1:11211',), **kw):
+    local.worker = local.Process()
+    local.request = local.Process()
+
+    sessions = memcached_sessions.Sessions(reset=False, debug=False, servers=servers, **kw)
+
+    memcaches = dict((server, Memcache()) for server in servers)
+    sessions.connections = memcached_pool.Servers(servers, create_client=memcaches.get)
+
+    return sessions
+
+
+def get_memcache(sessions, session_id=42):
+    """Return the fake memcached server of a session"""
+    return sessions.connections.create_client(sessions.connections.get_server(session_id))
+
+
+def test_lock1():
+    """Memcached sessions - the lock is acquired and released"""
+    sessions = create_sessions()
+    connection = get_memcache(sessions)
+
+    lock = sessions.get_lock(42)
+    lock.acquire()
+    assert connection.get('nagare_42_lock') == lock.owner
+
+    lock.release()
+    assert connection.get('nagare_42_lock') is None
+
+    lock.acquire()
+    lock.release()
+
+    assert (sessions.lock_counters.acquisitions, sessions.lock_counters.contentions) == (2, 0)
+
+
+def test_lock2():
+    """Memcached sessions - a lock not acquired in time raises an exception"""
+    sessions = create_sessions(lock_poll_time=0.001, lock_max_poll_time=0.004, lock_max_wait_time=0.05)
+
+    sessions.get_lock(42).acquire()
+
+    connection = get_memcache(sessions)
+    nb_calls = connection.nb_calls
+    try:
+        sessions.get_lock(42).acquire()
+    except LockTimeoutError:
+        pass
+    else:
+        assert False
+
+    # Backoff: far less tries than with a constant 1ms poll time
+    assert connection.nb_calls - nb_calls < 30
+    assert (sessions.lock_counters.timeouts, sessions.lock_counters.contentions) == (1, 1)
+    assert sessions.lock_counters.max_wait_time >= 0.05
+
+
+def test_lock3():
+    """Memcached sessions - a lock expired and acquired by an other process is not released"""
+    sessions = create_sessions(lock_ttl=0.5)
+    connection = get_memcache(sessions)
+
+    lock = sessions.get_lock(42)
+    lock.acquire()
+
+    # Lock expiration
+    connection.delete('nagare_42_lock')
+    connection.add('nagare_42_lock', 10)
+
+    lock.release()
+    assert connection.get('nagare_42_lock') == 10
+
+
+def test_lock_lost():
+    """Memcached sessions - a state is not stored if the lock was lost"""
+    sessions = create_sessions(lock_ttl=0.5)
+    connection = get_memcache(sessions)
+
+    lock = sessions.get_lock(42)
+    lock.acquire()
+    sessions.create(42, 'secure', lock)
+    sessions.store_state(42, 0, 'secure', False, None, 'data')
+    assert connection.get('nagare_42_sess') == (1, 'secure', None)
+
+    # Lock expiration
+    connection.delete('nagare_42_lock')
+
+    try:
+        sessions.store_state(42, 1, 'secure', False, None, 'data')
+    except LockTimeoutError:
+        pass
+    else:
+        assert False
+
+    assert connection.get('nagare_42_00001') is None
+    assert sessions.lock_counters.losses == 1
+
+
+def test_compare_and_set():
+    """Memcached sessions - a state is not stored if the session was stored by an other process"""
+    sessions = create_sessions(lock_ttl=0.5)
+    connection = get_memcache(sessions)
+
+    lock = sessions.get_lock(42)
+    lock.acquire()
+    sessions.create(42, 'secure', lock)
+    sessions.store_state(42, 0, 'secure', False, None, 'data0')
+    lock.release()
+
+    local.request.clear()
+    lock = sessions.get_lock(42)
+    lock.acquire()
+    sessions.fetch_state(42, 0)
+
+    # Lock expired, then acquired by an other process storing a new state,
+    # while the lock is still in the local cache of this process
+    connection.set('nagare_42_sess', (2, 'secure', None))
+    connection.set('nagare_42_00001', 'other')
+
+    try:
+        sessions.store_state(42, 1, 'secure', False, None, 'data1')
+    except LockTimeoutError:
+        pass
+    else:
+        assert False
+
+    assert connection.get('nagare_42_sess') == (2, 'secure', None)
+    assert connection.get('nagare_42_00001') == 'other'
+    assert sessions.lock_counters.losses == 1
+
+
+def test_orphan_state():
+    """Memcached sessions - a state written by a process which lost its lock is replaced"""
+    sessions = create_sessions()
+    connection = get_memcache(sessions)
+
+    lock = sessions.get_lock(42)
+    lock.acquire()
+    sessions.create(42, 'secure', lock)
+    sessions.store_state(42, 0, 'secure', False, None, 'data0')
+    lock.release()
+
+    local.request.clear()
+    lock = sessions.get_lock(42)
+    lock.acquire()
+    sessions.fetch_state(42, 0)
+
+    connection.set('nagare_42_00001', 'orphan')
+    sessions.store_state(42, 1, 'secure', False, None, 'data1')
+    lock.release()
+
+    assert connection.get('nagare_42_00001') == 'data1'
+    assert local.request.memcached_round_trips == 5
+
+
+def test_migration():
+    """Memcached sessions - a session stored by a previous version is migrated"""
+    sessions = create_sessions()
+    connection = get_memcache(sessions)
+
+    # Latest state id in its own key, with or without a fencing token
+    for token in ({}, {'nagare_42_token': 1}):
+        local.request.clear()
+        connection.flush_all()
+        connection.set_multi(dict({'nagare_42_state': 1, 'nagare_42_sess': ('secure', 'session'), 'nagare_42_00000': 'data0'}, **token))
+
+        lock = sessions.get_lock(42)
+        lock.acquire()
+        assert sessions.fetch_state(42, 0) == (1, 'secure', 'session', 'data0')
+        sessions.store_state(42, 1, 'secure', False, 'session', 'data1')
+        lock.release()
+
+        assert connection.get('nagare_42_sess') == (2, 'secure', 'session')
+        assert connection.get('nagare_42_00001') == 'data1'
+
+    # Without its latest state id, a session can't be migrated
+    connection.delete('nagare_42_state')
+    connection.set('nagare_42_sess', ('secure', 'session'))
+    try:
+        sessions.fetch_state(42, 1)
+    except ExpirationError:
+        pass
+    else:
+        assert False
+
+
+def test_round_trips():
+    """Memcached sessions - a request does only 4 round-trips to the memcached server"""
+    sessions = create_sessions()
+    connection = get_memcache(sessions)
+
+    lock = sessions.get_lock(42)
+    lock.acquire()
+    sessions.create(42, 'secure', lock)
+    sessions.store_state(42, 0, 'secure', False, None, 'data0')
+    lock.release()
+
+    for state_id in (1, 2):
+        local.request.clear()
+        nb_calls = connection.nb_calls
+
+        lock = sessions.get_lock(42)
+        lock.acquire()
+        last_state_id, secure_id, session_data, state_data = sessions.fetch_state(42, state_id - 1)
+        assert (last_state_id, state_data) == (state_id, 'data%d' % (state_id - 1))
+        sessions.store_state(42, last_state_id, secure_id, False, session_data, 'data%d' % state_id)
+        lock.release()
+
+        assert connection.nb_calls - nb_calls == local.request.memcached_round_trips == 4
+
+    assert connection.get('nagare_42_sess')[0] == 3
+
+    # An XHR request doesn't create a new state
+    sessions.get_lock(42).acquire()
+    sessions.fetch_state(42, 2)
+    sessions.store_state(42, 2, 'secure', True, None, 'xhr')
+    assert connection.get('nagare_42_sess')[0] == 3
+    assert connection.get('nagare_42_00002') == 'xhr'
+
+
+def test_hash_ring():
+    """Memcached sessions - removing a server only moves its sessions"""
+    ring = memcached_pool.HashRing(['a', 'b', 'c', 'd'])
+
+    nodes = dict((key, ring.get_node(str(key))) for key in range(1000))
+    assert all(650 < nodes.values().count(node) * 4 < 1350 for node in 'abcd')
+
+    ring.remove_node('c')
+    assert all(ring.get_node(str(key)) == node for (key, node) in nodes.items() if node != 'c')
+    assert 'c' not in [ring.get_node(str(key)) for key in range(1000)]
+
+    ring.add_node('c')
+    assert all(ring.get_node(str(key)) == node for (key, node) in nodes.items())
+
+
+def test_pool():
+    """Memcached sessions - the connections are reused"""
+    created = []
+    pool = memcached_pool.Pool(lambda: created.append(Memcache()) or created[-1], 2)
+
+    client1 = pool.acquire()
+    client2 = pool.acquire()
+    assert not pool.semaphore.acquire(False)
+
+    pool.release(client1)
+    assert pool.acquire() is client1
+    assert len(created) == 2
+
+
+def test_servers():
+    """Memcached sessions - the sessions are spread over the servers and re-routed from a dead server"""
+    servers = ('s1:11211', 's2:11211', 's3:11211')
+    sessions = create_sessions(servers)
+
+    for session_id in range(30):
+        lock = sessions.get_lock(session_id)
+        lock.acquire()
+        sessions.create(session_id, 'secure', lock)
+        lock.release()
+
+    memcaches = [sessions.connections.create_client(server) for server in servers]
+    assert all(memcache.data for memcache in memcaches)
+
+    # A server found dead is removed from the hash ring
+    server = sessions.connections.get_server(0)
+    get_memcache(sessions, 0).dead = True
+    with sessions.connections.connection(0):
+        pass
+
+    assert sessions.connections.get_server(0) != server
+    assert all(sessions.connections.get_server(session_id) != server for session_id in range(30))
+
+    # And retried later, but not put back while still dead
+    sessions.connections.dead[server] = 0
+    assert sessions.connections.get_server(0) != server
+    assert sessions.connections.dead[server] > 0
+
+    # Once alive, it's put back with its sessions
+    memcache = sessions.connections.create_client(server)
+    memcache.dead = False
+    sessions.connections.dead[server] = 0
+    assert sessions.connections.get_server(0) == server
+    assert memcache.data
+    assert not sessions.connections.dead
+
+
+def test_last_server():
+    """Memcached sessions - the last live server is never removed from the hash ring"""
+    sessions = create_sessions(('s1:11211', 's2:11211'), lock_max_wait_time=10)
+
+    for server in ('s1:11211', 's2:11211'):
+        sessions.connections.create_client(server).dead = True
+        sessions.connections.mark_dead(server)
+
+    assert sessions.connections.dead.keys() == ['s1:11211']
+    assert sessions.connections.get_server(42) == 's2:11211'
+
+    # The lock can't be acquired on a dead server
+    try:
+        sessions.get_lock(42).acquire()
+    except LockTimeoutError:
+        pass
+    else:
+        assert False
+
+
+def test_servers_threads():
+    """Memcached sessions - the servers are looked up while others threads change the hash ring"""
+    servers = memcached_pool.Servers(['s%d:11211' % i for i in range(5)], dead_retry=0, create_client=lambda server: Memcache())
+
+    errors = []
+
+    def lookup():
+        try:
+            for key in range(20000):
+                servers.get_server(key)
+        except Exception, e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=lookup) for i in range(4)]
+    for thread in threads:
+        thread.start()
+
+    while any(thread.is_alive() for thread in threads):
+        servers.mark_dead('s1:11211')
+        servers.mark_dead('s3:11211')
+
+    for thread in threads:
+        thread.join()
+
+    assert not errors
@@ -14,7 +14,7 @@ import unittest
 from lxml import etree
 
 from nagare.namespaces import xml, xhtml
-from nagare.serializer import serialize
+from nagare.serializer import serialize, stream
 
 
 class TestSerializer(unittest.TestCase):
@@ -264,3 +264,23 @@ class TestSerializer(unittest.TestCase):
         self.assertEqual(r, ('', 'hello<p>hello</p>\n<person>hello</person><!--hello--><?hello ?><person>hello</person>hello'))
         r = serialize(l, '', '<!DOCTYPE html>', True)
         self.assertEqual(r, ('', 'hello<p>hello</p>\n<person>hello</person><!--hello--><?hello ?><person>hello</person>hello'))
+
+    def test_stream(self):
+        h = xhtml.Renderer()
+        table = lambda: h.div(h.table([h.tr(h.td(i), h.td(h.a(u'été', href='#'))) for i in range(1000)]), h.p('end'))
+
+        r = stream(table(), 'application/xhtml+xml', '<!DOCTYPE html>', True)
+        self.assertEqual(r[0], 'application/xhtml+xml')
+        self.assertEqual(''.join(r[1]), serialize(table(), 'application/xhtml+xml', '<!DOCTYPE html>', True)[1])
+
+        chunks = list(xml.iterwrite(table(), chunk_size=1024))
+        self.assert_(len(chunks) > 10)
+        self.assertEqual(''.join(chunks), table().write_xmlstring())
+
+        # In HTML, only the elements serialized at once are pretty printed
+        r = stream(table(), 'text/html', '<!DOCTYPE html>', True)
+        self.assertEqual(r[0], 'text/html')
+        self.assertEqual(''.join(r[1]).replace('\n', ''), serialize(table(), 'text/html', '<!DOCTYPE html>', True)[1].replace('\n', ''))
+
+        r = stream('hello world', 'text/msg', '<!DOCTYPE html>', True)
+        self.assertEqual(r, ('text/msg', ['hello world']))
@@ -0,0 +1,573 @@
+#--
+# Copyright (c) 2008-2013 Net-ng.
+# All rights reserved.
+#
+# This software is licensed under the BSD License, as described in
+# the file LICENSE.txt, which you should have received as part of
+# this distribution.
+#--
+
+import os
+import time
+import tempfile
+import threading
+
+import webob
+
+from nagare import component, state, local, callbacks
+from nagare.sessions import serializer, memory_sessions, lru_dict, compression, file_sessions, shared_sessions
+from nagare.sessions import ExpirationError, LockTimeoutError
+
+local.worker = local.Process()
+local.request = local.Process()
+
+
+class Node(object):
+    def __init__(self, depth):
+        self.children = [component.Component(Node(depth - 1)) for i in range(2)] if depth else []
+
+    def action(self):
+        pass
+
+
+def create_tree(depth):
+    root = component.Component(Node(depth))
+
+    stack = [root]
+    while stack:
+        comp = stack.pop()
+        comp.register_callback(None, 4, comp().action, False, None)
+        comp.register_callback('other', 4, comp().action, False, None)
+        stack.extend(comp().children)
+
+    return root
+
+# -------------------------------------------------------------------------------------------------------
+
+def test_dummy_serializer():
+    """Sessions - the dummy serializer keeps the objects graph untouched"""
+    s = serializer.Dummy()
+
+    root = create_tree(2)
+    session_data, (data, callbacks) = s.dumps(root, True)
+
+    assert session_data is None
+    assert data is root
+    assert len(callbacks) == 2 * 7
+
+
+def test_delta_serializer1():
+    """Sessions - the delta serializer keeps the identity of the objects shared between components"""
+    s = serializer.Delta()
+
+    root = create_tree(2)
+    shared = []
+    root().shared = shared
+    root().children[1]().children[0]().shared = shared
+
+    session_data, state_data = s.dumps(root, True)
+    root2, callbacks = s.loads(session_data, state_data)
+
+    assert len(state_data[1]) == 7 + 2
+    assert len(callbacks) == 2 * 7
+    assert root2().shared is root2().children[1]().children[0]().shared
+    assert isinstance(root2().children[0](), Node)
+
+
+def test_delta_serializer2():
+    """Sessions - the delta serializer keeps the stateless objects into the session"""
+    s = serializer.Delta()
+
+    stateless = state.stateless(Node(0))
+    root = create_tree(1)
+    root().children.append(stateless)
+
+    session_data, state_data = s.dumps(root, True)
+    root2, callbacks = s.loads(session_data, state_data)
+
+    assert session_data == {stateless._persistent_id: stateless}
+    assert root2().children[2] is stateless
+
+
+def test_delta_serializer3():
+    """Sessions - only the pickles of the modified components differ from one state to the other"""
+    s = serializer.Delta()
+
+    root = create_tree(3)
+    chunks1 = s.dumps(root, True)[1][1]
+
+    root, callbacks = s.loads(None, s.dumps(root, True)[1])
+    root().children[0]().children[1]().title = 'modified'
+    chunks2 = s.dumps(root, True)[1][1]
+
+    assert len(chunks1) == len(chunks2)
+    assert len([chunk for chunk in chunks2 if chunk not in chunks1]) == 2  # The modified component and the callbacks
+
+
+def test_delta_sessions():
+    """Sessions - the states stored with the ``delta`` option share the unmodified pickles"""
+    sessions = memory_sessions.SessionsWithPickledStates(delta=True)
+    sessions.create(1, None, None)
+
+    sessions.set_root(1, 0, None, False, create_tree(2))
+    for state_id in range(2):
+        root = sessions.get_root(1, state_id)[2][0]
+        sessions.set_root(1, state_id + 1, None, False, root)
+
+    chunks1 = sessions.fetch_state(1, 1)[3][1]
+    chunks2 = sessions.fetch_state(1, 2)[3][1]
+    assert all((chunk1 is chunk2) for (chunk1, chunk2) in zip(chunks1, chunks2)[:-1])
+
+    assert len(sessions.get_root(1, 0)[2][1]) == 2 * 7
+
+
+def test_lru_dict1():
+    """Sessions - the last recently used keys are deleted when the maximum number of keys is reached"""
+    d = lru_dict.LRUDict(3)
+    d['a'] = 1
+    d['b'] = 2
+    d['c'] = 3
+    d['a']
+    d['d'] = 4
+
+    assert 'b' not in d
+    assert len(d) == 3
+
+    d['c'] = 5
+    d['e'] = 6
+    assert 'a' not in d
+    assert d['c'] == 5
+
+    del d['c']
+    assert sorted(d.items) == ['d', 'e']
+
+
+def test_lru_dict2():
+    """Sessions - the last recently used keys are deleted when the maximum memory is reached"""
+    d = lru_dict.LRUDict(10, 10, len)
+    d['a'] = 'xxx'
+    d['b'] = 'xxxx'
+    d['c'] = 'xxx'
+    assert d.memory == 10
+
+    d['d'] = 'xx'
+    assert 'a' not in d
+    assert d.memory == 9
+
+    d.set_memory('d', 7)
+    assert sorted(d.items) == ['c', 'd']
+    assert d.memory == 10
+
+    d['e'] = 'x' * 20
+    assert d.items.keys() == ['e']
+    assert d.memory == 20
+
+
+def test_max_memory():
+    """Sessions - the last recently used sessions are deleted when the pickled states use too much memory"""
+    sessions = memory_sessions.SessionsWithPickledStates(max_memory=20000)
+
+    for session_id in range(10):
+        sessions.create(session_id, None, None)
+        sessions.set_root(session_id, 0, None, False, create_tree(4))
+
+    assert 0 < sessions._sessions.memory <= 20000
+    assert 0 < len(sessions._sessions) < 10
+    assert sessions.check_session_id(9)
+    assert not sessions.check_session_id(0)
+
+
+def test_zlib_codec():
+    """Sessions - the zlib codec compresses the states"""
+    s = serializer.Pickle(codec=compression.Zlib(9))
+
+    session_data, state_data = s.dumps(create_tree(4), True)
+    root, callbacks = s.loads(session_data, state_data)
+
+    assert len(callbacks) == 2 * 31
+    assert len(root().children[1]().children[0]().children) == 2
+    assert s.codec.ratio > 2
+    assert (s.codec.nb_encoded, s.codec.nb_decoded) == (1, 1)
+
+
+def test_zlib_dictionary():
+    """Sessions - a dictionary improves the compression of the small states"""
+    dictionary = compression.train_dictionary([serializer.Pickle().dumps(create_tree(2), True)[1]])
+
+    codec1 = compression.Zlib(6)
+    codec2 = compression.Zlib(6, dictionary)
+
+    state = serializer.Pickle().dumps(create_tree(0), True)[1]
+    encoded = codec2.encode(state)
+
+    assert codec2.decode(encoded) == state
+    assert codec2.decode(encoded) == state
+    assert len(encoded) * 2 < len(codec1.encode(state))
+
+
+def test_zlib_other_dictionary():
+    """Sessions - a state encoded with another dictionary is expired"""
+    state = serializer.Pickle().dumps(create_tree(0), True)[1]
+    encoded = compression.Zlib(6, state).encode(state)
+
+    for codec in (compression.Zlib(6), compression.Zlib(6, 'another dictionary')):
+        try:
+            codec.decode(encoded)
+        except ExpirationError:
+            pass
+        else:
+            assert False
+
+
+class LegacySerializer(serializer.Pickle):
+    """Serializer of an application, written before the codecs"""
+
+    def __init__(self, pickler, unpickler):
+        super(LegacySerializer, self).__init__(pickler, unpickler)
+
+
+def test_legacy_serializer():
+    """Sessions - the serializers without codec are still usable"""
+    sessions = memory_sessions.SessionsWithPickledStates(serializer=LegacySerializer)
+    sessions.set_config('', {'serializer': 'nagare.test.test_sessions:LegacySerializer'}, None)
+    assert isinstance(sessions.serializer, LegacySerializer)
+
+    sessions.create(1, None, None)
+    sessions.set_root(1, 0, None, False, create_tree(1))
+    assert len(sessions.get_root(1, 0)[2][1]) == 2 * 3
+
+    # A serializer is given the codec which really encodes
+    sessions.set_config('', {'codec': 'nagare.sessions.compression:Zlib'}, None)
+    assert isinstance(sessions.serializer.codec, compression.Zlib)
+
+
+def test_delta_codec():
+    """Sessions - the encoded chunks of the unmodified components are shared between states"""
+    sessions = memory_sessions.SessionsWithPickledStates(delta=True, codec=compression.Zlib(6))
+    sessions.create(1, None, None)
+
+    sessions.set_root(1, 0, None, False, create_tree(2))
+    for state_id in range(2):
+        root = sessions.get_root(1, state_id)[2][0]
+        sessions.set_root(1, state_id + 1, None, False, root)
+
+    chunks1 = sessions.fetch_state(1, 1)[3][1]
+    chunks2 = sessions.fetch_state(1, 2)[3][1]
+    assert all((chunk1 is chunk2) for (chunk1, chunk2) in zip(chunks1, chunks2)[:-1])
+    assert sessions.serializer.codec.ratio > 1
+
+
+def test_delta_memory():
+    """Sessions - the pickles shared between the states are only counted once"""
+    sessions = memory_sessions.SessionsWithPickledStates(delta=True)
+    sessions.create(1, None, None)
+
+    sessions.set_root(1, 0, None, False, create_tree(4))
+    memory = sessions._sessions.memory
+
+    for state_id in range(5):
+        root = sessions.get_root(1, state_id)[2][0]
+        sessions.set_root(1, state_id + 1, None, False, root)
+
+    # Only the root pickle, with the callbacks, is not shared
+    assert memory < sessions._sessions.memory < memory * 2
+
+
+def test_delta_serializer():
+    """Sessions - a configured serializer is not replaced by the delta option"""
+    try:
+        memory_sessions.SessionsWithPickledStates(delta=True, serializer=LegacySerializer)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+    errors = []
+    sessions = memory_sessions.SessionsWithPickledStates()
+    sessions.set_config('', {'delta': True, 'serializer': 'nagare.test.test_sessions:LegacySerializer'}, errors.append)
+    assert errors and isinstance(sessions.serializer, LegacySerializer)
+
+    sessions.set_config('', {'delta': True}, errors.append)
+    assert isinstance(sessions.serializer, serializer.Delta)
+
+
+def test_file_sessions1():
+    """Sessions - the states are read from the memory mapped segments without copy"""
+    sessions = file_sessions.Sessions()
+    sessions.create(1, None, None)
+
+    sessions.set_root(1, 0, None, False, create_tree(2))
+    state_data = sessions.fetch_state(1, 0)[3]
+    assert isinstance(state_data, buffer)
+
+    root, callbacks = sessions.get_root(1, 0)[2]
+    assert len(callbacks) == 2 * 7
+    assert len(root().children[1]().children) == 2
+
+
+def test_file_sessions2():
+    """Sessions - the segments with the states of expired sessions are compacted"""
+    sessions = file_sessions.Sessions(nb_sessions=4, nb_states=2, segment_size=20000)
+
+    for session_id in range(20):
+        sessions.create(session_id, None, None)
+        for state_id in range(4):
+            sessions.set_root(session_id, state_id, None, False, create_tree(3))
+
+    assert 1 < len(sessions.segments) <= 3
+    assert all(sessions.check_session_id(session_id) for session_id in range(16, 20))
+
+    for session_id in range(16, 20):
+        for state_id in (2, 3):
+            root, callbacks = sessions.get_root(session_id, state_id)[2]
+            assert len(callbacks) == 2 * 15
+
+
+def test_file_sessions3():
+    """Sessions - the states are read and stored by concurrent threads during the compactions"""
+    sessions = file_sessions.Sessions(nb_sessions=8, nb_states=2, segment_size=5000)
+    errors = []
+
+    def requests(session_id):
+        try:
+            sessions.create(session_id, None, None)
+            sessions.set_root(session_id, 0, None, False, create_tree(3))
+            for state_id in range(100):
+                root = sessions.get_root(session_id, state_id)[2][0]
+                sessions.set_root(session_id, state_id + 1, None, False, root)
+        except Exception, e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=requests, args=(session_id,)) for session_id in range(8)]
+    for t in threads:
+        t.start()
+
+    for t in threads:
+        t.join()
+
+    assert not errors
+    for session_id in range(8):
+        root = sessions.get_root(session_id, 100)[2][0]
+        assert len(root().children) == 2
+
+
+def create_shared_sessions(**kw):
+    address = tempfile.mktemp(prefix='nagare-test-')
+
+    server = shared_sessions.Server(address)
+    ready = threading.Event()
+    t = threading.Thread(target=server.serve_forever, args=(ready.set,))
+    t.setDaemon(True)
+    t.start()
+    ready.wait(5)
+
+    return shared_sessions.Sessions(address, lock_max_wait_time=0.2, **kw)
+
+
+def in_thread(f, *args):
+    """Call a function in a new thread, i.e with a new connection to the sessions server"""
+    result = []
+    t = threading.Thread(target=lambda: result.append(f(*args)))
+    t.start()
+    t.join()
+
+    return result[0]
+
+
+def test_shared_sessions1():
+    """Sessions - the states are shared through the sessions server"""
+    sessions = create_shared_sessions()
+    sessions.create(1, 'secure', None)
+    sessions.set_root(1, 0, 'secure', False, create_tree(2))
+
+    assert sessions.check_session_id(1)
+    last_state_id, secure_id, (root, callbacks) = in_thread(sessions.get_root, 1, 0)
+    assert (last_state_id, secure_id, len(callbacks)) == (1, 'secure', 2 * 7)
+
+    sessions.delete(1)
+    try:
+        sessions.fetch_state(1, 0)
+    except ExpirationError:
+        pass
+    else:
+        assert False
+
+
+def test_shared_sessions2():
+    """Sessions - a session locked by a connection is released when the connection is closed"""
+    sessions = create_shared_sessions()
+    sessions.create(1, 'secure', None)
+
+    lock = sessions.get_lock(1)
+    lock.acquire()
+
+    def acquire():
+        try:
+            sessions.get_lock(1).acquire()
+        except LockTimeoutError:
+            return False
+
+        return True
+
+    t0 = time.time()
+    assert not in_thread(acquire)
+    assert time.time() - t0 >= 0.2
+
+    lock.release()
+    assert in_thread(acquire)  # The lock is released when the thread connection is garbage collected
+    assert in_thread(acquire)
+
+    # A lock of an unknown session is not acquired, the expiration being reported later
+    lock = sessions.get_lock(2)
+    lock.acquire()
+    assert not lock.acquired
+
+
+def test_shared_sessions3():
+    """Sessions - the sessions server is shared by forked processes"""
+    sessions = shared_sessions.Sessions(start_server=True)
+    try:
+        sessions.create(1, 'secure', None)
+
+        pid = os.fork()
+        if not pid:
+            # Child process
+            sessions.get_lock(1).acquire()
+            sessions.set_root(1, 0, 'secure', False, create_tree(1))
+            os._exit(0)
+
+        os.waitpid(pid, 0)
+
+        # The lock of the dead process is released
+        sessions.get_lock(1).acquire()
+        root, callbacks = sessions.get_root(1, 0)[2]
+        assert len(callbacks) == 2 * 3
+    finally:
+        sessions.stop_server()
+
+
+def test_shared_sessions4():
+    """Sessions - the sessions servers of a process don't steal the socket of each other"""
+    sessions1 = shared_sessions.Sessions(start_server=True)
+    sessions2 = shared_sessions.Sessions(start_server=True)
+    try:
+        assert sessions1.server_address != sessions2.server_address
+
+        sessions1.create(1, 'secure1', None)
+        sessions1.set_root(1, 0, 'secure1', False, create_tree(1))
+        sessions2.create(1, 'secure2', None)
+        sessions2.set_root(1, 0, 'secure2', False, create_tree(1))
+        assert sessions1.fetch_state(1, 0)[1] == 'secure1'
+
+        # A live server is not replaced
+        try:
+            sessions2.start_server(shared_sessions.Server(sessions1.server_address))
+        except IOError:
+            pass
+        else:
+            assert False
+
+        assert sessions1.fetch_state(1, 0)[1] == 'secure1'
+    finally:
+        sessions1.stop_server()
+        sessions2.stop_server()
+
+
+def test_readonly_state():
+    """Sessions - a read-only state is rendered from a snapshot, without lock, and not stored"""
+    sessions = memory_sessions.SessionsWithPickledStates()
+    sessions.create(1, 'secure', threading.Lock())
+    sessions.set_root(1, 0, 'secure', False, create_tree(1))
+
+    request = webob.Request.blank('/?_s=1&_c=0', cookies={'_nagare': 'secure'})
+    state = sessions.get_state(request, webob.Response(), False, True)
+    state.acquire()
+    assert not state.locked
+
+    root, callbacks = state.get_root()
+    assert (state.state_id, len(callbacks)) == (0, 2 * 3)
+
+    state.set_root(False, root)
+    state.release()
+    assert sessions.fetch_state(1, 0)[0] == 1
+    assert state.lock_hold_time == 0
+
+    # A locked state measures the time the session was locked
+    state = sessions.get_state(request, webob.Response(), False)
+    state.acquire()
+    time.sleep(0.01)
+    state.release()
+    assert state.lock_hold_time >= 0.01
+
+
+def test_session_ids():
+    """Sessions - the new sessions ids are random 63 bits integers"""
+    sessions = memory_sessions.SessionsWithPickledStates()
+
+    ids = set(sessions.get_state(webob.Request.blank('/'), webob.Response(), False).session_id for i in range(1000))
+    assert len(ids) == 1000
+    assert all(0 <= session_id < 2 ** 63 for session_id in ids)
+
+
+def test_callbacks_ids():
+    """Sessions - the callbacks ids are allocated by a monotonic counter kept into the session"""
+    local.request.clear()
+
+    sessions = memory_sessions.SessionsWithPickledStates()
+    sessions.create(1, 'secure', threading.Lock())
+    sessions.set_root(1, 0, 'secure', False, create_tree(1))
+
+    local.request.clear()
+    root, callbacks_ = sessions.get_root(1, 0)[2]
+    assert sorted(callbacks_) == range(2 * 3)
+    assert callbacks.get_next_id() == 2 * 3
+
+    assert root.register_callback(None, 4, root().action, False, None) == '_action4%d' % (2 * 3)
+    sessions.set_root(1, 1, 'secure', False, root)
+
+    # Going back to the first state, the ids are not reused
+    local.request.clear()
+    sessions.get_root(1, 0)
+    assert callbacks.get_next_id() == 2 * 3 + 1
+
+
+def test_session_format():
+    """Sessions - a session stored in an unknown format is expired"""
+    local.request.clear()
+
+    sessions = memory_sessions.SessionsWithPickledStates()
+    sessions.create(1, 'secure', threading.Lock())
+
+    # The legacy dict-shaped sessions, even with 3 keys, are not unpacked
+    for session_data in (None, {}, (0, {}), {'a': 1, 'b': 2, 'c': 3}):
+        sessions.store_state(1, 0, 'secure', False, session_data, sessions.serializer.dumps(create_tree(0), True)[1])
+
+        try:
+            sessions.get_root(1, 0)
+        except ExpirationError:
+            pass
+        else:
+            assert False
+
+
+def test_callbacks_buckets():
+    """Sessions - the callbacks are grouped by views, with their distinct actions"""
+    root = create_tree(0)
+    root.serialize_callbacks(True)
+
+    for i in range(100):
+        root.register_callback(None, 4, root().action, False, None)
+
+    new = root.serialize_callbacks(False)
+    assert sorted(new) == [None, 'other']
+    assert (len(new[None]), len(new[None].actions)) == (100, 1)
+
+    # Only the buckets of the views not rendered again are kept
+    assert root.serialize_callbacks(False) == new
+    root.register_callback('other', 4, root().action, False, None)
+    assert len(root.serialize_callbacks(False)['other']) == 1
+
+    s = serializer.Pickle()
+    root2, callbacks_ = s.loads(*s.dumps(root, False))
+    assert len(callbacks_) == 100 + 1
+    assert callbacks_[max(callbacks_)][:3] == ('other', root2().action, False)
@@ -7,13 +7,46 @@
 # this distribution.
 #--
 
+import types
 import unittest
 
 from lxml import etree as ET
 from webob import Request, Response
+from peak.rules import when
 
 from nagare.namespaces import xhtml
-from nagare import top
+from nagare import top, presentation
+
+
+class MyHeadRenderer(xhtml.HeadRenderer):
+    pass
+
+
+@presentation.render_for(MyHeadRenderer)
+def render(self, h, *args):
+    return self.head(self.meta(name='generator', content='my'))
+
+
+class MyRenderer(xhtml.Renderer):
+    head_renderer_factory = MyHeadRenderer
+
+
+class MyHeadRenderer2(xhtml.HeadRenderer):
+    pass
+
+
+@when(presentation.render, (MyHeadRenderer2, object, object, types.NoneType))
+@presentation.bypass_cache_for(MyHeadRenderer2)
+def render(self, h, *args):
+    return self.head(self.meta(name='generator', content='my2'))
+
+
+class MyRenderer2(xhtml.Renderer):
+    head_renderer_factory = MyHeadRenderer2
+
+
+def onload():
+    pass
 
 
 class TestTop(unittest.TestCase):
@@ -316,3 +349,42 @@ class TestTop(unittest.TestCase):
         h = xhtml.Renderer(request=Request({'PATH_INFO': '/foo'}), response=self.h.response)
         h.head << h.head.link(rel='canonical', href='/bar')
         self.assertEqual(top.wrap('text/html', h, h.root).write_xmlstring(), '<html><head><link href="/bar" rel="canonical"/></head><body></body></html>')
+
+    def test_assets(self):
+        h = xhtml.Renderer(request=Request({'PATH_INFO': '/foo'}), response=self.h.response)
+        h.head << h.head.title('hello')
+        h.head.css_url('/a.css')
+        h.head.javascript_url('/a.js')
+        h.head.css('b', 'p {}')
+        h.head.javascript('b', 'var b;')
+
+        head = top.wrap('text/html', h, h.root)[0]
+        self.assertEqual(
+                         [(e.tag, sorted(e.attrib.items()), e.text) for e in head],
+                         [
+                          ('title', [], 'hello'),
+                          ('link', [('href', '/a.css'), ('rel', 'stylesheet'), ('type', 'text/css')], None),
+                          ('script', [('src', '/a.js'), ('type', 'text/javascript')], None),
+                          ('style', [('type', 'text/css')], 'p {}'),
+                          ('script', [('type', 'text/javascript')], 'var b;'),
+                          ('link', [('href', '/foo'), ('rel', 'canonical')], None)
+                         ]
+                        )
+
+    def test_head_attributes(self):
+        h = xhtml.Renderer(request=Request({'PATH_INFO': ''}), response=self.h.response)
+        h.head.javascript_url('/a.js', onload=onload)
+        html = top.wrap('text/html', h, h.root).write_xmlstring()
+
+        self.assertTrue('onload="nagare_test_test_top_onload(this)"' in html, html)
+        self.assertTrue('<script src="/static/nagare/pyjslib.js" type="text/javascript"/>' in html, html)
+        self.assertTrue('function nagare_test_test_top_onload' in html, html)
+
+    def test_head_view(self):
+        h = MyRenderer(request=Request({'PATH_INFO': ''}), response=self.h.response)
+        self.assertFalse(h.head.can_fill())
+        self.assertEqual(top.wrap('text/html', h, h.root).write_xmlstring(), '<html><head><meta content="my" name="generator"/></head><body></body></html>')
+
+        h = MyRenderer2(request=Request({'PATH_INFO': ''}), response=self.h.response)
+        self.assertFalse(h.head.can_fill())
+        self.assertEqual(top.wrap('text/html', h, h.root).write_xmlstring(), '<html><head><meta content="my2" name="generator"/></head><body></body></html>')
@@ -7,8 +7,8 @@
 # this distribution.
 #--
 
-from nagare import local, wsgi
-from nagare.sessions import ExpirationError, common
+from nagare import local, wsgi, component, presentation, profiler, comet
+from nagare.sessions import ExpirationError, LockTimeoutError, common, serializer, memory_sessions
 
 local.request = local.Process()
 
@@ -54,11 +54,29 @@ class ExpiredSessionManager(common.Sessions):
     def get_lock(self, session_id):
         return Lock()
 
-    def get_state(self, request, response, use_same_state):
+    def get_state(self, request, response, use_same_state, readonly=False):
         assert self._get_ids(request) == (10, 42)
         raise ExpirationError()
 
 
+class TimeoutLock(object):
+    def acquire(self):
+        raise LockTimeoutError()
+
+    def release(self):
+        assert False
+
+
+class LockedSessionManager(common.Sessions):
+    def get_lock(self, session_id):
+        return TimeoutLock()
+
+
+class ReadOnlySessionManager(LockedSessionManager):
+    def fetch_state(self, session_id, state_id):
+        raise ExpirationError()
+
+
 class App(wsgi.WSGIApp):
     def __init__(self, session_manager=SessionManager(local.DummyLock)):
         super(App, self).__init__(lambda: None)
@@ -88,3 +106,226 @@ def test_bad_session():
     """Request - session expired"""
     r = process_request(App(session_manager=ExpiredSessionManager(local.DummyLock)))
     assert (r.status_code == 301) and r['Location'] == 'http://localhost:8080/app/'
+
+
+def test_lock_timeout():
+    """Request - session lock not acquired in time"""
+    r = process_request(App(session_manager=LockedSessionManager(local.DummyLock)))
+    assert r.status_code == 503
+
+
+class ReadOnlyApp(App):
+    def is_readonly_request(self, request):
+        return True
+
+
+def test_readonly_request():
+    """Request - a read-only request doesn't lock the session"""
+    sessions = ReadOnlySessionManager(serializer=serializer.Pickle)
+
+    r = process_request(ReadOnlyApp(session_manager=sessions))
+    assert r.status_code == 301
+
+    # A request with actions always locks the session
+    r = process_request(ReadOnlyApp(session_manager=sessions), QUERY_STRING='_s=10&_c=42&_action41234567')
+    assert r.status_code == 503
+
+    # Without snapshots of the states, the session is always locked
+    r = process_request(ReadOnlyApp(session_manager=LockedSessionManager()))
+    assert r.status_code == 503
+
+
+class Table(object):
+    pass
+
+
+@presentation.render_for(Table)
+def render(self, h, *args):
+    return h.table([h.tr(h.td(i)) for i in range(5000)])
+
+
+def test_streaming():
+    """Request - a page is sent chunk by chunk"""
+    local.worker = local.Process()
+
+    app = App(session_manager=memory_sessions.SessionsWithPickledStates())
+    app.root_factory = lambda: component.Component(Table())
+    app.streaming = True
+
+    env = create_environ()
+    env['QUERY_STRING'] = ''
+    r = Response()
+    chunks = list(app(env, r))
+
+    assert r.status_code == 200
+    assert 'Content-Length' not in r
+    assert len(chunks) > 1
+    assert ''.join(chunks).count('<tr>') == 5000
+
+
+def test_profiler():
+    """Request - the profiling middleware measures the steps of a request"""
+    local.worker = local.Process()
+
+    app = App(session_manager=memory_sessions.SessionsWithPickledStates())
+    app.root_factory = lambda: component.Component(Table())
+    app = profiler.Profiler(app)
+
+    env = create_environ()
+    env['QUERY_STRING'] = ''
+    r = Response()
+    app(env, r)
+
+    assert r.status_code == 200
+
+    profile = app.get_profiles()[-1]
+    steps = [name for (name, t) in profile.steps]
+    assert steps == ['phase1 callbacks', 'rendering', 'top wrap', 'phase2 serialization', 'state pickle', 'state store']
+    assert profile.renders.keys() == [('nagare.test.test_wsgi.Table', None)]
+    assert r['Server-Timing'].startswith('phase1-callbacks;dur=') and ('total;dur=' in r['Server-Timing'])
+
+    # Without profiling middleware, nothing is measured
+    r = process_request(PATH_INFO='')
+    assert len(app.get_profiles()) == 1
+    assert 'Server-Timing' not in r
+
+
+class Assets(object):
+    loaded = None
+    extra = False
+
+
+@presentation.render_for(Assets)
+def render(self, h, *args):
+    h.head.css('assets', 'p {}')
+    h.head.javascript_url('/assets.js')
+    if Assets.extra:
+        h.head.javascript_url('/extra.js')
+
+    Assets.loaded = getattr(h.head, 'loaded_assets', None)
+    return h.p('assets')
+
+
+class AssetsSessionManager(memory_sessions.SessionsWithPickledStates):
+    def create(self, session_id, secure_id, lock):
+        self.ids = (session_id, secure_id)
+        super(AssetsSessionManager, self).create(session_id, secure_id, lock)
+
+
+def test_loaded_assets():
+    """Request - the head assets of the page are not sent again by the XHR requests"""
+    local.worker = local.Process()
+
+    sessions = AssetsSessionManager()
+    app = App(session_manager=sessions)
+    app.root_factory = lambda: component.Component(Assets())
+
+    env = create_environ()
+    env['QUERY_STRING'] = ''
+    r = Response()
+    app(env, r)
+    assert r.status_code == 200
+
+    session_id, secure_id = sessions.ids
+    xhr = {
+           'QUERY_STRING': '_s=%d&_c=0' % session_id,
+           'HTTP_COOKIE': '%s=%s' % (sessions.security_cookie_name, secure_id),
+           'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'
+          }
+
+    r = process_request(app, xhr)
+    assert r.status_code == 200
+    assert Assets.loaded == frozenset([('css', 'assets'), ('js_url', '/assets.js')])
+
+
+class Clicks(object):
+    nb_renders = 0
+
+    def click(self):
+        pass
+
+
+@presentation.render_for(Clicks)
+def render(self, h, *args):
+    Clicks.nb_renders += 1
+    return h.a('click').action(self.click)
+
+
+def test_readonly_actions():
+    """Request - a read-only request registering actions is processed again with the session locked"""
+    local.worker = local.Process()
+
+    sessions = AssetsSessionManager()
+    app = ReadOnlyApp(session_manager=sessions)
+    app.root_factory = lambda: component.Component(Clicks())
+
+    env = create_environ()
+    env['QUERY_STRING'] = ''
+    r = Response()
+    app(env, r)
+    assert r.status_code == 200
+
+    session_id, secure_id = sessions.ids
+    get = {
+           'QUERY_STRING': '_s=%d&_c=0' % session_id,
+           'HTTP_COOKIE': '%s=%s' % (sessions.security_cookie_name, secure_id)
+          }
+
+    r = process_request(app, get)
+    assert r.status_code == 200
+    assert Clicks.nb_renders == 3
+
+    # The new state and the callbacks ids counter are stored
+    last_state_id, _, session_data, _ = sessions.fetch_state(session_id, 0)
+    assert (last_state_id, session_data[0]) == (2, 2)
+
+
+def test_readonly_assets():
+    """Request - a read-only page changing the head assets is processed again with the session locked"""
+    local.worker = local.Process()
+
+    sessions = AssetsSessionManager()
+    app = ReadOnlyApp(session_manager=sessions)
+    app.root_factory = lambda: component.Component(Assets())
+
+    Assets.extra = True
+    try:
+        env = create_environ()
+        env['QUERY_STRING'] = ''
+        r = Response()
+        app(env, r)
+        assert r.status_code == 200
+
+        session_id, secure_id = sessions.ids
+        cookie = '%s=%s' % (sessions.security_cookie_name, secure_id)
+
+        # The page is reloaded without the extra javascript
+        Assets.extra = False
+        r = process_request(app, {'QUERY_STRING': '_s=%d&_c=0' % session_id, 'HTTP_COOKIE': cookie})
+        assert r.status_code == 200
+
+        # So the extra javascript is sent again by the next XHR requests on the page state
+        Assets.extra = True
+        last_state_id = sessions.fetch_state(session_id, 0)[0]
+        xhr = {
+               'QUERY_STRING': '_s=%d&_c=%d' % (session_id, last_state_id - 1),
+               'HTTP_COOKIE': cookie,
+               'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'
+              }
+
+        r = process_request(app, xhr)
+        assert r.status_code == 200
+        assert Assets.loaded == frozenset([('css', 'assets'), ('js_url', '/assets.js')])
+    finally:
+        Assets.extra = False
+
+
+def test_comet_prefork():
+    """Request - the comet connections are refused by a prefork publisher"""
+    backend = comet.channels.backend
+    comet.channels.backend = comet.UnixSocketBackend('/tmp/comet')
+    try:
+        r = process_request(QUERY_STRING='_channel=test&_nb=0', **{'wsgi.multiprocess': True, 'wsgi.multithread': False})
+        assert r.status_code == 501
+    finally:
+        comet.channels.backend = backend
@@ -79,14 +79,21 @@ def wrap(content_type, h, content):
         # No ``<html>`` found, add it
         content = h.html(content)
 
-    head1 = presentation.render(h.head, None, None, None)  # The automatically generated ``<head>``
-
     url = h.request.upath_info.strip('/')
-    if url and not head1.xpath('./link[@rel="canonical"]'):
-        head1.append(h.head.link(rel='canonical', href=h.request.uscript_name + '/' + url))
+    canonical_url = (h.request.uscript_name + '/' + url) if url else None
+
+    can_fill = getattr(h.head, 'can_fill', None)
+    if (can_fill is not None) and can_fill():
+        # The head renderer directly fills the ``<head>``
+        h.head.fill(head, canonical_url)
+    else:
+        head1 = presentation.render(h.head, None, None, None)  # The automatically generated ``<head>``
+
+        if canonical_url and not head1.xpath('./link[@rel="canonical"]'):
+            head1.append(h.head.link(rel='canonical', href=canonical_url))
 
-    # Merge the attributes and child of the automatically generated ``<head>``
-    head.attrib.update(head1.attrib.items())
-    head.add_child(head1[:])
+        # Merge the attributes and child of the automatically generated ``<head>``
+        head.attrib.update(head1.attrib.items())
+        head.add_child(head1[:])
 
     return content
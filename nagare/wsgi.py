@@ -22,13 +22,13 @@ import os
 import webob
 from webob import exc, acceptparse
 
-from nagare import component, presentation, serializer, database, top, security, log, comet, i18n, local
+from nagare import component, presentation, serializer, database, top, security, log, comet, i18n, local, profiler
 from nagare.security import dummy_manager
 from nagare.callbacks import CallbackLookupError
-from nagare.callbacks import process as process_callbacks
+from nagare.callbacks import process as process_callbacks, has_actions
 from nagare.namespaces import xhtml
 
-from nagare.sessions import ExpirationError, SessionSecurityError
+from nagare.sessions import ExpirationError, SessionSecurityError, LockTimeoutError, ReadOnlyStateError
 
 
 # ---------------------------------------------------------------------------
@@ -66,6 +66,7 @@ class WSGIApp(object):
         self.project_name = ''
         self.redirect_after_post = False
         self.always_html = True
+        self.streaming = False
         self.sessions = None
         self.last_exception = None
 
@@ -84,6 +85,7 @@ class WSGIApp(object):
         self.name = config['application']['name']
         self.redirect_after_post = config['application']['redirect_after_post']
         self.always_html = config['application']['always_html']
+        self.streaming = config['application']['streaming']
 
     def set_static_path(self, static_path):
         """Register the directory of the static contents
@@ -218,6 +220,18 @@ class WSGIApp(object):
         """
         raise exc.HTTPMovedPermanently()
 
+    def on_lock_timeout(self, request, response):
+        """The lock of the session can't be acquired in time or was lost
+
+        In:
+          - ``request`` -- the web request object
+          - ``response`` -- the web response object
+
+        Return:
+          - raise a ``webob.exc`` object, used to generate the response to the browser
+        """
+        raise exc.HTTPServiceUnavailable()
+
     def on_back(self, request, response, h, output):
         """The user used the back button
 
@@ -333,8 +347,29 @@ class WSGIApp(object):
                                                 async_header=True
                                              )
 
+            # The head assets already loaded by the browser are not sent again
+            renderer.head.loaded_assets = session.loaded_assets or frozenset()
+
         return renderer
 
+    def is_readonly_request(self, request):
+        """Can the request be rendered from a snapshot of its state, without locking the session?
+
+        Only asked for the GET requests without actions on an existing state.
+        A read-only request is rendered from an unpickled copy of its state,
+        without holding the session lock, and the state is not stored. So the
+        rendered views must be free of side effects on the objects graph. A
+        rendering registering actions or changing the head assets loaded by
+        the browser is redone with the session locked
+
+        In:
+          - ``request`` -- the web request object
+
+        Return:
+          - a boolean (``False`` by default)
+        """
+        return False
+
     def start_request(self, root, request, response):
         """A new request is received, setup its dedicated environment
 
@@ -384,7 +419,12 @@ class WSGIApp(object):
         Out:
           - ``response`` -- the response object
         """
-        (response.content_type, response.body) = serializer.serialize(output, content_type, doctype, not is_xhr)
+        if self.streaming and not is_xhr:
+            # The content is generated chunk by chunk, when the response is sent
+            (response.content_type, response.app_iter) = serializer.stream(output, content_type, doctype, True)
+        else:
+            (response.content_type, response.body) = serializer.serialize(output, content_type, doctype, not is_xhr)
+
         response.charset = 'utf-8'
 
     def __call__(self, environ, start_response):
@@ -398,6 +438,7 @@ class WSGIApp(object):
           - the content to send back to the browser
         """
         local.request.clear()
+        local.request.profile = environ.get('nagare.profile')  # Set by the profiling middleware
 
         # Create the ``WebOb`` request and response objects
         # -------------------------------------------------
@@ -413,22 +454,30 @@ class WSGIApp(object):
         channel_id = request.params.get('_channel')
         nb = request.params.get('_nb')
         if channel_id and nb:
-            if environ['wsgi.multiprocess']:
+            # A multi-processes publisher needs a backend sending the messages
+            # to all the processes and, as a waiting client holds its worker,
+            # several workers by process
+            if environ['wsgi.multiprocess'] and not (comet.channels.multiprocess and environ.get('wsgi.multithread')):
                 response.status = 501  # "Not Implemented"
             else:
-                comet.channels.connect(channel_id, int(nb), environ['wsgi.input'].file.fileno(), response)
+                # The socket of the browser (``rfile`` with the eventlet publisher)
+                input = environ['wsgi.input']
+                f = getattr(input, 'file', None) or input.rfile
+
+                comet.channels.connect(channel_id, int(nb), f.fileno(), response)
 
             return response(environ, start_response)
 
         xhr_request = request.is_xhr or ('_a' in request.params)
 
         state = None
+        redo = False
         self.last_exception = None
 
         log.set_logger('nagare.application.' + self.name)  # Set the dedicated application logger
 
-        # Create a database transaction for each request
-        with database.session.begin():
+        # Create a database transaction for each request, when the database is used
+        with database.transactions:
             try:
                 # Phase 1
                 # -------
@@ -437,14 +486,23 @@ class WSGIApp(object):
                 if not request.path_info:
                     self.on_incomplete_url(request, response)
 
+                readonly = (
+                            environ.get('nagare.readonly', True) and
+                            (request.method == 'GET') and not has_actions(request.params) and
+                            self.is_readonly_request(request)
+                           )
+
                 try:
-                    state = self.sessions.get_state(request, response, xhr_request)
+                    state = self.sessions.get_state(request, response, xhr_request, readonly)
                 except ExpirationError:
                     self.on_expired_session(request, response)
                 except SessionSecurityError:
                     self.on_invalid_session(request, response)
 
-                state.acquire()
+                try:
+                    state.acquire()
+                except LockTimeoutError:
+                    self.on_lock_timeout(request, response)
 
                 try:
                     root, callbacks = state.get_root() or (self.create_root(), None)
@@ -467,7 +525,8 @@ class WSGIApp(object):
                         presentation.init(root, tuple(url.split('/')), None, request.method, request)
 
                 try:
-                    render = self._phase1(root, request, response, callbacks)
+                    with profiler.timer('phase1 callbacks'):
+                        render = self._phase1(root, request, response, callbacks)
                 except CallbackLookupError:
                     render = self.on_callback_lookuperror(request, response, xhr_request)
             except exc.HTTPException, response:
@@ -497,24 +556,36 @@ class WSGIApp(object):
                         renderer = self.create_renderer(xhr_request, state, request, response)
                         # If the phase 1 has returned a render function, use it
                         # else, start the rendering by the application root component
-                        output = render(renderer) if render else root.render(renderer)
+                        with profiler.timer('rendering'):
+                            output = render(renderer) if render else root.render(renderer)
 
                         if state.back_used:
                             output = self.on_back(request, response, renderer, output)
 
                         if not xhr_request:
-                            output = top.wrap(renderer.content_type, renderer, output)
+                            with profiler.timer('top wrap'):
+                                output = top.wrap(renderer.content_type, renderer, output)
 
-                        self._phase2(output, renderer.content_type, renderer.doctype, xhr_request, response)
+                        with profiler.timer('phase2 serialization'):
+                            self._phase2(output, renderer.content_type, renderer.doctype, xhr_request, response)
+
+                        # A full page replaces all the head assets of the browser
+                        state.add_assets(renderer.head.get_assets_ids(), not xhr_request)
 
                     # Store the state
-                    state.set_root(use_same_state, root)
+                    try:
+                        state.set_root(use_same_state, root)
+                    except LockTimeoutError:
+                        self.on_lock_timeout(request, response)
 
                     security.get_manager().end_rendering(request, response, state)
                 except exc.HTTPException, response:
                     # When a ``webob.exc`` object is raised during phase 2, stop immediately
                     # use it as the response object
                     pass
+                except ReadOnlyStateError:
+                    # The read-only rendering has registered actions
+                    redo = True
                 except Exception:
                     self.last_exception = (request,  sys.exc_info())
                     response = self.on_exception(request, response)
@@ -522,6 +593,14 @@ class WSGIApp(object):
                 if state:
                     state.release()
 
+                    # Time the session was locked, for the profiling middlewares
+                    environ['nagare.lock_hold_time'] = state.lock_hold_time
+
+        if redo:
+            # Process the request again, with the session locked
+            environ['nagare.readonly'] = False
+            return self(environ, start_response)
+
         return response(environ, start_response)
 
 # ---------------------------------------------------------------------------
@@ -25,8 +25,8 @@ except ImportError:
     print "Warning: you are installing Nagare on CPython instead of Stackless Python (http://www.stackless.com) or PyPy (http://pypy.org)."
     print "         Without 'continuation', the 'Component.call()' method will not be available."
 
-if sys.version_info < (2, 5, 2):
-    print 'The version of Python must be 2.5.2 or more'
+if sys.version_info < (2, 6):
+    print 'The version of Python must be 2.6 or more'
     sys.exit(-2)
 
 # -----------------------------------------------------------------------------
@@ -68,7 +68,7 @@ setup(
       namespace_packages=('nagare',),
       zip_safe=False,
       dependency_links=('http://www.nagare.org/download/',),
-      install_requires=('PEAK-Rules', 'ConfigObj', 'lxml>=3.0.1', 'WebOb>=1.2.3', 'Paste', 'flup', 'python-memcached'),
+      install_requires=('PEAK-Rules', 'ConfigObj', 'lxml>=3.4', 'WebOb>=1.2.3', 'Paste', 'flup', 'python-memcached'),
       message_extractors={'nagare': [
           ('test/**', 'ignore', None),
           ('**.py', 'python', None),
@@ -119,6 +119,8 @@ setup(
       standalone = nagare.sessions.memory_sessions:SessionsWithPickledStates
       pickle = nagare.sessions.memory_sessions:SessionsWithPickledStates
       memcache = nagare.sessions.memcached_sessions:Sessions
+      file = nagare.sessions.file_sessions:Sessions
+      shared = nagare.sessions.shared_sessions:Sessions
 
       [nagare.applications]
       admin = nagare.admin.admin_app:app
@@ -126,6 +128,7 @@ setup(
       [nagare.admin]
       info = nagare.admin.interface.info:Admin
       apps = nagare.admin.interface.applications:Admin
+      profiler = nagare.admin.interface.profiler:Admin
       ''',
       classifiers=(
         'Development Status :: 4 - Beta',
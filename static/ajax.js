@@ -13,7 +13,7 @@
 var nagare_callbacks = {
     cache : false,
 
-    success : function (o) { setTimeout(o.responseText, 0); },
+    success : function (o) { nagare_evalResponse(o.responseText); },
     failure : function (o) {
                             var url = o.status ? o.getResponseHeader["X-Debug-URL"] : undefined;
                             if(url) {
@@ -28,7 +28,7 @@ var nagare_callbacks = {
                                 var js_fragments = o.responseXML.lastChild.lastChild.firstChild;
                                 for(var i=0; i<js_fragments.childNodes.length; i++)
                                     js += js_fragments.childNodes[i].data;
-                                setTimeout(js, 0);
+                                nagare_evalResponse(js);
                             } else {
                                 alert("XHR Error");
                             }
@@ -65,6 +65,27 @@ function nagare_imageInputSubmit(event, button, action) {
 // ----------------------------------------------------------------------------
 // Responses
 
+function nagare_evalResponse(text) {
+    if(text.charAt(0) != "{") {
+        // Javascript response
+        setTimeout(text, 0);
+        return;
+    }
+
+    // JSON response: list of the DOM elements to update and assets to load
+    var response = window.JSON ? JSON.parse(text) : eval("(" + text + ")");
+
+    setTimeout(function () {
+        for(var i=0; i<response.updates.length; i++) {
+            var update = response.updates[i];
+            window[update.js](update.id, update.html);
+        }
+
+        var head = response.head;
+        nagare_loadAll(head.named_css, head.css, head.css_urls, head.named_js, head.js, head.js_urls);
+    }, 0);
+}
+
 var nagare_loaded_named_css = {};
 var nagare_loaded_named_js = {};
 